@@ -0,0 +1,3 @@
+"""
+Backend Tcha-llé
+"""
@@ -0,0 +1,348 @@
+"""
+Tuiles vectorielles (Mapbox Vector Tiles) des activités, avec regroupement
+
+Une tuile (z, x, y) est produite par ST_AsMVT directement depuis `activities`,
+avec les seuls attributs utiles à l'affichage d'un marqueur. Jusqu'au niveau
+CLUSTER_MAX_ZOOM, les activités sont regroupées sur une grille de
+CLUSTER_CELLS x CLUSTER_CELLS cases par tuile: couche `clusters` (nombre
+d'activités, dont ouvertes) et couche `activities` pour les cases à une seule
+activité. Les cases sont alignées sur les tuiles: un groupe n'est jamais coupé
+entre deux tuiles, et une activité ne modifie que la tuile qui la contient.
+
+Les tuiles sont gardées dans un cache disque borné (les moins récemment lues
+sont supprimées). Le flux de changements invalide seulement les tuiles de
+l'ancienne et de la nouvelle position d'une activité modifiée. Chaque
+invalidation avance la génération de la tuile: une tuile calculée avant une
+invalidation arrivée pendant son rendu n'est pas écrite dans le cache.
+"""
+import logging
+import math
+import os
+import threading
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+MAX_ZOOM = 22
+# Au-delà, chaque activité est un point
+CLUSTER_MAX_ZOOM = 14
+CLUSTER_CELLS = 16
+EXTENT = 4096
+# Marge (unités de tuile) des points proches du bord, dessinés dans les deux tuiles
+BUFFER = 64
+# Niveaux mis en cache (les plus fins sont rarement partagés)
+MAX_CACHED_ZOOM = 18
+
+CACHE_DIR = os.getenv("ACTIVITY_TILE_CACHE_DIR",
+                      os.path.join(os.path.dirname(__file__), "..", "cache", "activity_tiles"))
+CACHE_MAX_BYTES = int(os.getenv("ACTIVITY_TILE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Part du plafond écrite entre deux balayages du répertoire
+SWEEP_FRACTION = 0.1
+# Tuiles invalidées suivies; au-delà, l'époque avance (rendus en cours abandonnés)
+MAX_TRACKED_GENERATIONS = 100000
+
+# Colonnes dont la modification change une tuile
+TILE_COLUMNS = ('location', 'is_active', 'is_open', 'is_verified', 'name', 'activity_type_id', 'rating')
+
+WORLD_SIZE = 2 * math.pi * 6378137
+WORLD_ORIGIN = -WORLD_SIZE / 2
+
+_MARKER_COLUMNS = """
+    a.id, a.name, a.activity_type_id, a.is_open, a.is_verified, ROUND(COALESCE(a.rating, 0), 1)::FLOAT AS rating
+"""
+
+POINTS_TILE_SQL = f"""
+WITH tile AS (
+    SELECT ST_TileEnvelope(:z, :x, :y) AS envelope,
+           ST_Transform(ST_TileEnvelope(:z, :x, :y, margin => {BUFFER / EXTENT}), 4326) AS area
+)
+SELECT ST_AsMVT(features, 'activities', {EXTENT}, 'geom', 'id')
+FROM (
+    SELECT ST_AsMVTGeom(ST_Transform(a.location, 3857), tile.envelope, {EXTENT}, {BUFFER}, TRUE) AS geom,
+           {_MARKER_COLUMNS}
+    FROM activities a, tile
+    WHERE a.is_active = TRUE AND a.location && tile.area
+) features
+WHERE geom IS NOT NULL
+"""
+
+# Cases de la grille: le point de calage est le centre des cases (ST_SnapToGrid arrondit),
+# leurs bords tombent sur ceux des tuiles
+CLUSTERS_TILE_SQL = f"""
+WITH tile AS (
+    SELECT ST_TileEnvelope(:z, :x, :y) AS envelope, ST_Transform(ST_TileEnvelope(:z, :x, :y), 4326) AS area
+),
+points AS (
+    SELECT ST_Transform(a.location, 3857) AS geom, {_MARKER_COLUMNS}
+    FROM activities a, tile
+    WHERE a.is_active = TRUE AND a.location && tile.area
+),
+inside AS (
+    -- Bord droit et bas exclus: un point sur une limite appartient à une seule tuile
+    SELECT p.* FROM points p, tile
+    WHERE ST_X(p.geom) >= ST_XMin(tile.envelope) AND ST_X(p.geom) < ST_XMax(tile.envelope)
+      AND ST_Y(p.geom) > ST_YMin(tile.envelope) AND ST_Y(p.geom) <= ST_YMax(tile.envelope)
+),
+cells AS (
+    SELECT COUNT(*) AS point_count, COUNT(*) FILTER (WHERE is_open) AS open_count,
+           ST_Centroid(ST_Collect(geom)) AS center, MIN(id) AS id
+    FROM inside
+    GROUP BY ST_SnapToGrid(geom, :origin, :origin, :cell, :cell)
+)
+SELECT
+    COALESCE((
+        SELECT ST_AsMVT(singles, 'activities', {EXTENT}, 'geom', 'id')
+        FROM (
+            SELECT ST_AsMVTGeom(p.geom, tile.envelope, {EXTENT}, {BUFFER}, TRUE) AS geom,
+                   p.id, p.name, p.activity_type_id, p.is_open, p.is_verified, p.rating
+            FROM cells c JOIN inside p ON p.id = c.id, tile
+            WHERE c.point_count = 1
+        ) singles
+    ), ''::BYTEA)
+    || COALESCE((
+        SELECT ST_AsMVT(groups, 'clusters', {EXTENT}, 'geom')
+        FROM (
+            SELECT ST_AsMVTGeom(c.center, tile.envelope, {EXTENT}, {BUFFER}, TRUE) AS geom,
+                   c.point_count, c.open_count
+            FROM cells c, tile
+            WHERE c.point_count > 1
+        ) groups
+    ), ''::BYTEA)
+"""
+
+POSITIONS_SQL = """
+SELECT id, ST_X(location) AS longitude, ST_Y(location) AS latitude FROM activities
+WHERE is_active = TRUE AND location IS NOT NULL
+"""
+
+POSITION_SQL = """
+SELECT ST_X(location) AS longitude, ST_Y(location) AS latitude FROM activities
+WHERE id = :id AND is_active = TRUE AND location IS NOT NULL
+"""
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def mercator(longitude: float, latitude: float) -> Tuple[float, float]:
+    """Coordonnées (x, y) en pixels-monde de 0 à 1, y vers le bas"""
+    latitude = max(-85.05112878, min(85.05112878, latitude))
+    sin_latitude = math.sin(math.radians(latitude))
+    return ((longitude + 180) / 360,
+            0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi))
+
+
+def tiles_containing(longitude: float, latitude: float, max_zoom: int = MAX_CACHED_ZOOM) -> Set[Tuple[int, int, int]]:
+    """Tuiles dont le contenu dépend d'une activité à cette position
+
+    Regroupement: la seule tuile qui contient le point. Points: aussi les
+    voisines dont la marge le recouvre.
+    """
+    world_x, world_y = mercator(longitude, latitude)
+    tiles = set()
+    for z in range(max_zoom + 1):
+        scale = 2 ** z
+        tile_x, tile_y = min(int(world_x * scale), scale - 1), min(int(world_y * scale), scale - 1)
+        tiles.add((z, tile_x, tile_y))
+        if z <= CLUSTER_MAX_ZOOM:
+            continue
+        margin = BUFFER / EXTENT
+        offset_x, offset_y = world_x * scale - tile_x, world_y * scale - tile_y
+        neighbours_x = [0] + ([-1] if offset_x < margin else []) + ([1] if offset_x > 1 - margin else [])
+        neighbours_y = [0] + ([-1] if offset_y < margin else []) + ([1] if offset_y > 1 - margin else [])
+        for dx in neighbours_x:
+            for dy in neighbours_y:
+                if 0 <= tile_x + dx < scale and 0 <= tile_y + dy < scale:
+                    tiles.add((z, tile_x + dx, tile_y + dy))
+    return tiles
+
+
+def render(db, z: int, x: int, y: int) -> bytes:
+    """Tuile MVT calculée par PostGIS"""
+    if z > CLUSTER_MAX_ZOOM:
+        result = db.execute(text(POINTS_TILE_SQL), {"z": z, "x": x, "y": y}).scalar()
+    else:
+        cell = WORLD_SIZE / 2 ** z / CLUSTER_CELLS
+        result = db.execute(text(CLUSTERS_TILE_SQL), {
+            "z": z, "x": x, "y": y, "cell": cell, "origin": WORLD_ORIGIN + cell / 2,
+        }).scalar()
+    return bytes(result or b"")
+
+
+class TileCache:
+    """Cache disque borné: un fichier par tuile, les moins récemment lues supprimées"""
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+        # Génération de chaque tuile invalidée, et époque (vidage complet)
+        self._generations: Dict[Tuple[int, int, int], int] = {}
+        self._epoch = 0
+        self.stats = {"hits": 0, "misses": 0, "invalidated": 0, "evicted": 0, "discarded": 0}
+
+    def path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self.directory, str(z), str(x), f"{y}.mvt")
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        path = self.path(z, x, y)
+        try:
+            with open(path, "rb") as handle:
+                data = handle.read()
+            # Date de dernière lecture: ordre de suppression
+            os.utime(path)
+        except OSError:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return data
+
+    def generation(self, z: int, x: int, y: int) -> Tuple[int, int]:
+        """Jeton à relever avant le rendu et à passer à `put`"""
+        with self._lock:
+            return self._epoch, self._generations.get((z, x, y), 0)
+
+    def _advance(self, tile: Tuple[int, int, int]) -> None:
+        # Appelé sous le verrou
+        if len(self._generations) >= MAX_TRACKED_GENERATIONS:
+            self._generations = {}
+            self._epoch += 1
+        self._generations[tile] = self._generations.get(tile, 0) + 1
+
+    def put(self, z: int, x: int, y: int, data: bytes, generation: Optional[Tuple[int, int]] = None) -> bool:
+        """Écrit la tuile, sauf si elle a été invalidée depuis le jeton `generation`"""
+        path = self.path(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Écriture atomique: un autre worker ne lit jamais un fichier partiel
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as handle:
+            handle.write(data)
+        with self._lock:
+            # Vérification et remplacement sous le verrou: une invalidation passe avant ou après
+            if generation is not None and generation != (self._epoch, self._generations.get((z, x, y), 0)):
+                os.remove(temporary_path)
+                self.stats["discarded"] += 1
+                return False
+            os.replace(temporary_path, path)
+            self._written += len(data)
+            sweep = self._written >= self.max_bytes * SWEEP_FRACTION
+            if sweep:
+                self._written = 0
+        if sweep:
+            self.sweep()
+        return True
+
+    def invalidate(self, tiles: Iterable[Tuple[int, int, int]]) -> None:
+        for z, x, y in tiles:
+            with self._lock:
+                self._advance((z, x, y))
+            try:
+                os.remove(self.path(z, x, y))
+                self.stats["invalidated"] += 1
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generations = {}
+            self._epoch += 1
+        for entry in self._files():
+            try:
+                os.remove(entry[2])
+            except OSError:
+                pass
+
+    def sweep(self) -> None:
+        """Ramène le cache sous son plafond (répertoire partagé par les workers)"""
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.stats["evicted"] += 1
+            except OSError:
+                pass
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".mvt"):
+                    path = os.path.join(root, name)
+                    try:
+                        status = os.stat(path)
+                    except OSError:
+                        continue
+                    yield status.st_mtime, status.st_size, path
+
+
+class ActivityTiles:
+    """Tuiles servies depuis le cache, invalidées par le flux de changements"""
+
+    def __init__(self, cache: Optional[TileCache] = None):
+        self.cache = cache or TileCache()
+        # Dernière position connue: une activité déplacée ou supprimée invalide aussi son ancienne tuile
+        self._positions: Dict[int, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def tile(self, db, z: int, x: int, y: int) -> bytes:
+        if z > MAX_CACHED_ZOOM:
+            return render(db, z, x, y)
+        data = self.cache.get(z, x, y)
+        if data is None:
+            generation = self.cache.generation(z, x, y)
+            data = render(db, z, x, y)
+            # Tuile invalidée pendant le rendu: servie à ce client, pas mise en cache
+            self.cache.put(z, x, y, data, generation)
+        return data
+
+    def load_positions(self, db) -> None:
+        positions = {row.id: (row.longitude, row.latitude) for row in db.execute(text(POSITIONS_SQL))}
+        with self._lock:
+            self._positions = positions
+
+    def activity_changed(self, db, activity_id: int) -> None:
+        """Invalide les tuiles de l'ancienne et de la nouvelle position"""
+        row = db.execute(text(POSITION_SQL), {"id": activity_id}).first()
+        with self._lock:
+            previous = self._positions.pop(activity_id, None)
+            if row is not None:
+                self._positions[activity_id] = (row.longitude, row.latitude)
+        tiles = set()
+        for position in (previous, (row.longitude, row.latitude) if row is not None else None):
+            if position is not None:
+                tiles |= tiles_containing(*position)
+        self.cache.invalidate(tiles)
+
+    def register_change_feed(self, feed=None, session_factory=None) -> None:
+        """Invalide les tuiles concernées par chaque modification d'activité"""
+        if feed is None:
+            from .change_feed import change_feed as feed
+        if session_factory is None:
+            from .new_models import SessionLocal as session_factory
+
+        with session_factory() as db:
+            self.load_positions(db)
+
+        def on_change(event) -> None:
+            if event.is_reset:
+                # Une reconnexion peut avoir masqué des modifications
+                self.cache.clear()
+                with session_factory() as db:
+                    self.load_positions(db)
+                return
+            if event.id is None or not event.touches(*TILE_COLUMNS):
+                return
+            with session_factory() as db:
+                self.activity_changed(db, event.id)
+
+        feed.register("activities", on_change)
+
+
+activity_tiles = ActivityTiles()
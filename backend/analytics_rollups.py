@@ -0,0 +1,414 @@
+"""
+Agrégats horaires des recherches pour les tableaux de bord et les insights
+
+Par heure, zone, intention et type d'activité (celui du premier résultat):
+volume de recherches, recherches sans résultat, histogramme des temps de
+réponse (p95), requêtes les plus fréquentes et clics attribués (clic, appel
+ou itinéraire de la même session dans les 30 minutes qui suivent).
+
+Chaque passage agrège la fenêtre (filigrane, NOW() - délai de sécurité] de
+search_logs et user_interactions et avance le filigrane dans la même
+transaction: après un arrêt, la fenêtre est simplement rejouée, chaque ligne
+est comptée une fois. Le filigrane porte sur created_at, pas sur l'identifiant:
+les identifiants de search_logs sont réservés par blocs et ne suivent pas
+l'ordre d'écriture. Tous les compteurs sont additifs (le p95 vient de
+l'histogramme), un tableau de bord somme quelques centaines de lignes au lieu
+de parcourir les logs. Un résumé quotidien est publié dans `insights`.
+"""
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Bornes (ms) de l'histogramme des temps de réponse: len + 1 classes
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+CLICK_TYPES = ('click', 'call', 'direction')
+ATTRIBUTION_WINDOW_MINUTES = 30
+TOP_QUERIES = 10
+MAX_QUERY_LENGTH = 200
+
+UPDATE_INTERVAL_SECONDS = 60
+# Les lignes plus récentes attendent le passage suivant (transactions encore ouvertes)
+SAFETY_LAG_SECONDS = 60
+# Fenêtre maximale d'un passage (rattrapage par fenêtres successives)
+MAX_WINDOW = timedelta(hours=6)
+WATERMARK_NAME = 'search_rollups'
+
+QUERY_RETENTION_DAYS = 90
+INSIGHT_RETENTION_DAYS = 90
+# Alerte: zones et intentions dont trop de recherches restent sans résultat
+ZERO_RESULT_ALERT_RATE = 0.3
+ZERO_RESULT_ALERT_MIN_SEARCHES = 50
+
+_CLICK_TYPES_SQL = ", ".join(f"'{name}'" for name in CLICK_TYPES)
+_HISTOGRAM_SQL = "ARRAY[{}]".format(", ".join(
+    f"COUNT(*) FILTER (WHERE width_bucket(search_time_ms, ARRAY{list(LATENCY_BUCKETS_MS)}) = {bucket})"
+    for bucket in range(len(LATENCY_BUCKETS_MS) + 1)
+))
+_EMPTY_HISTOGRAM_SQL = f"array_fill(0, ARRAY[{len(LATENCY_BUCKETS_MS) + 1}])"
+
+# Dimensions d'une recherche: zone nommée dans la requête, sinon zone de la position
+SEARCHES_SQL = """
+SELECT sl.id, sl.created_at, sl.search_time_ms, sl.results_count,
+       left(COALESCE(NULLIF(sl.processed_query, ''), sl.query), {max_query_length}) AS query,
+       date_trunc('hour', sl.created_at, 'UTC') AS hour,
+       COALESCE((sl.entities->'zone_ids'->>0)::INT, located.zone_id, 0) AS zone_id,
+       COALESCE(sl.intent, 'unknown') AS intent,
+       COALESCE(top.activity_type_id, 0) AS activity_type_id
+FROM search_logs sl
+LEFT JOIN LATERAL (
+    SELECT z.id AS zone_id FROM zones z
+    WHERE sl.user_location IS NOT NULL AND ST_Contains(z.geometry, sl.user_location)
+    LIMIT 1
+) located ON TRUE
+LEFT JOIN activities top ON top.id = sl.results_ids[1]
+WHERE {{condition}}
+""".format(max_query_length=MAX_QUERY_LENGTH)
+
+_WINDOW_SEARCHES_SQL = SEARCHES_SQL.format(condition="sl.created_at > :from_time AND sl.created_at <= :to_time")
+_ATTRIBUTED_SEARCHES_SQL = SEARCHES_SQL.format(
+    condition="(sl.id, sl.created_at) IN (SELECT search_id, searched_at FROM attributed)")
+
+ROLLUP_SEARCHES_SQL = f"""
+WITH searches AS ({_WINDOW_SEARCHES_SQL})
+INSERT INTO search_rollups_hourly AS r
+    (hour, zone_id, intent, activity_type_id, searches, zero_results, search_time_sum, search_time_histogram)
+SELECT hour, zone_id, intent, activity_type_id, COUNT(*), COUNT(*) FILTER (WHERE results_count = 0),
+       COALESCE(SUM(search_time_ms), 0), {_HISTOGRAM_SQL}
+FROM searches
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (hour, zone_id, intent, activity_type_id) DO UPDATE SET
+    searches = r.searches + EXCLUDED.searches,
+    zero_results = r.zero_results + EXCLUDED.zero_results,
+    search_time_sum = r.search_time_sum + EXCLUDED.search_time_sum,
+    search_time_histogram = ARRAY(
+        SELECT a + b FROM unnest(r.search_time_histogram, EXCLUDED.search_time_histogram)
+            WITH ORDINALITY AS h(a, b, i) ORDER BY i
+    )
+"""
+
+ROLLUP_QUERIES_SQL = f"""
+WITH searches AS ({_WINDOW_SEARCHES_SQL})
+INSERT INTO search_query_rollups_hourly AS q (hour, zone_id, intent, activity_type_id, query, searches)
+SELECT hour, zone_id, intent, activity_type_id, query, COUNT(*)
+FROM searches
+WHERE query <> ''
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (hour, zone_id, intent, activity_type_id, query) DO UPDATE SET
+    searches = q.searches + EXCLUDED.searches
+"""
+
+# Un clic est attribué à la dernière recherche du même visiteur qui le précède;
+# il ouvre la recherche (clicked_searches) si aucun clic ne l'a précédé depuis
+ROLLUP_CLICKS_SQL = f"""
+WITH attributed AS (
+    SELECT ui.id AS interaction_id, ui.created_at, s.id AS search_id, s.created_at AS searched_at,
+           NOT EXISTS (
+               SELECT 1 FROM user_interactions p
+               WHERE ((ui.session_id IS NOT NULL AND p.session_id = ui.session_id)
+                      OR (ui.user_id IS NOT NULL AND p.user_id = ui.user_id))
+                 AND p.interaction_type IN ({_CLICK_TYPES_SQL})
+                 AND p.created_at >= s.created_at
+                 AND (p.created_at < ui.created_at OR (p.created_at = ui.created_at AND p.id < ui.id))
+           ) AS opens_search
+    FROM user_interactions ui
+    CROSS JOIN LATERAL (
+        SELECT sl.id, sl.created_at FROM search_logs sl
+        WHERE ((ui.session_id IS NOT NULL AND sl.session_id = ui.session_id)
+               OR (ui.user_id IS NOT NULL AND sl.user_id = ui.user_id))
+          AND sl.created_at BETWEEN ui.created_at - make_interval(mins => {ATTRIBUTION_WINDOW_MINUTES}) AND ui.created_at
+        ORDER BY sl.created_at DESC
+        LIMIT 1
+    ) s
+    WHERE ui.created_at > :from_time AND ui.created_at <= :to_time
+      AND ui.interaction_type IN ({_CLICK_TYPES_SQL})
+      AND (ui.session_id IS NOT NULL OR ui.user_id IS NOT NULL)
+),
+searches AS ({_ATTRIBUTED_SEARCHES_SQL})
+INSERT INTO search_rollups_hourly AS r
+    (hour, zone_id, intent, activity_type_id, searches, zero_results, search_time_sum, search_time_histogram,
+     clicks, clicked_searches)
+SELECT s.hour, s.zone_id, s.intent, s.activity_type_id, 0, 0, 0, {_EMPTY_HISTOGRAM_SQL},
+       COUNT(*), COUNT(*) FILTER (WHERE a.opens_search)
+FROM attributed a
+JOIN searches s ON s.id = a.search_id AND s.created_at = a.searched_at
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (hour, zone_id, intent, activity_type_id) DO UPDATE SET
+    clicks = r.clicks + EXCLUDED.clicks,
+    clicked_searches = r.clicked_searches + EXCLUDED.clicked_searches
+"""
+
+# Premier filigrane: juste avant la plus ancienne recherche
+WATERMARK_SQL = """
+INSERT INTO rollup_watermarks (name, processed_until)
+SELECT :name, COALESCE((SELECT MIN(created_at) FROM search_logs) - INTERVAL '1 microsecond', NOW())
+ON CONFLICT (name) DO NOTHING
+"""
+
+LOCK_WATERMARK_SQL = "SELECT processed_until FROM rollup_watermarks WHERE name = :name FOR UPDATE"
+
+TOTALS_SQL = """
+SELECT hour, SUM(searches) AS searches, SUM(zero_results) AS zero_results, SUM(search_time_sum) AS search_time_sum,
+       SUM(clicks) AS clicks, SUM(clicked_searches) AS clicked_searches
+FROM search_rollups_hourly
+WHERE {where}
+GROUP BY hour
+ORDER BY hour
+"""
+
+HISTOGRAM_SQL = """
+SELECT r.hour, h.i AS bucket, SUM(h.bucket_count) AS count
+FROM search_rollups_hourly r
+CROSS JOIN LATERAL unnest(r.search_time_histogram) WITH ORDINALITY AS h(bucket_count, i)
+WHERE {where}
+GROUP BY r.hour, h.i
+"""
+
+TOP_QUERIES_SQL = """
+SELECT query, SUM(searches) AS searches
+FROM search_query_rollups_hourly
+WHERE {where}
+GROUP BY query
+ORDER BY searches DESC
+LIMIT :limit
+"""
+
+ZERO_RESULT_GROUPS_SQL = """
+SELECT zone_id, intent, SUM(searches) AS searches, SUM(zero_results) AS zero_results
+FROM search_rollups_hourly
+WHERE hour >= :since AND hour < :until
+GROUP BY zone_id, intent
+HAVING SUM(searches) >= :min_searches AND SUM(zero_results) >= :rate * SUM(searches)
+ORDER BY SUM(zero_results) DESC
+"""
+
+INSIGHT_EXISTS_SQL = """
+SELECT 1 FROM insights WHERE filters_applied->>'rollup' = 'daily' AND filters_applied->>'day' = :day
+"""
+
+INSERT_INSIGHT_SQL = """
+INSERT INTO insights (title, description, insight_type, data, source_tables, filters_applied,
+                      target_audience, expires_at)
+VALUES (:title, :description, :insight_type, CAST(:data AS JSONB), :source_tables, CAST(:filters AS JSONB),
+        'admins', :expires_at)
+"""
+
+
+def percentile(histogram: Sequence[int], fraction: float) -> Optional[float]:
+    """Percentile estimé (ms) par interpolation linéaire dans la classe qui le contient"""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = fraction * total
+    cumulative = 0
+    for bucket, count in enumerate(histogram):
+        if count and cumulative + count >= rank:
+            lower = LATENCY_BUCKETS_MS[bucket - 1] if bucket > 0 else 0
+            # Dernière classe ouverte: sa borne inférieure
+            if bucket >= len(LATENCY_BUCKETS_MS):
+                return float(lower)
+            return lower + (LATENCY_BUCKETS_MS[bucket] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return float(LATENCY_BUCKETS_MS[-1])
+
+
+def metrics(searches: int, zero_results: int, search_time_sum: int, clicks: int, clicked_searches: int,
+            histogram: Sequence[int]) -> Dict[str, Any]:
+    """Indicateurs d'un ensemble de lignes agrégées"""
+    timed = sum(histogram)
+    return {
+        "searches": searches,
+        "zero_result_rate": zero_results / searches if searches else None,
+        "avg_search_time_ms": search_time_sum / timed if timed else None,
+        "p95_search_time_ms": percentile(histogram, 0.95),
+        "click_through_rate": clicked_searches / searches if searches else None,
+        "clicks": clicks,
+    }
+
+
+def _filters(since: datetime, until: datetime, zone_id: Optional[int], intent: Optional[str],
+             activity_type_id: Optional[int], prefix: str = "") -> Tuple[str, Dict[str, Any]]:
+    conditions = [f"{prefix}hour >= :since", f"{prefix}hour < :until"]
+    params: Dict[str, Any] = {"since": since, "until": until}
+    for name, value in (("zone_id", zone_id), ("intent", intent), ("activity_type_id", activity_type_id)):
+        if value is not None:
+            conditions.append(f"{prefix}{name} = :{name}")
+            params[name] = value
+    return " AND ".join(conditions), params
+
+
+class SearchRollups:
+    """Mise à jour incrémentale des agrégats et lecture pour les tableaux de bord"""
+
+    def __init__(self, max_window: timedelta = MAX_WINDOW):
+        self.max_window = max_window
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"updates": 0, "insights": 0}
+
+    # -------------------------------------------------
+    # Mise à jour
+    # -------------------------------------------------
+
+    def update(self, db) -> timedelta:
+        """Agrège une fenêtre depuis le filigrane; retourne la durée traitée
+
+        Le filigrane est verrouillé jusqu'au commit: deux workers ne comptent
+        jamais la même fenêtre, un arrêt en cours de route annule tout.
+        """
+        db.execute(text(WATERMARK_SQL), {"name": WATERMARK_NAME})
+        from_time = db.execute(text(LOCK_WATERMARK_SQL), {"name": WATERMARK_NAME}).scalar()
+        to_time = db.execute(
+            text("SELECT LEAST(NOW() - make_interval(secs => :lag), CAST(:from_time AS TIMESTAMPTZ) + :max_window)"),
+            {"lag": SAFETY_LAG_SECONDS, "from_time": from_time, "max_window": self.max_window}
+        ).scalar()
+        if to_time <= from_time:
+            db.rollback()
+            return timedelta(0)
+
+        window = {"from_time": from_time, "to_time": to_time}
+        db.execute(text(ROLLUP_SEARCHES_SQL), window)
+        db.execute(text(ROLLUP_QUERIES_SQL), window)
+        db.execute(text(ROLLUP_CLICKS_SQL), window)
+        db.execute(
+            text("UPDATE rollup_watermarks SET processed_until = :to_time, updated_at = NOW() WHERE name = :name"),
+            {"to_time": to_time, "name": WATERMARK_NAME}
+        )
+        db.commit()
+        self.stats["updates"] += 1
+        return to_time - from_time
+
+    def publish_daily_insights(self, db, day) -> bool:
+        """Publie le résumé d'une journée entièrement agrégée (une seule fois)"""
+        since = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        until = since + timedelta(days=1)
+        db.execute(text(WATERMARK_SQL), {"name": WATERMARK_NAME})
+        processed_until = db.execute(text(LOCK_WATERMARK_SQL), {"name": WATERMARK_NAME}).scalar()
+        if processed_until < until or db.execute(text(INSIGHT_EXISTS_SQL), {"day": day.isoformat()}).scalar():
+            db.rollback()
+            return False
+
+        summary = self.summary(db, since, until)
+        filters = json.dumps({"rollup": "daily", "day": day.isoformat()})
+        insight = {
+            "source_tables": ["search_rollups_hourly", "search_query_rollups_hourly"],
+            "filters": filters,
+            "expires_at": until + timedelta(days=INSIGHT_RETENTION_DAYS),
+        }
+        db.execute(text(INSERT_INSIGHT_SQL), dict(
+            insight, title=f"Recherches du {day:%d/%m/%Y}", insight_type="trend",
+            description="Volume, recherches sans résultat, temps de réponse et taux de clic de la journée",
+            data=json.dumps({key: value for key, value in summary.items() if key != "hours"}, default=str),
+        ))
+        alerts = [dict(row) for row in db.execute(text(ZERO_RESULT_GROUPS_SQL), {
+            "since": since, "until": until, "rate": ZERO_RESULT_ALERT_RATE,
+            "min_searches": ZERO_RESULT_ALERT_MIN_SEARCHES,
+        }).mappings()]
+        if alerts:
+            db.execute(text(INSERT_INSIGHT_SQL), dict(
+                insight, title=f"Recherches sans résultat du {day:%d/%m/%Y}", insight_type="alert",
+                description=f"Zones et intentions avec plus de {ZERO_RESULT_ALERT_RATE:.0%} de recherches sans résultat",
+                data=json.dumps({"groups": alerts}, default=int),
+            ))
+        db.execute(
+            text("DELETE FROM search_query_rollups_hourly WHERE hour < :before"),
+            {"before": since - timedelta(days=QUERY_RETENTION_DAYS)}
+        )
+        db.commit()
+        self.stats["insights"] += 1
+        return True
+
+    def run_once(self, session_factory) -> None:
+        with session_factory() as db:
+            # Rattrapage d'un retard: fenêtres successives jusqu'au présent
+            while self.update(db) >= self.max_window:
+                pass
+            yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+            self.publish_daily_insights(db, yesterday)
+
+    def start(self, session_factory, interval: float = UPDATE_INTERVAL_SECONDS) -> None:
+        """Met à jour périodiquement dans un thread dédié"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.run_once(session_factory)
+                except Exception:
+                    logger.exception("Échec de la mise à jour des agrégats de recherche")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="search-rollups", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # -------------------------------------------------
+    # Lecture
+    # -------------------------------------------------
+
+    @staticmethod
+    def _queries(since, until, zone_id, intent, activity_type_id, top_queries):
+        where, params = _filters(since, until, zone_id, intent, activity_type_id)
+        histogram_where, _ = _filters(since, until, zone_id, intent, activity_type_id, prefix="r.")
+        return (
+            (TOTALS_SQL.format(where=where), params),
+            (HISTOGRAM_SQL.format(where=histogram_where), params),
+            (TOP_QUERIES_SQL.format(where=where), dict(params, limit=top_queries)),
+        )
+
+    @staticmethod
+    def _assemble(totals, histograms, top_queries) -> Dict[str, Any]:
+        bucket_count = len(LATENCY_BUCKETS_MS) + 1
+        by_hour: Dict[datetime, List[int]] = {}
+        for row in histograms:
+            by_hour.setdefault(row["hour"], [0] * bucket_count)[row["bucket"] - 1] = int(row["count"])
+
+        hours, overall = [], [0] * 5
+        overall_histogram = [0] * bucket_count
+        for row in totals:
+            values = [int(row[name]) for name in
+                      ("searches", "zero_results", "search_time_sum", "clicks", "clicked_searches")]
+            histogram = by_hour.get(row["hour"], [0] * bucket_count)
+            hours.append(dict(metrics(*values, histogram), hour=row["hour"]))
+            overall = [total + value for total, value in zip(overall, values)]
+            overall_histogram = [total + value for total, value in zip(overall_histogram, histogram)]
+
+        return dict(
+            metrics(*overall, overall_histogram),
+            top_queries=[{"query": row["query"], "searches": int(row["searches"])} for row in top_queries],
+            hours=hours,
+        )
+
+    def summary(self, db, since: datetime, until: datetime, zone_id: Optional[int] = None,
+                intent: Optional[str] = None, activity_type_id: Optional[int] = None,
+                top_queries: int = TOP_QUERIES) -> Dict[str, Any]:
+        """Indicateurs de la période, au total et par heure"""
+        results = [db.execute(text(sql), params).mappings().all()
+                   for sql, params in self._queries(since, until, zone_id, intent, activity_type_id, top_queries)]
+        return self._assemble(*results)
+
+    async def summary_async(self, db, since: datetime, until: datetime, zone_id: Optional[int] = None,
+                            intent: Optional[str] = None, activity_type_id: Optional[int] = None,
+                            top_queries: int = TOP_QUERIES) -> Dict[str, Any]:
+        results = []
+        for sql, params in self._queries(since, until, zone_id, intent, activity_type_id, top_queries):
+            results.append((await db.execute(text(sql), params)).mappings().all())
+        return self._assemble(*results)
+
+
+if __name__ == "__main__":
+    from .new_models import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    rollups = SearchRollups()
+    rollups.run_once(SessionLocal)
+    print(rollups.stats)
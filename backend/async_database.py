@@ -0,0 +1,144 @@
+"""
+Accès asynchrone à la base de données (SQLAlchemy asyncio + asyncpg)
+
+Le chemin de recherche asynchrone ne bloque aucun thread pendant l'aller-retour
+réseau: un worker peut ainsi servir des milliers de clients mobiles lents au
+lieu d'être limité à la taille du threadpool.
+"""
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from .new_models import DATABASE_URL, SearchLog
+
+logger = logging.getLogger(__name__)
+
+# Paramètres libpq que asyncpg ne comprend pas dans l'URL
+_LIBPQ_ONLY_PARAMS = {"sslmode", "channel_binding"}
+
+
+def to_async_url(url: str) -> str:
+    """Convertit une URL psycopg2 en URL asyncpg"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.split("+")[0]
+    if scheme == "postgres":
+        scheme = "postgresql"
+
+    params = parse_qsl(parts.query)
+    query = [(key, value) for key, value in params if key not in _LIBPQ_ONLY_PARAMS]
+    sslmode = dict(params).get("sslmode")
+    if sslmode and sslmode != "disable":
+        query.append(("ssl", sslmode))
+
+    return urlunsplit((f"{scheme}+asyncpg", parts.netloc, parts.path, urlencode(query), parts.fragment))
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "10")),
+    pool_pre_ping=True,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Obtient une session asynchrone de base de données"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# =====================================================
+# ÉCRITURE DIFFÉRÉE DES LOGS DE RECHERCHE
+# =====================================================
+
+class AsyncSearchLogWriter:
+    """Écrit les SearchLog par lots en arrière-plan
+
+    Les identifiants sont réservés par blocs sur la séquence de search_logs:
+    la recherche connaît son search_id sans attendre l'insertion.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, batch_size: int = 100,
+                 flush_interval: float = 0.5, id_block_size: int = 100, max_queue: int = 10000):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+
+        self._queue: "asyncio.Queue[SearchLog]" = asyncio.Queue(maxsize=max_queue)
+        self._ids: List[int] = []
+        self._id_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "failed_batches": 0}
+
+    async def reserve_id(self) -> int:
+        """Identifiant du prochain log (un aller-retour par bloc)"""
+        async with self._id_lock:
+            if not self._ids:
+                async with self.session_factory() as db:
+                    result = await db.execute(
+                        text("SELECT nextval('search_logs_id_seq') FROM generate_series(1, :n)"),
+                        {"n": self.id_block_size},
+                    )
+                    self._ids = sorted(result.scalars().all(), reverse=True)
+            return self._ids.pop()
+
+    def submit(self, search_log: SearchLog) -> None:
+        """Met un log en file sans attendre; abandonné si la file est pleine"""
+        try:
+            self._queue.put_nowait(search_log)
+            self.stats["queued"] += 1
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    def start(self) -> None:
+        """Démarre la tâche d'écriture sur la boucle courante"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Arrête la tâche après avoir vidé la file"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            await self._flush(self._drain())
+
+    def _drain(self) -> List[SearchLog]:
+        batch = []
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                await asyncio.sleep(self.flush_interval)
+            finally:
+                # Le lot en cours est écrit même si la tâche est annulée
+                await self._flush(batch + self._drain())
+
+    async def _flush(self, batch: List[SearchLog]) -> None:
+        if not batch:
+            return
+        try:
+            async with self.session_factory() as db:
+                db.add_all(batch)
+                await db.commit()
+            self.stats["written"] += len(batch)
+        except Exception:
+            self.stats["failed_batches"] += 1
+            logger.exception("Échec d'écriture de %d logs de recherche", len(batch))
@@ -0,0 +1,273 @@
+"""
+Flux de changements inter-workers basé sur LISTEN/NOTIFY PostgreSQL
+
+Les triggers `notify_table_change` (database_schema.sql, section 20) publient
+un message compact sur le canal `tchaller_changes` à chaque modification des
+tables activities, activity_types, categories, zones et media. Chaque worker
+démarre un `ChangeFeed` qui écoute ce canal et transmet les événements aux
+invalidateurs de cache enregistrés.
+
+Les notifications sont perdues si la connexion d'écoute tombe: un rattrapage
+périodique basé sur les watermarks `updated_at` couvre ce cas, et une
+réinitialisation complète est émise après chaque reconnexion (les suppressions
+ne laissent pas de trace dans `updated_at`).
+
+Utilisation:
+    from backend.change_feed import change_feed
+
+    @change_feed.on("activities", "media")
+    def invalidate(event):
+        cache.pop(event.activity_id or event.id, None)
+
+    change_feed.start()  # au démarrage de l'application
+
+`start()` est idempotent: chaque hook de démarrage qui enregistre des
+invalidateurs l'appelle juste après `register`, sans dépendre de l'ordre des
+hooks. Sans cet appel, aucun événement n'est reçu.
+"""
+import json
+import logging
+import os
+import select
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import text
+
+from .new_models import DATABASE_URL, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "tchaller_changes"
+WATCHED_TABLES = ("activities", "activity_types", "categories", "zones", "media")
+
+# Marge de recouvrement du rattrapage pour les transactions longues
+CATCHUP_OVERLAP = timedelta(seconds=5)
+CATCHUP_BATCH_SIZE = 1000
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Codes d'opération
+OP_INSERT = "I"
+OP_UPDATE = "U"
+OP_DELETE = "D"
+OP_CATCHUP = "C"
+OP_RESET = "R"
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    """Modification d'une ligne (ou réinitialisation d'une table si id est None)"""
+    table: str
+    id: Optional[int]
+    op: str
+    columns: Optional[Tuple[str, ...]] = None
+    activity_id: Optional[int] = None
+
+    @classmethod
+    def from_payload(cls, payload: str) -> "ChangeEvent":
+        """Décode le JSON émis par notify_table_change()"""
+        data = json.loads(payload)
+        columns = data.get("c")
+        return cls(
+            table=data["t"],
+            id=data.get("id"),
+            op=data.get("op", OP_UPDATE),
+            columns=tuple(columns) if columns is not None else None,
+            activity_id=data.get("a"),
+        )
+
+    @property
+    def is_reset(self) -> bool:
+        return self.op == OP_RESET
+
+    def touches(self, *columns: str) -> bool:
+        """Indique si l'événement peut concerner l'une des colonnes données"""
+        if self.columns is None:
+            return True
+        return any(column in self.columns for column in columns)
+
+
+Invalidator = Callable[[ChangeEvent], None]
+
+
+class ChangeFeed:
+    """Écoute du canal de changements et diffusion vers les invalidateurs"""
+
+    def __init__(self, dsn: Optional[str] = None, catchup_interval: float = 30.0,
+                 poll_timeout: float = 0.5):
+        # LISTEN exige une connexion directe: le pooler en mode transaction ne le supporte pas
+        dsn = dsn or os.getenv("CHANGE_FEED_DATABASE_URL", DATABASE_URL)
+        self.dsn = dsn.replace("postgresql+psycopg2://", "postgresql://")
+        self.catchup_interval = catchup_interval
+        self.poll_timeout = poll_timeout
+
+        self._invalidators: Dict[str, List[Invalidator]] = {table: [] for table in WATCHED_TABLES}
+        self._watermarks: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats = {"received": 0, "caught_up": 0, "resets": 0, "reconnects": 0, "errors": 0}
+
+    # -------------------------------------------------
+    # Enregistrement et diffusion
+    # -------------------------------------------------
+
+    def register(self, tables, invalidator: Invalidator) -> None:
+        """Enregistre un invalidateur pour une ou plusieurs tables"""
+        if isinstance(tables, str):
+            tables = (tables,)
+        with self._lock:
+            for table in tables:
+                if table not in self._invalidators:
+                    raise ValueError(f"Table non surveillée: {table}")
+                self._invalidators[table].append(invalidator)
+
+    def on(self, *tables: str) -> Callable[[Invalidator], Invalidator]:
+        """Décorateur équivalent à register()"""
+        def decorator(invalidator: Invalidator) -> Invalidator:
+            self.register(tables, invalidator)
+            return invalidator
+        return decorator
+
+    def dispatch(self, event: ChangeEvent) -> None:
+        """Transmet un événement à tous les invalidateurs de sa table"""
+        with self._lock:
+            invalidators = list(self._invalidators.get(event.table, ()))
+        for invalidator in invalidators:
+            try:
+                invalidator(event)
+            except Exception:
+                self.stats["errors"] += 1
+                logger.exception("Invalidateur en échec pour %s", event)
+
+    def reset_all(self) -> None:
+        """Demande à tous les invalidateurs de vider leurs caches"""
+        self.stats["resets"] += 1
+        for table in WATCHED_TABLES:
+            self.dispatch(ChangeEvent(table=table, id=None, op=OP_RESET))
+
+    # -------------------------------------------------
+    # Rattrapage par watermark
+    # -------------------------------------------------
+
+    def init_watermarks(self) -> None:
+        """Positionne les watermarks sur le dernier updated_at connu"""
+        with SessionLocal() as db:
+            for table in WATCHED_TABLES:
+                latest = db.execute(text(f"SELECT MAX(updated_at) FROM {table}")).scalar()
+                self._watermarks[table] = latest or EPOCH
+
+    def catch_up(self) -> int:
+        """Rejoue les modifications postérieures aux watermarks"""
+        replayed = 0
+        with SessionLocal() as db:
+            for table in WATCHED_TABLES:
+                watermark = self._watermarks.get(table, EPOCH)
+                activity_column = "activity_id" if table == "media" else "NULL"
+                rows = db.execute(
+                    text(f"""
+                    SELECT id, {activity_column} AS activity_id, updated_at
+                    FROM {table}
+                    WHERE updated_at > :since
+                    ORDER BY updated_at
+                    LIMIT :limit
+                    """),
+                    {"since": watermark - CATCHUP_OVERLAP, "limit": CATCHUP_BATCH_SIZE},
+                ).fetchall()
+
+                for row in rows:
+                    self.dispatch(ChangeEvent(table=table, id=row.id, op=OP_CATCHUP,
+                                              activity_id=row.activity_id))
+                    if row.updated_at > watermark:
+                        watermark = row.updated_at
+                self._watermarks[table] = watermark
+                replayed += len(rows)
+
+        self.stats["caught_up"] += replayed
+        return replayed
+
+    # -------------------------------------------------
+    # Boucle d'écoute
+    # -------------------------------------------------
+
+    def start(self) -> None:
+        """Démarre l'écoute dans un thread dédié (une fois par worker)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Arrête l'écoute"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _connect(self):
+        connection = psycopg2.connect(self.dsn)
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL};")
+        return connection
+
+    def _run(self) -> None:
+        backoff = 1.0
+        first_connection = True
+
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                if first_connection:
+                    self.init_watermarks()
+                    first_connection = False
+                else:
+                    # Des notifications ont pu être perdues pendant la coupure
+                    self.stats["reconnects"] += 1
+                    self.reset_all()
+                    self.catch_up()
+                backoff = 1.0
+                self._listen(connection)
+            except Exception:
+                self.stats["errors"] += 1
+                logger.exception("Flux de changements interrompu, reconnexion dans %.0fs", backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+    def _listen(self, connection) -> None:
+        next_catchup = time.monotonic() + self.catchup_interval
+
+        while not self._stop.is_set():
+            if select.select([connection], [], [], self.poll_timeout) != ([], [], []):
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    try:
+                        event = ChangeEvent.from_payload(notify.payload)
+                    except (ValueError, KeyError):
+                        self.stats["errors"] += 1
+                        logger.warning("Notification invalide: %r", notify.payload)
+                        continue
+                    self.stats["received"] += 1
+                    self.dispatch(event)
+
+            if time.monotonic() >= next_catchup:
+                self.catch_up()
+                next_catchup = time.monotonic() + self.catchup_interval
+
+
+# Instance partagée par worker
+change_feed = ChangeFeed()
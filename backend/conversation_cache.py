@@ -0,0 +1,191 @@
+"""
+Candidats du tour précédent, par conversation, pour répondre aux relances
+
+Dans le chat, la plupart des messages affinent la recherche précédente:
+"les moins chers", "seulement ceux ouverts", "plus proche". Les candidats
+du dernier tour (lignes et critères de classement) sont gardés par
+conversation, avec une durée de vie; une relance est traitée en filtrant et
+en reclassant ces candidats en mémoire. La base n'est interrogée que si la
+relance élargit la recherche ("plus loin", "d'autres options") ou si le
+filtre ne laisse plus aucun candidat.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .text_normalization import fold
+
+CONVERSATION_TTL_SECONDS = 15 * 60
+MAX_CONVERSATIONS = 10000
+# Au-delà, le message est une nouvelle demande plutôt qu'une relance
+MAX_REFINEMENT_WORDS = 6
+WIDEN_RADIUS_FACTOR = 2
+DEFAULT_RADIUS = 5000
+
+Row = Dict[str, Any]
+
+
+@dataclass(frozen=True)
+class Refinement:
+    """Relance reconnue dans un message (motifs sur le texte replié)"""
+    name: str
+    patterns: Tuple[str, ...]
+    keep: Optional[Callable[[Row], bool]] = None
+    sort_key: Optional[Callable[[Row], Any]] = None
+    # Filtres de la requête SQL quand la relance doit repasser par la base
+    request_filters: Dict[str, Any] = field(default_factory=dict)
+    widens: bool = False
+
+
+REFINEMENTS = (
+    Refinement("open_now", (r"\bouverte?s?\b",),
+               keep=lambda row: bool(row.get('is_open')),
+               request_filters={'is_open_now': True}),
+    Refinement("verified", (r"\bverifiee?s?\b",),
+               keep=lambda row: bool(row.get('is_verified')),
+               request_filters={'verification_level': 1}),
+    Refinement("cheaper", (r"\bmoins chere?s?\b", r"\bpas chere?s?\b", r"\bbon marche\b", r"\beconomique", r"\babordable"),
+               sort_key=lambda row: row.get('price_level') or 99,
+               request_filters={'price_level': 1}),
+    Refinement("closer", (r"\bplus proches?\b", r"\bplus pres\b", r"\ba cote\b"),
+               sort_key=lambda row: row.get('distance') if row.get('distance') is not None else float('inf')),
+    Refinement("better_rated", (r"\bmieux notee?s?\b", r"\bmeilleure?s? notee?s?\b", r"\bles meilleure?s?\b"),
+               sort_key=lambda row: (-float(row.get('rating') or 0), -(row.get('review_count') or 0))),
+    Refinement("wider", (r"\bplus loin\b", r"\belargi", r"\bd autres\b", r"\bautres (options|resultats|endroits|adresses)\b"),
+               widens=True),
+)
+
+
+@dataclass
+class CandidateSet:
+    """Résultat d'un tour: lignes dans l'ordre affiché et contexte de la recherche"""
+    rows: List[Row]
+    search_request: Dict[str, Any]
+    intent: str
+    entities: Dict[str, Any]
+    stored_at: float
+
+
+@dataclass
+class RefinementResult:
+    """Relance résolue: lignes en mémoire, ou requête élargie si `rows` est None
+
+    `request` est toujours la requête complète du tour (recherche précédente et
+    filtres de la relance), à conserver pour les relances suivantes.
+    """
+    name: str
+    rows: Optional[List[Row]]
+    request: Dict[str, Any]
+    intent: str
+    entities: Dict[str, Any]
+
+
+def detect_refinements(query: str) -> List[Refinement]:
+    """Relances exprimées par un message court"""
+    folded = fold(query)
+    if not folded or len(folded.split()) > MAX_REFINEMENT_WORDS:
+        return []
+    return [
+        refinement for refinement in REFINEMENTS
+        if any(re.search(pattern, folded) for pattern in refinement.patterns)
+    ]
+
+
+class ConversationCache:
+    """Cache LRU à durée de vie des candidats par conversation"""
+
+    def __init__(self, ttl_seconds: float = CONVERSATION_TTL_SECONDS, max_conversations: int = MAX_CONVERSATIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_conversations = max_conversations
+        self._sets: "OrderedDict[Hashable, CandidateSet]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "refined_in_memory": 0, "widened": 0, "expired": 0}
+
+    @staticmethod
+    def key_for(search_request: Dict[str, Any]) -> Optional[Hashable]:
+        """Identifiant de conversation (ou de session) de la requête"""
+        if search_request.get('conversation_id') is not None:
+            return ('conversation', search_request['conversation_id'])
+        if search_request.get('session_id'):
+            return ('session', search_request['session_id'])
+        return None
+
+    def get(self, key: Optional[Hashable]) -> Optional[CandidateSet]:
+        if key is None:
+            return None
+        with self._lock:
+            candidates = self._sets.get(key)
+            if candidates is None:
+                return None
+            if time.monotonic() - candidates.stored_at > self.ttl_seconds:
+                del self._sets[key]
+                self.stats["expired"] += 1
+                return None
+            self._sets.move_to_end(key)
+            return candidates
+
+    def remember(self, search_request: Dict[str, Any], rows: List[Row], ranked_ids: List[Any],
+                 intent: str, entities: Dict[str, Any]) -> None:
+        """Conserve les candidats d'un tour dans l'ordre où ils ont été présentés"""
+        key = self.key_for(search_request)
+        if key is None:
+            return
+        position = {activity_id: index for index, activity_id in enumerate(ranked_ids)}
+        ordered = sorted(rows, key=lambda row: position.get(row.get('id'), len(position)))
+
+        with self._lock:
+            self._sets[key] = CandidateSet(ordered, dict(search_request), intent, dict(entities), time.monotonic())
+            self._sets.move_to_end(key)
+            while len(self._sets) > self.max_conversations:
+                self._sets.popitem(last=False)
+            self.stats["stored"] += 1
+
+    def invalidate(self, search_request: Dict[str, Any]) -> None:
+        key = self.key_for(search_request)
+        with self._lock:
+            self._sets.pop(key, None)
+
+    def refine(self, search_request: Dict[str, Any], query: str, entities: Dict[str, Any]) -> Optional[RefinementResult]:
+        """Traite le message comme une relance du tour précédent si possible"""
+        refinements = detect_refinements(query)
+        if not refinements:
+            return None
+        previous = self.get(self.key_for(search_request))
+        if previous is None:
+            return None
+
+        # Un nouveau type d'activité ou un lieu nommé est une nouvelle demande
+        activity_type = entities.get('activity_type')
+        if entities.get('activity_ids') or (activity_type and activity_type != previous.entities.get('activity_type')):
+            return None
+
+        name = "+".join(refinement.name for refinement in refinements)
+        rows = previous.rows
+        for refinement in refinements:
+            if refinement.keep is not None:
+                rows = [row for row in rows if refinement.keep(row)]
+        for refinement in refinements:
+            if refinement.sort_key is not None:
+                rows = sorted(rows, key=refinement.sort_key)
+
+        # Requête du tour précédent, filtres de la relance, position actuelle: c'est elle qui
+        # est conservée pour le tour suivant, pas le texte de la relance
+        request = dict(previous.search_request)
+        for refinement in refinements:
+            request.update(refinement.request_filters)
+        for name_key in ('latitude', 'longitude', 'user_id', 'user_location', 'conversation_id', 'session_id'):
+            if search_request.get(name_key) is not None:
+                request[name_key] = search_request[name_key]
+
+        if rows and not any(refinement.widens for refinement in refinements):
+            self.stats["refined_in_memory"] += 1
+            return RefinementResult(name, rows, request, previous.intent, dict(previous.entities))
+
+        # Élargissement (ou plus aucun candidat): la requête est relancée sur la base
+        if any(refinement.widens for refinement in refinements):
+            request['radius'] = (previous.search_request.get('radius') or DEFAULT_RADIUS) * WIDEN_RADIUS_FACTOR
+        self.stats["widened"] += 1
+        return RefinementResult(name, None, request, previous.intent, dict(previous.entities))
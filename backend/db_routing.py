@@ -0,0 +1,324 @@
+"""
+Routage lecture/écriture entre la base primaire et ses réplicas
+
+- Les lectures de recherche vont vers le réplica le moins chargé dont le
+  retard de réplication reste sous MAX_REPLICA_LAG_SECONDS; sinon vers la
+  primaire.
+- Les écritures (SearchLog, modifications des ambassadeurs) vont toujours
+  vers la primaire.
+- Lecture de ses propres écritures: après une écriture faite pour une clé
+  (utilisateur, session), les lectures de cette clé restent sur la primaire
+  pendant la fenêtre de réplication. Les dépendances FastAPI tirent la clé de
+  la requête (paramètres `user_id`/`session_id`, en-têtes X-User-Id/X-Session-Id).
+  Seul un commit qui a réellement écrit (flush ORM ou INSERT/UPDATE/DELETE)
+  épingle la clé; les écritures que l'utilisateur ne relit pas (SearchLog) se
+  font sans clé.
+- Le retard des réplicas est mesuré par un thread dédié toutes les
+  LAG_CHECK_INTERVAL_SECONDS, jamais pendant une requête; un réplica pas encore
+  mesuré n'est pas utilisé.
+
+Configuration:
+    DATABASE_URL               primaire (moteur de new_models)
+    DATABASE_REPLICA_URLS      réplicas séparés par des virgules
+    REPLICA_POOL_SIZE          taille du pool de chaque réplica
+    MAX_REPLICA_LAG_SECONDS    retard toléré sur un réplica
+    REPLICA_FAKE_LAG_SECONDS   retard simulé (tests locaux sans réplication)
+"""
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, Iterator, List, Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from .new_models import engine as primary_engine
+
+logger = logging.getLogger(__name__)
+
+REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_POOL_SIZE = int(os.getenv("REPLICA_POOL_SIZE", "20"))
+REPLICA_MAX_OVERFLOW = int(os.getenv("REPLICA_MAX_OVERFLOW", "10"))
+MAX_REPLICA_LAG_SECONDS = float(os.getenv("MAX_REPLICA_LAG_SECONDS", "2"))
+LAG_CHECK_INTERVAL_SECONDS = float(os.getenv("LAG_CHECK_INTERVAL_SECONDS", "5"))
+
+# Retard nul quand le réplica a rejoué tout ce qu'il a reçu (primaire inactive)
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+LagProbe = Callable[[Engine], float]
+
+# Requête SQL textuelle qui écrit (les instructions ORM sont reconnues par SQLAlchemy)
+_WRITE_SQL = re.compile(r"\b(insert\s+into|update\s+\S+\s+set|delete\s+from)\b", re.IGNORECASE)
+
+
+def sql_lag_probe(replica_engine: Engine) -> float:
+    """Mesure le retard de réplication d'un réplica en secondes"""
+    with replica_engine.connect() as connection:
+        return float(connection.execute(text(REPLICA_LAG_SQL)).scalar() or 0)
+
+
+def _checked_out(pool_engine: Engine) -> int:
+    pool = pool_engine.pool
+    return pool.checkedout() if isinstance(pool, QueuePool) else 0
+
+
+def static_lag_probe(seconds: float) -> LagProbe:
+    """Sonde factice renvoyant un retard fixe (tests locaux)"""
+    return lambda replica_engine: seconds
+
+
+def request_key(user_id=None, session_id=None) -> Optional[Hashable]:
+    """Clé de lecture de ses propres écritures: utilisateur, sinon session"""
+    if user_id not in (None, ""):
+        return ("user", str(user_id))
+    if session_id not in (None, ""):
+        return ("session", str(session_id))
+    return None
+
+
+def key_from_request(request: Request) -> Optional[Hashable]:
+    """Clé d'une requête HTTP (paramètres de requête, sinon en-têtes)"""
+    return request_key(
+        request.query_params.get("user_id") or request.headers.get("x-user-id"),
+        request.query_params.get("session_id") or request.headers.get("x-session-id"),
+    )
+
+
+class _Replica:
+    __slots__ = ("name", "engine", "sessionmaker", "lag", "checked_at")
+
+    def __init__(self, name: str, replica_engine: Engine):
+        self.name = name
+        self.engine = replica_engine
+        self.sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+        self.lag: Optional[float] = None
+        self.checked_at = 0.0
+
+
+class DatabaseRouter:
+    """Choisit la base (primaire ou réplica) de chaque session"""
+
+    def __init__(self, primary: Engine, replicas: List[Engine] = (), max_lag: float = MAX_REPLICA_LAG_SECONDS,
+                 lag_check_interval: float = LAG_CHECK_INTERVAL_SECONDS, lag_probe: LagProbe = sql_lag_probe):
+        self.primary = primary
+        self.primary_sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=primary)
+        self.replicas = [_Replica(f"replica_{index}", replica) for index, replica in enumerate(replicas)]
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.lag_probe = lag_probe
+
+        # Fenêtre pendant laquelle une clé qui vient d'écrire lit sur la primaire
+        self.read_your_writes_window = max(max_lag, 1.0) * 2
+        self._recent_writes: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"replica_reads": 0, "primary_reads": 0, "pinned_reads": 0, "lagging_skips": 0, "writes": 0}
+
+    # -------------------------------------------------
+    # Retard de réplication
+    # -------------------------------------------------
+
+    def refresh_lags(self) -> None:
+        """Mesure le retard de chaque réplica (thread de surveillance)"""
+        for replica in self.replicas:
+            try:
+                replica.lag = self.lag_probe(replica.engine)
+            except Exception:
+                logger.warning("Réplica %s injoignable", replica.name, exc_info=True)
+                replica.lag = None
+            replica.checked_at = time.monotonic()
+
+    def _is_stale(self, replica: _Replica) -> bool:
+        # Mesure trop ancienne (surveillance arrêtée ou bloquée): réplica écarté
+        return time.monotonic() - replica.checked_at > self.lag_check_interval * 3
+
+    def start(self, interval: Optional[float] = None) -> None:
+        """Mesure périodiquement le retard des réplicas dans un thread dédié"""
+        with self._lock:
+            if not self.replicas or (self._thread and self._thread.is_alive()):
+                return
+            interval = interval or self.lag_check_interval
+
+            def run() -> None:
+                while not self._stop.is_set():
+                    try:
+                        self.refresh_lags()
+                    except Exception:
+                        logger.exception("Échec de la mesure du retard des réplicas")
+                    self._stop.wait(interval)
+
+            self._stop.clear()
+            self._thread = threading.Thread(target=run, name="replica-lag", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def healthy_replicas(self) -> List[_Replica]:
+        """Réplicas joignables dont le dernier retard mesuré est acceptable"""
+        # Surveillance démarrée au premier besoin; la mesure reste hors de la requête
+        if self._thread is None:
+            self.start()
+        healthy = []
+        for replica in self.replicas:
+            if replica.lag is not None and replica.lag <= self.max_lag and not self._is_stale(replica):
+                healthy.append(replica)
+            else:
+                self.stats["lagging_skips"] += 1
+        return healthy
+
+    # -------------------------------------------------
+    # Lecture de ses propres écritures
+    # -------------------------------------------------
+
+    def note_write(self, key: Optional[Hashable]) -> None:
+        """Signale une écriture faite pour `key` (utilisateur, session...)"""
+        if key is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._recent_writes[key] = now
+            # Purge opportuniste des clés expirées
+            if len(self._recent_writes) > 10000:
+                cutoff = now - self.read_your_writes_window
+                self._recent_writes = {k: t for k, t in self._recent_writes.items() if t >= cutoff}
+
+    def _is_pinned(self, key: Optional[Hashable]) -> bool:
+        if key is None:
+            return False
+        with self._lock:
+            written_at = self._recent_writes.get(key)
+        return written_at is not None and time.monotonic() - written_at < self.read_your_writes_window
+
+    # -------------------------------------------------
+    # Sessions
+    # -------------------------------------------------
+
+    def read_sessionmaker(self, key: Optional[Hashable] = None) -> sessionmaker:
+        """Fabrique de sessions pour une lecture"""
+        if self._is_pinned(key):
+            self.stats["pinned_reads"] += 1
+            return self.primary_sessionmaker
+
+        healthy = self.healthy_replicas()
+        if not healthy:
+            self.stats["primary_reads"] += 1
+            return self.primary_sessionmaker
+
+        # Réplica le moins chargé
+        replica = min(healthy, key=lambda candidate: _checked_out(candidate.engine))
+        self.stats["replica_reads"] += 1
+        return replica.sessionmaker
+
+    @contextmanager
+    def read_session(self, key: Optional[Hashable] = None) -> Iterator[Session]:
+        """Session de lecture (réplica si possible)"""
+        db = self.read_sessionmaker(key)()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def write_session(self, key: Optional[Hashable] = None) -> Iterator[Session]:
+        """Session sur la primaire; la clé est épinglée après chaque commit qui a écrit"""
+        db = self.primary_sessionmaker()
+        self.stats["writes"] += 1
+        if key is not None:
+            wrote = [False]
+
+            def on_flush(session, flush_context) -> None:
+                wrote[0] = True
+
+            def on_execute(state) -> None:
+                if state.is_insert or state.is_update or state.is_delete \
+                        or _WRITE_SQL.search(getattr(state.statement, "text", "")):
+                    wrote[0] = True
+
+            def on_commit(session) -> None:
+                if wrote[0]:
+                    self.note_write(key)
+                wrote[0] = False
+
+            def on_rollback(session) -> None:
+                wrote[0] = False
+
+            event.listen(db, "after_flush", on_flush)
+            event.listen(db, "do_orm_execute", on_execute)
+            event.listen(db, "after_commit", on_commit)
+            event.listen(db, "after_rollback", on_rollback)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def is_primary(self, db: Session) -> bool:
+        """Indique si la session est liée à la primaire"""
+        return db.get_bind() is self.primary
+
+    # -------------------------------------------------
+    # Métriques
+    # -------------------------------------------------
+
+    @staticmethod
+    def _pool_metrics(pool_engine: Engine) -> Dict[str, float]:
+        pool = pool_engine.pool
+        if not isinstance(pool, QueuePool):
+            return {"size": 0, "checked_out": 0, "overflow": 0, "utilisation": 0.0}
+
+        checked_out = _checked_out(pool_engine)
+        capacity = pool.size() + pool._max_overflow
+        return {
+            "size": pool.size(),
+            "checked_out": checked_out,
+            "overflow": max(pool.overflow(), 0),
+            "utilisation": round(checked_out / capacity, 3) if capacity else 0.0,
+        }
+
+    def pool_metrics(self) -> Dict[str, Dict]:
+        """Utilisation de chaque pool et compteurs de routage"""
+        metrics = {"primary": self._pool_metrics(self.primary)}
+        for replica in self.replicas:
+            metrics[replica.name] = {**self._pool_metrics(replica.engine), "lag_seconds": replica.lag}
+        metrics["routing"] = dict(self.stats)
+        return metrics
+
+
+def _build_router() -> DatabaseRouter:
+    replicas = [
+        create_engine(url, pool_size=REPLICA_POOL_SIZE, max_overflow=REPLICA_MAX_OVERFLOW,
+                      pool_timeout=5, pool_pre_ping=True)
+        for url in REPLICA_URLS
+    ]
+    fake_lag = os.getenv("REPLICA_FAKE_LAG_SECONDS")
+    probe = static_lag_probe(float(fake_lag)) if fake_lag else sql_lag_probe
+    return DatabaseRouter(primary_engine, replicas, lag_probe=probe)
+
+
+router = _build_router()
+
+
+def get_read_db(request: Request) -> Iterator[Session]:
+    """Dépendance FastAPI: session de lecture (réplica si possible, primaire après
+    une écriture récente de l'utilisateur ou de la session)"""
+    with router.read_session(key_from_request(request)) as db:
+        yield db
+
+
+def get_write_db(request: Request) -> Iterator[Session]:
+    """Dépendance FastAPI: session d'écriture sur la primaire; l'utilisateur ou la
+    session est épinglé après le commit"""
+    with router.write_session(key_from_request(request)) as db:
+        yield db
@@ -0,0 +1,257 @@
+"""
+Détection des activités en double et propositions de fusion
+
+Les données d'amorçage et les saisies des ambassadeurs contiennent des
+doublons ("Hôpital Sainte-Anne" enregistré plusieurs fois à quelques mètres).
+Comparer toutes les paires est impossible sur un million d'activités: les
+activités sont regroupées par bloc (cellule geohash, type d'activité), lues
+en flux dans l'ordre des blocs, et seules les paires d'un même bloc sont
+comparées:
+
+- nom: cosinus TF-IDF sur les trigrammes de caractères (IDF appris sur un
+  échantillon, pour que "pharmacie" pèse moins que "sainte anne");
+- téléphone: égalité des 8 derniers chiffres (téléphone ou WhatsApp);
+- adresse: cosinus sur les trigrammes de caractères.
+
+Un doublon à cheval sur deux cellules est retrouvé par une seconde passe sur
+une grille décalée d'une demi-cellule. Les activités sans position n'ont pas
+de cellule et ne sont pas comparées (elles formeraient un seul bloc
+quadratique). Les propositions (activité conservée,
+doublon, scores) sont écrites dans `activity_merge_proposals` pour
+validation; une proposition déjà traitée n'est pas modifiée.
+
+    python -m backend.deduplication
+"""
+import itertools
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Précision 6 ≈ 1,2 km x 0,6 km
+BLOCK_PRECISION = 6
+# Décalages (latitude, longitude en degrés) des grilles de blocage: une demi-cellule de précision 6
+BLOCKING_GRIDS = ((0.0, 0.0), (0.00275, 0.0055))
+# Lignes lues et vectorisées ensemble
+BATCH_ROWS = 50000
+# Au-delà, un bloc est comparé par tranches de lignes (mémoire bornée)
+BLOCK_CHUNK_ROWS = 2000
+IDF_SAMPLE_SIZE = 100000
+
+# Paire candidate: noms proches, ou même téléphone
+NAME_CANDIDATE_THRESHOLD = 0.6
+# Poids des signaux (renormalisés sur les signaux disponibles)
+NAME_WEIGHT = 0.6
+PHONE_WEIGHT = 0.25
+ADDRESS_WEIGHT = 0.15
+MIN_PROPOSAL_SCORE = 0.75
+PHONE_DIGITS = 8
+
+_NON_DIGIT = re.compile(r"\D+")
+
+BLOCKS_SQL = """
+SELECT
+    a.id, a.name, a.address, a.phone_number, a.whatsapp_number,
+    a.verification_level, a.review_count,
+    COALESCE(a.activity_type_id, 0) AS block_type,
+    ST_GeoHash(ST_Translate(a.location, :lon_offset, :lat_offset), :precision) AS block_cell
+FROM activities a
+WHERE a.is_active = TRUE AND a.location IS NOT NULL
+ORDER BY block_type, block_cell
+"""
+
+NAME_SAMPLE_SQL = """
+SELECT name FROM activities WHERE is_active = TRUE ORDER BY random() LIMIT :limit
+"""
+
+UPSERT_SQL = """
+INSERT INTO activity_merge_proposals
+    (activity_id, duplicate_id, score, name_score, address_score, phone_match, created_at)
+VALUES (:activity_id, :duplicate_id, :score, :name_score, :address_score, :phone_match, NOW())
+ON CONFLICT (LEAST(activity_id, duplicate_id), GREATEST(activity_id, duplicate_id)) DO UPDATE SET
+    activity_id = EXCLUDED.activity_id,
+    duplicate_id = EXCLUDED.duplicate_id,
+    score = EXCLUDED.score,
+    name_score = EXCLUDED.name_score,
+    address_score = EXCLUDED.address_score,
+    phone_match = EXCLUDED.phone_match,
+    created_at = NOW()
+WHERE activity_merge_proposals.status = 'pending'
+"""
+
+
+@dataclass
+class MergeProposal:
+    """Paire en double: `activity_id` est conservée, `duplicate_id` à fusionner"""
+    activity_id: int
+    duplicate_id: int
+    score: float
+    name_score: float
+    address_score: Optional[float]
+    phone_match: Optional[bool]
+
+
+def normalize_phone(value: Optional[str]) -> Optional[str]:
+    """Derniers chiffres du numéro (indicatif et séparateurs ignorés)"""
+    digits = _NON_DIGIT.sub("", value or "")
+    return digits[-PHONE_DIGITS:] if len(digits) >= PHONE_DIGITS else None
+
+
+def _survivor_key(row: Dict[str, Any]) -> Tuple:
+    # L'activité la plus vérifiée, puis la plus commentée, puis la plus ancienne est conservée
+    return (-(row['verification_level'] or 0), -(row['review_count'] or 0), row['id'])
+
+
+def _pair_score(name_score: float, address_score: Optional[float], phone_match: Optional[bool]) -> float:
+    total, weights = NAME_WEIGHT * name_score, NAME_WEIGHT
+    if phone_match is not None:
+        total, weights = total + PHONE_WEIGHT * phone_match, weights + PHONE_WEIGHT
+    if address_score is not None:
+        total, weights = total + ADDRESS_WEIGHT * address_score, weights + ADDRESS_WEIGHT
+    return total / weights
+
+
+class DuplicateDetector:
+    """Comparaison vectorisée des activités d'un même bloc"""
+
+    def __init__(self, name_vectorizer: Optional[TfidfVectorizer] = None):
+        self.name_vectorizer = name_vectorizer
+        self.address_vectorizer = HashingVectorizer(analyzer="char_wb", ngram_range=(3, 3),
+                                                    n_features=2 ** 18, alternate_sign=False)
+        self.stats = {"rows": 0, "blocks": 0, "candidate_pairs": 0, "proposals": 0}
+
+    def fit(self, names: Iterable[str]) -> None:
+        """Apprend le vocabulaire et l'IDF des trigrammes de noms"""
+        self.name_vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 3),
+                                               lowercase=True, strip_accents="unicode", sublinear_tf=True)
+        self.name_vectorizer.fit([name or "" for name in names])
+
+    def _candidate_pairs(self, names, phones: List[Optional[str]]) -> Iterator[Tuple[int, int, float]]:
+        """Paires (i, j, cosinus des noms) d'un bloc, i < j"""
+        count = names.shape[0]
+        seen = set()
+        for start in range(0, count, BLOCK_CHUNK_ROWS):
+            similarity = (names[start:start + BLOCK_CHUNK_ROWS] @ names.T).tocoo()
+            for row, column, value in zip(similarity.row, similarity.col, similarity.data):
+                i, j = start + int(row), int(column)
+                if i < j and value >= NAME_CANDIDATE_THRESHOLD:
+                    seen.add((i, j))
+                    yield i, j, float(value)
+
+        # Même téléphone, noms éloignés ("Pharmacie X" renommée)
+        by_phone: Dict[str, List[int]] = {}
+        for index, phone in enumerate(phones):
+            if phone is not None:
+                by_phone.setdefault(phone, []).append(index)
+        for indexes in by_phone.values():
+            for i, j in itertools.combinations(indexes, 2):
+                if (i, j) not in seen:
+                    yield i, j, float(names[i].multiply(names[j]).sum())
+
+    def compare_batch(self, blocks: List[List[Dict[str, Any]]]) -> List[MergeProposal]:
+        """Propositions de fusion pour des blocs lus ensemble (noms vectorisés en une fois)"""
+        rows = [row for block in blocks for row in block]
+        names = self.name_vectorizer.transform([row['name'] or "" for row in rows]).tocsr()
+        # Lignes normalisées (L2); une adresse absente donne une ligne vide
+        addresses = self.address_vectorizer.transform([row['address'] or "" for row in rows]).tocsr()
+        has_address = np.diff(addresses.indptr) > 0
+        phones = [{normalize_phone(row['phone_number']), normalize_phone(row['whatsapp_number'])} - {None}
+                  for row in rows]
+
+        proposals = []
+        offset = 0
+        for block in blocks:
+            size = len(block)
+            self.stats["blocks"] += 1
+            if size > 1:
+                block_phones = [min(phones[offset + index]) if phones[offset + index] else None
+                                for index in range(size)]
+                for i, j, name_score in self._candidate_pairs(names[offset:offset + size], block_phones):
+                    self.stats["candidate_pairs"] += 1
+                    first, second = offset + i, offset + j
+                    phone_match = bool(phones[first] & phones[second]) if phones[first] and phones[second] else None
+                    address_score = None
+                    if has_address[first] and has_address[second]:
+                        address_score = float(addresses[first].multiply(addresses[second]).sum())
+                    score = _pair_score(name_score, address_score, phone_match)
+                    if score >= MIN_PROPOSAL_SCORE:
+                        kept, duplicate = sorted((rows[first], rows[second]), key=_survivor_key)
+                        proposals.append(MergeProposal(kept['id'], duplicate['id'], round(score, 3),
+                                                       round(name_score, 3),
+                                                       None if address_score is None else round(address_score, 3),
+                                                       phone_match))
+            offset += size
+
+        self.stats["rows"] += len(rows)
+        self.stats["proposals"] += len(proposals)
+        return proposals
+
+    def detect(self, rows: Iterable[Dict[str, Any]]) -> Iterator[MergeProposal]:
+        """Propositions pour des lignes triées par bloc (block_type, block_cell)"""
+        batch: List[List[Dict[str, Any]]] = []
+        batch_rows = 0
+        for _, block in itertools.groupby(rows, key=lambda row: (row['block_type'], row['block_cell'])):
+            block = list(block)
+            batch.append(block)
+            batch_rows += len(block)
+            if batch_rows >= BATCH_ROWS:
+                yield from self.compare_batch(batch)
+                batch, batch_rows = [], 0
+        if batch:
+            yield from self.compare_batch(batch)
+
+
+def store_proposals(db, proposals: List[MergeProposal]) -> None:
+    db.execute(text(UPSERT_SQL), [proposal.__dict__ for proposal in proposals])
+    db.commit()
+
+
+def run_deduplication(session_factory=None) -> Dict[str, int]:
+    """Passe complète: une lecture en flux par grille de blocage, propositions écrites par lots"""
+    if session_factory is None:
+        from .new_models import SessionLocal as session_factory
+
+    start_time = time.time()
+    detector = DuplicateDetector()
+    stored = set()
+    with session_factory() as db:
+        detector.fit(row[0] for row in db.execute(text(NAME_SAMPLE_SQL), {"limit": IDF_SAMPLE_SIZE}))
+
+        with session_factory() as write_db:
+            for lat_offset, lon_offset in BLOCKING_GRIDS:
+                rows = db.execute(
+                    text(BLOCKS_SQL),
+                    {"lat_offset": lat_offset, "lon_offset": lon_offset, "precision": BLOCK_PRECISION},
+                    execution_options={"yield_per": BATCH_ROWS}
+                ).mappings()
+
+                pending = []
+                for proposal in detector.detect(rows):
+                    pair = (min(proposal.activity_id, proposal.duplicate_id),
+                            max(proposal.activity_id, proposal.duplicate_id))
+                    # Une paire trouvée par les deux grilles n'est écrite qu'une fois
+                    if pair in stored:
+                        continue
+                    stored.add(pair)
+                    pending.append(proposal)
+                    if len(pending) >= 1000:
+                        store_proposals(write_db, pending)
+                        pending = []
+                if pending:
+                    store_proposals(write_db, pending)
+
+    stats = dict(detector.stats, stored=len(stored))
+    logger.info("Détection des doublons: %s en %.1f s", stats, time.time() - start_time)
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_deduplication()
@@ -0,0 +1,288 @@
+"""
+Tuiles de demande: où les gens cherchent, et où ils ne trouvent rien
+
+Les positions des recherches (search_logs.user_location) sont comptées dans
+une grille multi-résolution: les cases de la grille sont les tuiles Web
+Mercator (z, x, y) des niveaux BIN_ZOOMS, par intention, avec le nombre de
+recherches et de recherches sans résultat. Les cases sont mises à jour
+incrémentalement depuis un filigrane sur created_at (même principe que
+backend/analytics_rollups.py).
+
+Une tuile de carte (z, x, y) contient les cases du niveau z + BIN_SHIFT
+(32 x 32 cases), en JSON compact par colonnes. Les tuiles demandées qui ont
+au moins une case visible sont conservées dans `demand_tiles` avec un ETag;
+une mise à jour des cases marque périmées les tuiles qui les contiennent, et
+elles sont recalculées en arrière-plan: une requête ne fait qu'une lecture par
+clé primaire. Une tuile vide n'est pas conservée (la table ne grossit pas avec
+les tuiles demandées au hasard) et une tuile devenue vide est supprimée.
+
+Une tuile est conservée avec le filigrane lu avant ses cases: si une mise à
+jour a avancé le filigrane depuis (ou est en cours), la tuile est conservée
+périmée et sera recalculée, au lieu d'effacer l'invalidation faite entre la
+lecture des cases et l'écriture.
+"""
+import hashlib
+import json
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+MAX_BIN_ZOOM = 17
+# Cases par côté de tuile: 2 ** BIN_SHIFT
+BIN_SHIFT = 5
+MIN_TILE_ZOOM = 4
+MAX_TILE_ZOOM = 16
+MIN_BIN_ZOOM = MIN_TILE_ZOOM + BIN_SHIFT
+# Cases moins fréquentées masquées (une recherche isolée révèle une position)
+MIN_BIN_SEARCHES = 3
+# Limite de latitude de la projection Web Mercator
+MAX_LATITUDE = 85.05112878
+
+UPDATE_INTERVAL_SECONDS = 60
+SAFETY_LAG_SECONDS = 60
+MAX_WINDOW_HOURS = 6
+RENDER_BATCH_SIZE = 500
+WATERMARK_NAME = 'demand_tiles'
+
+# Case du niveau le plus fin de chaque recherche de la fenêtre
+_POINTS_SQL = f"""
+SELECT COALESCE(sl.intent, 'unknown') AS intent, sl.results_count = 0 AS zero_result,
+       floor((ST_X(sl.user_location) + 180) / 360 * {2 ** MAX_BIN_ZOOM})::INT AS x,
+       floor((1 - ln(tan(radians(ST_Y(sl.user_location))) + 1 / cos(radians(ST_Y(sl.user_location)))) / pi())
+             / 2 * {2 ** MAX_BIN_ZOOM})::INT AS y
+FROM search_logs sl
+WHERE sl.created_at > :from_time AND sl.created_at <= :to_time
+  AND sl.user_location IS NOT NULL AND abs(ST_Y(sl.user_location)) < {MAX_LATITUDE}
+"""
+
+UPDATE_BINS_SQL = f"""
+WITH points AS ({_POINTS_SQL})
+INSERT INTO search_demand_bins AS b (zoom, x, y, intent, searches, zero_results)
+SELECT zoom, x >> ({MAX_BIN_ZOOM} - zoom), y >> ({MAX_BIN_ZOOM} - zoom), intent,
+       COUNT(*), COUNT(*) FILTER (WHERE zero_result)
+FROM points
+CROSS JOIN generate_series({MIN_BIN_ZOOM}, {MAX_BIN_ZOOM}) AS zoom
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (zoom, x, y, intent) DO UPDATE SET
+    searches = b.searches + EXCLUDED.searches,
+    zero_results = b.zero_results + EXCLUDED.zero_results
+"""
+
+# Tuiles conservées contenant une case modifiée
+MARK_STALE_SQL = f"""
+WITH points AS ({_POINTS_SQL}),
+touched AS (
+    SELECT DISTINCT z, x >> ({MAX_BIN_ZOOM} - z) AS x, y >> ({MAX_BIN_ZOOM} - z) AS y
+    FROM points
+    CROSS JOIN generate_series({MIN_TILE_ZOOM}, {MAX_TILE_ZOOM}) AS z
+)
+UPDATE demand_tiles t SET stale = TRUE
+FROM touched
+WHERE t.z = touched.z AND t.x = touched.x AND t.y = touched.y AND NOT t.stale
+"""
+
+WATERMARK_SQL = """
+INSERT INTO rollup_watermarks (name, processed_until)
+SELECT :name, COALESCE((SELECT MIN(created_at) FROM search_logs) - INTERVAL '1 microsecond', NOW())
+ON CONFLICT (name) DO NOTHING
+"""
+
+LOCK_WATERMARK_SQL = "SELECT processed_until FROM rollup_watermarks WHERE name = :name FOR UPDATE"
+
+TILE_BINS_SQL = """
+SELECT x, y, intent, searches, zero_results FROM search_demand_bins
+WHERE zoom = :zoom AND x BETWEEN :x_min AND :x_max AND y BETWEEN :y_min AND :y_max
+"""
+
+TILE_SQL = "SELECT body, etag, stale FROM demand_tiles WHERE z = :z AND x = :x AND y = :y"
+
+STORE_TILE_SQL = """
+INSERT INTO demand_tiles (z, x, y, body, etag, stale, rendered_at)
+VALUES (:z, :x, :y, :body, :etag, :stale, NOW())
+ON CONFLICT (z, x, y) DO UPDATE SET
+    body = EXCLUDED.body, etag = EXCLUDED.etag, stale = EXCLUDED.stale, rendered_at = EXCLUDED.rendered_at
+"""
+
+WATERMARK_VALUE_SQL = "SELECT processed_until FROM rollup_watermarks WHERE name = :name"
+
+# Verrou partagé jusqu'au commit: une mise à jour (FOR UPDATE) attend l'écriture de la tuile
+# et la marquera périmée; aucune ligne si une mise à jour est en cours
+SHARE_WATERMARK_SQL = "SELECT processed_until FROM rollup_watermarks WHERE name = :name FOR SHARE SKIP LOCKED"
+
+DELETE_TILE_SQL = "DELETE FROM demand_tiles WHERE z = :z AND x = :x AND y = :y"
+
+STALE_TILES_SQL = "SELECT z, x, y FROM demand_tiles WHERE stale LIMIT :limit"
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return MIN_TILE_ZOOM <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def render(z: int, x: int, y: int, rows) -> Tuple[str, int]:
+    """(tuile en JSON compact, nombre de cases visibles); une colonne par attribut,
+    positions relatives à la tuile
+
+    {"z", "x", "y", "bin_zoom", "size",
+     "bins": {"x": [...], "y": [...], "searches": [...], "zero_results": [...]},
+     "intents": {"<intention>": {"searches": [...], "zero_results": [...]}}}
+    """
+    bin_zoom = min(z + BIN_SHIFT, MAX_BIN_ZOOM)
+    shift = bin_zoom - z
+    bins: Dict[Tuple[int, int], Dict[str, Tuple[int, int]]] = {}
+    for row in rows:
+        key = (row["x"] - (x << shift), row["y"] - (y << shift))
+        bins.setdefault(key, {})[row["intent"]] = (int(row["searches"]), int(row["zero_results"]))
+
+    visible = sorted(key for key, intents in bins.items()
+                     if sum(searches for searches, _ in intents.values()) >= MIN_BIN_SEARCHES)
+    intent_names = sorted({intent for key in visible for intent in bins[key]})
+    body = {
+        "z": z, "x": x, "y": y, "bin_zoom": bin_zoom, "size": 2 ** shift,
+        "bins": {
+            "x": [key[0] for key in visible],
+            "y": [key[1] for key in visible],
+            "searches": [sum(value[0] for value in bins[key].values()) for key in visible],
+            "zero_results": [sum(value[1] for value in bins[key].values()) for key in visible],
+        },
+        "intents": {
+            intent: {
+                "searches": [bins[key].get(intent, (0, 0))[0] for key in visible],
+                "zero_results": [bins[key].get(intent, (0, 0))[1] for key in visible],
+            }
+            for intent in intent_names
+        },
+    }
+    return json.dumps(body, separators=(",", ":"), ensure_ascii=False), len(visible)
+
+
+def etag_of(body: str) -> str:
+    return '"' + hashlib.md5(body.encode("utf-8")).hexdigest() + '"'
+
+
+class DemandTiles:
+    """Mise à jour des cases, rendu et lecture des tuiles"""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"updates": 0, "rendered": 0, "empty": 0}
+
+    # -------------------------------------------------
+    # Mise à jour incrémentale
+    # -------------------------------------------------
+
+    def update(self, db) -> bool:
+        """Ajoute aux cases les recherches depuis le filigrane; True si la fenêtre était pleine
+
+        Cases, tuiles périmées et filigrane changent dans la même transaction:
+        chaque recherche est comptée une fois, même après un arrêt.
+        """
+        db.execute(text(WATERMARK_SQL), {"name": WATERMARK_NAME})
+        from_time = db.execute(text(LOCK_WATERMARK_SQL), {"name": WATERMARK_NAME}).scalar()
+        to_time, full = db.execute(text("""
+            SELECT LEAST(NOW() - make_interval(secs => :lag), CAST(:from_time AS TIMESTAMPTZ) + make_interval(hours => :hours)),
+                   NOW() - make_interval(secs => :lag) > CAST(:from_time AS TIMESTAMPTZ) + make_interval(hours => :hours)
+        """), {"lag": SAFETY_LAG_SECONDS, "from_time": from_time, "hours": MAX_WINDOW_HOURS}).one()
+        if to_time <= from_time:
+            db.rollback()
+            return False
+
+        window = {"from_time": from_time, "to_time": to_time}
+        db.execute(text(UPDATE_BINS_SQL), window)
+        db.execute(text(MARK_STALE_SQL), window)
+        db.execute(
+            text("UPDATE rollup_watermarks SET processed_until = :to_time, updated_at = NOW() WHERE name = :name"),
+            {"to_time": to_time, "name": WATERMARK_NAME}
+        )
+        db.commit()
+        self.stats["updates"] += 1
+        return full
+
+    # -------------------------------------------------
+    # Rendu et lecture
+    # -------------------------------------------------
+
+    def render_tile(self, db, z: int, x: int, y: int, stored: bool = False) -> Tuple[str, str]:
+        """Calcule la tuile à partir des cases et la conserve si elle n'est pas vide;
+        retourne (corps, ETag)"""
+        body, etag, _ = self._render(db, z, x, y, stored)
+        return body, etag
+
+    def _render(self, db, z: int, x: int, y: int, stored: bool) -> Tuple[str, str, bool]:
+        """(corps, ETag, à jour): à jour si la tuile conservée n'est pas périmée ou a été supprimée"""
+        # Filigrane lu avant les cases: toute mise à jour postérieure le fait avancer
+        watermark = db.execute(text(WATERMARK_VALUE_SQL), {"name": WATERMARK_NAME}).scalar()
+        bin_zoom = min(z + BIN_SHIFT, MAX_BIN_ZOOM)
+        shift = bin_zoom - z
+        rows = db.execute(text(TILE_BINS_SQL), {
+            "zoom": bin_zoom,
+            "x_min": x << shift, "x_max": ((x + 1) << shift) - 1,
+            "y_min": y << shift, "y_max": ((y + 1) << shift) - 1,
+        }).mappings().all()
+        body, visible = render(z, x, y, rows)
+        etag = etag_of(body)
+        if visible:
+            current = db.execute(text(SHARE_WATERMARK_SQL), {"name": WATERMARK_NAME}).first()
+            stale = current is None or current.processed_until != watermark
+            db.execute(text(STORE_TILE_SQL), {"z": z, "x": x, "y": y, "body": body, "etag": etag, "stale": stale})
+            db.commit()
+            self.stats["rendered"] += 1
+            return body, etag, not stale
+        # Tuile vide: recalculée à chaque demande (une lecture indexée des cases)
+        self.stats["empty"] += 1
+        if stored:
+            db.execute(text(DELETE_TILE_SQL), {"z": z, "x": x, "y": y})
+            db.commit()
+        return body, etag, True
+
+    def tile(self, db, z: int, x: int, y: int) -> Tuple[str, str]:
+        """Tuile conservée (même périmée: elle sera recalculée en arrière-plan), sinon calculée"""
+        row = db.execute(text(TILE_SQL), {"z": z, "x": x, "y": y}).first()
+        if row is not None:
+            return row.body, row.etag
+        return self.render_tile(db, z, x, y)
+
+    def render_stale(self, db, limit: int = RENDER_BATCH_SIZE) -> int:
+        """Recalcule des tuiles périmées; retourne le nombre de tuiles remises à jour"""
+        tiles = db.execute(text(STALE_TILES_SQL), {"limit": limit}).all()
+        # Une tuile encore périmée (mise à jour concurrente) sera reprise au prochain passage
+        return sum(self._render(db, z, x, y, stored=True)[2] for z, x, y in tiles)
+
+    # -------------------------------------------------
+    # Exécution périodique
+    # -------------------------------------------------
+
+    def run_once(self, session_factory) -> None:
+        with session_factory() as db:
+            # Rattrapage d'un retard: fenêtres successives jusqu'au présent
+            while self.update(db):
+                pass
+            while self.render_stale(db) == RENDER_BATCH_SIZE:
+                pass
+
+    def start(self, session_factory, interval: float = UPDATE_INTERVAL_SECONDS) -> None:
+        """Met à jour périodiquement dans un thread dédié"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.run_once(session_factory)
+                except Exception:
+                    logger.exception("Échec de la mise à jour des tuiles de demande")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="demand-tiles", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+demand_tiles = DemandTiles()
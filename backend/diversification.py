@@ -0,0 +1,119 @@
+"""
+Diversification des résultats classés (pertinence marginale maximale, MMR)
+
+`rank_results` place souvent en tête plusieurs résultats quasi identiques
+(même type, même zone, noms proches: plusieurs "Hôpital Sainte-Anne"). Les
+premières positions sont réordonnées par MMR: à chaque position, on retient le
+candidat qui maximise
+
+    lambda * pertinence - (1 - lambda) * similarité maximale aux déjà retenus
+
+La similarité combine le type d'activité, la zone et les mots communs du nom
+(cosinus); c'est un produit scalaire sur la matrice des candidats, calculé
+pour les seuls candidats retenus.
+lambda = 1 conserve l'ordre de pertinence.
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .text_normalization import fold
+
+# Candidats considérés (les suivants gardent leur ordre)
+MAX_CANDIDATES = 200
+# Positions réordonnées
+DIVERSIFY_TOP_K = 20
+
+DEFAULT_LAMBDA = 0.8
+# lambda par intention; les intentions absentes (accès à un lieu précis) ne sont pas diversifiées
+INTENT_LAMBDAS: Dict[str, float] = {
+    'search_activity': 0.7,
+    'compare_activities': 0.6,
+    'find_by_service': 0.7,
+    'find_open_now': 0.8,
+}
+
+# Poids des composantes de la similarité (somme 1)
+TYPE_WEIGHT = 0.4
+ZONE_WEIGHT = 0.3
+NAME_WEIGHT = 0.3
+
+
+@lru_cache(maxsize=65536)
+def _name_words(name: str) -> Tuple[str, ...]:
+    return tuple(set(fold(name).split()))
+
+
+def _indicators(values: Sequence[Optional[int]], weight: float) -> np.ndarray:
+    """Colonnes indicatrices d'un identifiant (absent: ligne nulle)"""
+    codes = np.array([-1 if value is None else value for value in values])
+    distinct, inverse = np.unique(codes, return_inverse=True)
+    columns = np.zeros((len(codes), len(distinct)), dtype=np.float32)
+    columns[np.arange(len(codes)), inverse] = weight ** 0.5
+    columns[codes == -1] = 0.0
+    return columns
+
+
+def candidate_features(items: Sequence[Any]) -> np.ndarray:
+    """Matrice des candidats dont le produit scalaire de deux lignes est leur similarité
+
+    Colonnes: type et zone en indicatrices (poids TYPE_WEIGHT, ZONE_WEIGHT),
+    mots du nom normalisés (cosinus, poids NAME_WEIGHT). Un type ou une zone
+    absents ne rapprochent pas deux candidats.
+    """
+    names = [_name_words(getattr(item, 'name', None) or '') for item in items]
+    counts = np.fromiter((len(words) for words in names), dtype=np.intp, count=len(names))
+    flat = [word for words in names for word in words]
+    vocabulary = {word: column for column, word in enumerate(dict.fromkeys(flat))}
+    words = np.zeros((len(items), max(len(vocabulary), 1)), dtype=np.float32)
+    words[np.repeat(np.arange(len(items)), counts), [vocabulary[word] for word in flat]] = \
+        np.repeat(np.sqrt(NAME_WEIGHT / np.maximum(counts, 1)), counts)
+
+    return np.hstack((
+        _indicators([getattr(item, 'activity_type_id', None) for item in items], TYPE_WEIGHT),
+        _indicators([getattr(item, 'zone_id', None) for item in items], ZONE_WEIGHT),
+        words,
+    ))
+
+
+def mmr_order(relevance: np.ndarray, features: np.ndarray, lambda_: float, top_k: int) -> List[int]:
+    """Indices des top_k candidats retenus par MMR, dans l'ordre de sélection
+
+    Seules les lignes de similarité des candidats retenus sont calculées.
+    """
+    top_k = min(top_k, len(relevance))
+    selected: List[int] = []
+    weighted_relevance = (lambda_ * relevance).astype(np.float32)
+    max_similarity = np.zeros(len(relevance), dtype=np.float32)
+    for _ in range(top_k):
+        chosen = int(np.argmax(weighted_relevance - (1 - lambda_) * max_similarity))
+        selected.append(chosen)
+        weighted_relevance[chosen] = -np.inf
+        np.maximum(max_similarity, features @ features[chosen], out=max_similarity)
+    return selected
+
+
+def diversify(items: List[Any], lambda_: float = DEFAULT_LAMBDA, top_k: int = DIVERSIFY_TOP_K,
+              max_candidates: int = MAX_CANDIDATES) -> List[Any]:
+    """Réordonne les premières positions d'une liste classée par `relevance_score`"""
+    if lambda_ >= 1 or len(items) < 2:
+        return items
+    candidates = items[:max_candidates]
+    scores = np.array([float(getattr(item, 'relevance_score', 0) or 0) for item in candidates], dtype=np.float32)
+    # Pertinence ramenée à [0, 1] pour être comparable à la similarité
+    spread = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+    order = mmr_order(relevance, candidate_features(candidates), lambda_, top_k)
+    chosen = set(order)
+    return [candidates[index] for index in order] \
+        + [item for index, item in enumerate(candidates) if index not in chosen] \
+        + items[max_candidates:]
+
+
+def lambda_for(intent: str, overrides: Optional[Dict[str, float]] = None) -> Optional[float]:
+    """lambda de l'intention (None: pas de diversification)"""
+    if overrides and intent in overrides:
+        return overrides[intent]
+    return INTENT_LAMBDAS.get(intent)
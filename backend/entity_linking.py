@@ -0,0 +1,210 @@
+"""
+Liaison des entités nommées de la requête aux activités, zones et villes
+
+"numéro du Maquis Doho" ou "horaires de l'Hôpital Saint-Paul" désignent un
+lieu précis. Un automate d'Aho-Corasick construit sur tous les noms (et slugs)
+d'activités, de zones et de villes repère en un seul passage sur la requête
+repliée (minuscules, sans accents) toutes les mentions connues, qui sont
+résolues en identifiants.
+
+L'automate n'accepte pas d'insertion: il est reconstruit en arrière-plan
+quand des activités ou des zones changent, l'ancien restant en service
+jusqu'à la substitution.
+"""
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from .text_normalization import fold
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY = "activity"
+ZONE = "zone"
+CITY = "city"
+
+# Un nom d'un seul mot plus court que ceci est trop ambigu pour être lié
+MIN_SINGLE_WORD_LENGTH = 5
+# Délai de regroupement des modifications avant reconstruction
+REBUILD_DELAY_SECONDS = 2.0
+
+NAMES_SQL = {
+    ACTIVITY: "SELECT id, name, slug FROM activities WHERE is_active = true",
+    ZONE: "SELECT id, name, NULL AS slug FROM zones",
+    CITY: "SELECT id, name, NULL AS slug FROM cities",
+}
+
+Payload = Tuple[str, int, str]
+
+
+class AhoCorasick:
+    """Automate de recherche simultanée de plusieurs motifs"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, Payload]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Motifs reconnus dans chaque état: (longueur, charge utile)
+        self._out: List[List[Tuple[int, Payload]]] = [[]]
+        self.size = 0
+
+        for pattern, payload in patterns:
+            self._add(pattern, payload)
+        self._link()
+
+    def _add(self, pattern: str, payload: Payload) -> None:
+        state = 0
+        for char in pattern:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = following
+        self._out[state].append((len(pattern), payload))
+        self.size += 1
+
+    def _link(self) -> None:
+        # Parcours en largeur: le lien d'échec d'un état pointe vers son plus long suffixe connu
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[following] = target if target != following else 0
+                self._out[following] = self._out[following] + self._out[self._fail[following]]
+
+    def find(self, haystack: str) -> List[Tuple[int, int, Payload]]:
+        """Toutes les occurrences (début, fin exclue, charge utile)"""
+        matches = []
+        state = 0
+        for index, char in enumerate(haystack):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, payload in self._out[state]:
+                matches.append((index + 1 - length, index + 1, payload))
+        return matches
+
+
+class EntityLinker:
+    """Reconnaît les lieux nommés d'une requête"""
+
+    def __init__(self, stopwords: Iterable[str] = (), rebuild_delay: float = REBUILD_DELAY_SECONDS):
+        # Mots génériques ("pharmacie", "maquis"...) qui ne désignent pas une activité précise
+        self.stopwords: Set[str] = {fold(word) for word in stopwords}
+        self.rebuild_delay = rebuild_delay
+        self._automaton = AhoCorasick(())
+        self._session_factory = None
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self.stats = {"queries": 0, "linked": 0, "rebuilds": 0}
+
+    @property
+    def size(self) -> int:
+        return self._automaton.size
+
+    def _patterns(self, kind: str, row) -> List[Tuple[str, Payload]]:
+        patterns = []
+        for value in (row['name'], (row.get('slug') or '').replace('-', ' ')):
+            folded = fold(value or '')
+            if not folded or (kind == ACTIVITY and folded in self.stopwords):
+                continue
+            if " " not in folded and len(folded) < MIN_SINGLE_WORD_LENGTH:
+                continue
+            if all(pattern != folded for pattern, _ in patterns):
+                patterns.append((folded, (kind, row['id'], row['name'])))
+        return patterns
+
+    def build(self, rows_by_kind: Dict[str, Iterable[Any]]) -> None:
+        """Construit un nouvel automate puis le substitue à l'ancien"""
+        patterns = []
+        for kind, rows in rows_by_kind.items():
+            for row in rows:
+                patterns.extend(self._patterns(kind, row))
+        self._automaton = AhoCorasick(patterns)
+        self.stats["rebuilds"] += 1
+
+    def load(self, db) -> None:
+        """Construit l'automate à partir de la base"""
+        self.build({kind: db.execute(text(sql)).mappings().all() for kind, sql in NAMES_SQL.items()})
+        logger.info("Automate de liaison d'entités: %d noms", self.size)
+
+    # -------------------------------------------------
+    # Liaison
+    # -------------------------------------------------
+
+    def link(self, query: str) -> Dict[str, List[int]]:
+        """Identifiants des lieux nommés: {"activity_ids": [...], "zone_ids": [...], "city_ids": [...]}"""
+        self.stats["queries"] += 1
+        haystack = fold(query)
+        candidates = []
+        for start, end, payload in self._automaton.find(haystack):
+            # Mots entiers uniquement: "bar" ne doit pas être trouvé dans "barbier"
+            if (start == 0 or haystack[start - 1] == " ") and (end == len(haystack) or haystack[end] == " "):
+                candidates.append((start, end, payload))
+
+        # Plus longue mention à gauche d'abord; les homonymes d'une même mention sont conservés
+        candidates.sort(key=lambda match: (match[0], -(match[1] - match[0])))
+        linked: Dict[str, List[int]] = {}
+        covered_until = -1
+        kept_span = None
+        for start, end, (kind, entity_id, _) in candidates:
+            if (start, end) != kept_span:
+                if start < covered_until:
+                    continue
+                kept_span, covered_until = (start, end), end
+            ids = linked.setdefault(f"{kind}_ids", [])
+            if entity_id not in ids:
+                ids.append(entity_id)
+
+        if linked:
+            self.stats["linked"] += 1
+        return linked
+
+    # -------------------------------------------------
+    # Reconstruction en arrière-plan
+    # -------------------------------------------------
+
+    def schedule_rebuild(self) -> None:
+        """Reconstruit l'automate après un court délai (les rafales sont regroupées)"""
+        if self._session_factory is None:
+            return
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Timer(self.rebuild_delay, self._rebuild)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _rebuild(self) -> None:
+        # Une modification reçue pendant la lecture programme une nouvelle reconstruction
+        with self._lock:
+            self._timer = None
+        try:
+            with self._session_factory() as db:
+                self.load(db)
+        except Exception:
+            logger.exception("Échec de reconstruction de l'automate de liaison d'entités")
+
+    def register_change_feed(self, feed=None, session_factory=None) -> None:
+        """Reconstruit l'automate quand des noms d'activités, de zones ou de villes changent"""
+        if feed is None:
+            from .change_feed import change_feed as feed
+        if session_factory is None:
+            from .new_models import SessionLocal as session_factory
+        self._session_factory = session_factory
+
+        def on_change(event) -> None:
+            if event.is_reset or event.touches("name", "slug", "is_active"):
+                self.schedule_rebuild()
+
+        feed.register(("activities", "zones"), on_change)
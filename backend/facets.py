@@ -0,0 +1,106 @@
+"""
+Comptes par facette (type, catégorie, prix, ouverture, zone) des résultats de recherche
+
+Les comptes sont calculés dans le même aller-retour que les résultats: la
+requête filtrée devient une CTE `candidates`, agrégée par GROUPING SETS, et
+le JSON des comptes est joint à chaque ligne renvoyée. Les recherches très
+larges sont plafonnées à FACET_CANDIDATE_LIMIT candidats (les mieux classés):
+les comptes sont alors marqués comme tronqués.
+
+Pour les lignes déjà en mémoire (relance, meilleurs choix précalculés), les
+comptes sont faits en Python sur ces lignes.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+FACET_CANDIDATE_LIMIT = 1000
+
+# Facette -> (colonne de valeur, colonne de libellé)
+FACETS = {
+    'activity_type': ('activity_type_id', 'activity_type_name'),
+    'category': ('category_id', 'category_name'),
+    'price_level': ('price_level', None),
+    'is_open': ('is_open', None),
+    'zone': ('zone_id', 'zone_name'),
+}
+
+# Colonnes ajoutées aux lignes par FACETED_QUERY
+FACET_COLUMNS = ('facets', 'facet_candidates')
+
+# {candidates}: requête filtrée et triée, terminée par LIMIT :facet_limit
+FACETED_QUERY = """
+WITH candidates AS MATERIALIZED ({candidates}),
+facet_counts AS (
+    SELECT
+        CASE
+            WHEN GROUPING(activity_type_id) = 0 THEN 'activity_type'
+            WHEN GROUPING(category_id) = 0 THEN 'category'
+            WHEN GROUPING(price_level) = 0 THEN 'price_level'
+            WHEN GROUPING(is_open) = 0 THEN 'is_open'
+            ELSE 'zone'
+        END AS facet,
+        COALESCE(activity_type_id::TEXT, category_id::TEXT, price_level::TEXT, is_open::TEXT, zone_id::TEXT) AS value,
+        COALESCE(activity_type_name, category_name, zone_name) AS label,
+        COUNT(*) AS count
+    FROM candidates
+    GROUP BY GROUPING SETS (
+        (activity_type_id, activity_type_name),
+        (category_id, category_name),
+        (price_level),
+        (is_open),
+        (zone_id, zone_name)
+    )
+)
+SELECT
+    c.*,
+    (SELECT COUNT(*) FROM candidates) AS facet_candidates,
+    (SELECT json_agg(json_build_object('facet', facet, 'value', value, 'label', label, 'count', count))
+     FROM facet_counts) AS facets
+FROM candidates c
+-- Même ordre que la requête de recherche
+ORDER BY
+    CASE WHEN c.is_open = TRUE THEN 0 ELSE 1 END,
+    c.verification_level DESC,
+    c.rating DESC,
+    c.distance ASC,
+    c.review_count DESC,
+    c.created_at DESC
+LIMIT :limit
+"""
+
+
+def _sorted(facets: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+    return {name: sorted(values, key=lambda value: -value['count']) for name, values in facets.items()}
+
+
+def _parse_value(facet: str, value: Optional[str]) -> Any:
+    if value is None:
+        return None
+    if facet == 'is_open':
+        return value == 'true'
+    return int(value)
+
+
+def facets_from_rows(rows: List[Dict[str, Any]], use_database_counts: bool = True) -> Dict[str, Any]:
+    """Comptes par facette: ceux calculés par la base si présents, sinon comptés sur les lignes
+
+    use_database_counts=False pour des lignes filtrées en mémoire: les comptes
+    joints par la base portent sur la recherche d'origine.
+    """
+    facets: Dict[str, List[Dict[str, Any]]] = {name: [] for name in FACETS}
+
+    if use_database_counts and rows and rows[0].get('facets') is not None:
+        for entry in rows[0]['facets']:
+            facets[entry['facet']].append({
+                'value': _parse_value(entry['facet'], entry['value']),
+                'label': entry['label'],
+                'count': entry['count'],
+            })
+        candidates = rows[0].get('facet_candidates') or 0
+        return {'counts': _sorted(facets), 'candidates': candidates,
+                'truncated': candidates >= FACET_CANDIDATE_LIMIT}
+
+    for name, (value_column, label_column) in FACETS.items():
+        counts = Counter((row.get(value_column), row.get(label_column) if label_column else None) for row in rows)
+        facets[name] = [{'value': value, 'label': label, 'count': count} for (value, label), count in counts.items()]
+    return {'counts': _sorted(facets), 'candidates': len(rows), 'truncated': False}
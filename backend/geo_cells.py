@@ -0,0 +1,103 @@
+"""
+Découpage de la carte en cellules (geohash) pour regrouper les positions proches
+"""
+from typing import List, Optional, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {char: index for index, char in enumerate(_BASE32)}
+
+# Précision 6 ≈ 1,2 km x 0,6 km, précision 7 ≈ 150 m x 150 m
+DEFAULT_PRECISION = 6
+
+
+def encode(latitude: float, longitude: float, precision: int = DEFAULT_PRECISION) -> str:
+    """Encode une position en geohash"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            middle = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= middle:
+                bits = (bits << 1) | 1
+                lon_range[0] = middle
+            else:
+                bits <<= 1
+                lon_range[1] = middle
+        else:
+            middle = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= middle:
+                bits = (bits << 1) | 1
+                lat_range[0] = middle
+            else:
+                bits <<= 1
+                lat_range[1] = middle
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def bounds(cell: str) -> Tuple[float, float, float, float]:
+    """Retourne (lat_min, lon_min, lat_max, lon_max) d'une cellule"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+
+    for char in cell:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            middle = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = middle
+            else:
+                target[1] = middle
+            even = not even
+
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def center(cell: str) -> Tuple[float, float]:
+    """Retourne le centre (latitude, longitude) d'une cellule"""
+    lat_min, lon_min, lat_max, lon_max = bounds(cell)
+    return (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Hauteur et largeur (degrés) d'une cellule"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def covering(lat_min: float, lon_min: float, lat_max: float, lon_max: float,
+             precision: int = DEFAULT_PRECISION) -> List[str]:
+    """Cellules qui recouvrent un rectangle"""
+    height, width = cell_size(precision)
+    cells = []
+    for row in range(int((lat_min + 90) // height), int((lat_max + 90) // height) + 1):
+        for column in range(int((lon_min + 180) // width), int((lon_max + 180) // width) + 1):
+            latitude = min(-90 + (row + 0.5) * height, 90.0)
+            longitude = min(-180 + (column + 0.5) * width, 180.0)
+            cells.append(encode(latitude, longitude, precision))
+    return cells
+
+
+def location_cell(latitude: Optional[float], longitude: Optional[float],
+                  precision: int = DEFAULT_PRECISION) -> Optional[str]:
+    """Cellule d'une position utilisateur, ou None si la position est inconnue"""
+    if latitude is None or longitude is None:
+        return None
+    if not latitude and not longitude:
+        return None
+    return encode(float(latitude), float(longitude), precision)
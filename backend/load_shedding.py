@@ -0,0 +1,257 @@
+"""
+Délestage et repli sur des résultats périmés quand la base de données ralentit
+
+Trois mécanismes protègent le pool de workers pendant un incident Postgres:
+
+- `AdmissionController`: limite le nombre de recherches simultanées par worker
+  et rejette immédiatement l'excédent avec un délai de nouvelle tentative;
+- `CircuitBreaker`: chaque appel SQL dispose d'un budget de latence; après
+  plusieurs dépassements ou erreurs consécutifs, le circuit s'ouvre et les
+  recherches ne touchent plus la base pendant la durée de refroidissement;
+- `StaleResultCache`: conserve les derniers résultats valides par clé de
+  recherche (requête, filtres, cellule) et une liste de repli par zone, servis
+  marqués comme périmés quand la base est indisponible.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+SEARCH_LATENCY_BUDGET_MS = int(os.getenv("SEARCH_LATENCY_BUDGET_MS", "800"))
+SEARCH_MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", "32"))
+
+# Préfixe geohash utilisé pour la liste de repli par zone (≈ 5 km x 5 km)
+ZONE_CELL_PRECISION = 5
+
+
+class Overloaded(Exception):
+    """Requête rejetée: le client doit réessayer après `retry_after` secondes"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = max(1, int(round(retry_after)))
+
+
+class DatabaseUnavailable(Exception):
+    """La base de données n'a pas répondu dans le budget de latence"""
+
+
+class CircuitOpen(DatabaseUnavailable):
+    """Le circuit est ouvert: la base n'est pas interrogée"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Circuit ouvert")
+        self.retry_after = retry_after
+
+
+# =====================================================
+# CONTRÔLE D'ADMISSION
+# =====================================================
+
+class AdmissionController:
+    """Borne le nombre de recherches en cours dans le worker"""
+
+    def __init__(self, max_concurrency: int = SEARCH_MAX_CONCURRENCY, retry_after: float = 1.0):
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.stats = {"admitted": 0, "rejected": 0}
+
+    @contextmanager
+    def admit(self):
+        """Réserve une place ou lève Overloaded sans attendre"""
+        if not self._semaphore.acquire(blocking=False):
+            self.stats["rejected"] += 1
+            raise Overloaded("Trop de recherches en cours", self.retry_after)
+        self.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+# =====================================================
+# DISJONCTEUR
+# =====================================================
+
+class CircuitBreaker:
+    """Disjoncteur à trois états (fermé, ouvert, semi-ouvert)"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, latency_budget_ms: int = SEARCH_LATENCY_BUDGET_MS,
+                 failure_threshold: int = 5, cooldown_seconds: float = 10.0,
+                 errors: Tuple[type, ...] = (Exception,)):
+        self.latency_budget_ms = latency_budget_ms
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.errors = errors
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {"calls": 0, "failures": 0, "slow_calls": 0, "short_circuited": 0, "trips": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def retry_after(self) -> float:
+        """Temps restant avant la prochaine tentative sur la base"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.cooldown_seconds - (time.monotonic() - self._opened_at))
+
+    def _before_call(self) -> None:
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN or (state == self.HALF_OPEN and self._probe_in_flight):
+                self.stats["short_circuited"] += 1
+                remaining = self.cooldown_seconds - (time.monotonic() - self._opened_at)
+                raise CircuitOpen(max(remaining, 1.0))
+            if state == self.HALF_OPEN:
+                # Une seule requête sonde la base avant de refermer le circuit
+                self._probe_in_flight = True
+            self.stats["calls"] += 1
+
+    def _record(self, success: bool) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+            if success:
+                self._failures = 0
+                self._state = self.CLOSED
+                return
+
+            self._failures += 1
+            self.stats["failures"] += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.stats["trips"] += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def _release_probe(self) -> None:
+        # Erreur applicative: l'état du circuit n'est pas modifié
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _after_success(self, start: float) -> None:
+        # Un appel réussi mais hors budget compte comme un échec
+        slow = (time.monotonic() - start) * 1000 > self.latency_budget_ms
+        if slow:
+            self.stats["slow_calls"] += 1
+        self._record(not slow)
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """Exécute fn sous la surveillance du disjoncteur"""
+        self._before_call()
+        start = time.monotonic()
+        try:
+            result = fn()
+        except self.errors as error:
+            self._record(False)
+            raise DatabaseUnavailable(str(error)) from error
+        except BaseException:
+            self._release_probe()
+            raise
+
+        self._after_success(start)
+        return result
+
+    async def call_async(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Variante asynchrone de call(), le budget est aussi imposé côté client"""
+        self._before_call()
+        start = time.monotonic()
+        try:
+            # Marge au-delà du statement_timeout pour couvrir un réseau bloqué
+            result = await asyncio.wait_for(fn(), timeout=self.latency_budget_ms / 1000 * 2)
+        except (asyncio.TimeoutError,) + tuple(self.errors) as error:
+            self._record(False)
+            raise DatabaseUnavailable(str(error) or "Délai dépassé") from error
+        except BaseException:
+            self._release_probe()
+            raise
+
+        self._after_success(start)
+        return result
+
+
+# =====================================================
+# RÉSULTATS PÉRIMÉS
+# =====================================================
+
+class StaleResultCache:
+    """Derniers résultats valides par clé de recherche et par zone"""
+
+    def __init__(self, max_keys: int = 5000, max_zones: int = 500, zone_top_n: int = 20):
+        self.max_keys = max_keys
+        self.max_zones = max_zones
+        self.zone_top_n = zone_top_n
+        self._lock = threading.Lock()
+        self._by_key: "OrderedDict[Tuple, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._by_zone: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self.stats = {"hits": 0, "zone_hits": 0, "misses": 0}
+
+    @staticmethod
+    def _zone_of(key: Tuple) -> Optional[str]:
+        cell = key[-1] if key else None
+        return cell[:ZONE_CELL_PRECISION] if cell else None
+
+    def remember(self, key: Tuple, rows: List[Dict[str, Any]]) -> None:
+        """Enregistre le résultat d'une recherche réussie"""
+        now = time.time()
+        zone = self._zone_of(key)
+
+        with self._lock:
+            self._by_key[key] = (now, rows)
+            self._by_key.move_to_end(key)
+            while len(self._by_key) > self.max_keys:
+                self._by_key.popitem(last=False)
+
+            if zone is None or not rows:
+                return
+
+            # Fusion dans la liste de repli de la zone, triée par note
+            _, previous = self._by_zone.get(zone, (now, []))
+            merged = {row.get('id'): row for row in previous}
+            merged.update((row.get('id'), row) for row in rows)
+            top = sorted(
+                merged.values(),
+                key=lambda row: (bool(row.get('is_open')), float(row.get('rating') or 0), row.get('review_count') or 0),
+                reverse=True
+            )[:self.zone_top_n]
+            self._by_zone[zone] = (now, top)
+            self._by_zone.move_to_end(zone)
+            while len(self._by_zone) > self.max_zones:
+                self._by_zone.popitem(last=False)
+
+    def lookup(self, key: Tuple) -> Optional[Tuple[str, float, List[Dict[str, Any]]]]:
+        """Retourne (source, horodatage, lignes) ou None"""
+        with self._lock:
+            entry = self._by_key.get(key)
+            if entry is not None:
+                self.stats["hits"] += 1
+                return "query", entry[0], entry[1]
+
+            zone = self._zone_of(key)
+            entry = self._by_zone.get(zone) if zone else None
+            if entry is not None:
+                self.stats["zone_hits"] += 1
+                return "zone_top", entry[0], entry[1]
+
+            self.stats["misses"] += 1
+            return None
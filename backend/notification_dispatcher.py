@@ -0,0 +1,403 @@
+"""
+Envoi des notifications par lots, regroupées par utilisateur
+
+Les notifications sont écrites dans `notifications` (alertes, insights...) avec
+delivery_status = 'pending'. Le dispatcher:
+
+- réserve un lot de notifications dues (FOR UPDATE SKIP LOCKED): plusieurs
+  dispatchers se partagent la file sans se bloquer. La réservation est un bail
+  (next_attempt_at = maintenant + CLAIM_LEASE_SECONDS): un dispatcher arrêté
+  en cours d'envoi libère ses notifications à l'expiration du bail;
+- regroupe les notifications d'un même utilisateur en un seul message
+  (récapitulatif): un SMS/WhatsApp par utilisateur et par lot;
+- envoie via un fournisseur interchangeable, avec un nombre borné d'envois
+  simultanés et un débit limité (seau à jetons);
+- enregistre les résultats du lot en une requête: envoyée, ou nouvelle
+  tentative avec attente exponentielle, ou échec définitif après MAX_ATTEMPTS.
+
+Le worker exige un fournisseur explicite (NOTIFICATION_PROVIDER): sans lui,
+les notifications seraient marquées envoyées sans l'être. `StubProvider`
+n'envoie rien (latence et taux d'échec simulés): il sert aux tests et à la
+mesure du débit hors ligne, jamais au worker.
+
+    NOTIFICATION_PROVIDER=gateway python -m backend.notification_dispatcher   # worker
+    python -m backend.notification_dispatcher bench 20000   # débit, sans base ni réseau
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+POLL_INTERVAL_SECONDS = 5
+CLAIM_LEASE_SECONDS = 300
+MAX_CONCURRENT_SENDS = int(os.getenv("NOTIFICATION_MAX_CONCURRENCY", "16"))
+# Débit maximal du fournisseur (messages par seconde) et rafale admise
+RATE_PER_SECOND = float(os.getenv("NOTIFICATION_RATE_PER_SECOND", "20"))
+RATE_BURST = 40
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+# Récapitulatif: lignes détaillées au plus, longueur maximale du message
+MAX_DIGEST_ITEMS = 5
+MAX_MESSAGE_LENGTH = 1000
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+# Colonne de notifications qui trace l'envoi, par canal
+CHANNEL_FLAGS = {'sms': 'is_sms_sent', 'whatsapp': 'is_sms_sent', 'push': 'is_push_sent', 'email': 'is_email_sent'}
+
+CLAIM_SQL = f"""
+WITH due AS (
+    SELECT id, created_at, user_id
+    FROM notifications
+    WHERE delivery_status IN ('{STATUS_PENDING}', '{STATUS_SENDING}') AND next_attempt_at <= NOW()
+    ORDER BY next_attempt_at
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE notifications n
+SET delivery_status = '{STATUS_SENDING}', next_attempt_at = NOW() + make_interval(secs => :lease)
+FROM due
+LEFT JOIN users u ON u.id = due.user_id
+WHERE n.id = due.id AND n.created_at = due.created_at
+RETURNING n.id, n.created_at, n.user_id, n.title, n.message, n.delivery_attempts,
+          u.phone_number, u.is_active AS user_active
+"""
+
+RECORD_SQL = """
+UPDATE notifications n
+SET delivery_status = r.status,
+    delivery_attempts = n.delivery_attempts + r.attempted,
+    next_attempt_at = NOW() + make_interval(secs => r.delay),
+    delivered_at = CASE WHEN r.status = 'sent' THEN NOW() ELSE n.delivered_at END,
+    delivery_error = r.error,
+    {flag} = n.{flag} OR r.status = 'sent'
+FROM unnest(CAST(:ids AS INTEGER[]), CAST(:created_at AS TIMESTAMPTZ[]), CAST(:statuses AS VARCHAR[]),
+            CAST(:attempted AS INTEGER[]), CAST(:delays AS FLOAT[]), CAST(:errors AS TEXT[]))
+     AS r(id, created_at, status, attempted, delay, error)
+WHERE n.id = r.id AND n.created_at = r.created_at
+"""
+
+
+# =====================================================
+# FOURNISSEURS
+# =====================================================
+
+class DeliveryError(Exception):
+    """Échec d'envoi; retryable=False pour un refus définitif (numéro invalide...)"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class NotificationProvider(ABC):
+    """Interface d'un fournisseur: un message texte vers un destinataire"""
+
+    channel = 'sms'
+
+    @abstractmethod
+    def send(self, recipient: str, body: str) -> None:
+        """Envoie le message; lève DeliveryError en cas d'échec"""
+
+
+class StubProvider(NotificationProvider):
+    """Fournisseur local (tests, mesure du débit): n'envoie rien, simule latence et échecs"""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, channel: str = 'sms'):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.channel = channel
+        self.sent: deque = deque(maxlen=1000)
+        self.stats = {"sent": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def send(self, recipient: str, body: str) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.failure_rate and random.random() < self.failure_rate:
+                self.stats["failed"] += 1
+                raise DeliveryError("Échec simulé")
+            self.stats["sent"] += 1
+            self.sent.append((recipient, body))
+
+
+class GatewayProvider(NotificationProvider):
+    """Passerelle HTTP SMS/WhatsApp: POST {"to", "text", "channel"} en JSON"""
+
+    def __init__(self, url: Optional[str] = None, token: Optional[str] = None, channel: Optional[str] = None,
+                 timeout: float = 10.0):
+        import httpx
+
+        self.url = url or os.environ["NOTIFICATION_GATEWAY_URL"]
+        self.channel = channel or os.getenv("NOTIFICATION_GATEWAY_CHANNEL", "whatsapp")
+        token = token or os.getenv("NOTIFICATION_GATEWAY_TOKEN")
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._client = httpx.Client(timeout=timeout, headers=headers)
+        self._transport_errors = (httpx.TransportError,)
+
+    def send(self, recipient: str, body: str) -> None:
+        try:
+            response = self._client.post(self.url, json={"to": recipient, "text": body, "channel": self.channel})
+        except self._transport_errors as error:
+            raise DeliveryError(f"Passerelle injoignable: {error}")
+        if response.status_code == 429 or response.status_code >= 500:
+            raise DeliveryError(f"Passerelle indisponible ({response.status_code})")
+        if response.status_code >= 400:
+            raise DeliveryError(f"Refusé par la passerelle ({response.status_code}): {response.text[:200]}",
+                                retryable=False)
+
+
+# Fournisseurs réels utilisables par le worker (StubProvider en est exclu)
+PROVIDERS: Dict[str, Callable[[], NotificationProvider]] = {
+    'gateway': GatewayProvider,
+}
+
+
+def provider_from_env() -> NotificationProvider:
+    """Fournisseur choisi par NOTIFICATION_PROVIDER; aucun fournisseur par défaut"""
+    name = os.getenv("NOTIFICATION_PROVIDER")
+    if not name:
+        raise RuntimeError("NOTIFICATION_PROVIDER non défini: aucun fournisseur de notifications configuré")
+    if name not in PROVIDERS:
+        raise RuntimeError(f"Fournisseur de notifications inconnu: {name} (disponibles: {', '.join(PROVIDERS)})")
+    return PROVIDERS[name]()
+
+
+# =====================================================
+# DÉBIT ET RÉCAPITULATIFS
+# =====================================================
+
+class TokenBucket:
+    """Limite de débit partagée entre les threads d'envoi"""
+
+    def __init__(self, rate: float = RATE_PER_SECOND, burst: int = RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Attend qu'un jeton soit disponible"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass
+class Digest:
+    """Message unique pour les notifications d'un utilisateur dans le lot"""
+    user_id: Optional[int]
+    recipient: Optional[str]
+    rows: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def body(self) -> str:
+        if len(self.rows) == 1:
+            row = self.rows[0]
+            body = f"{row['title']}\n{row['message']}"
+        else:
+            lines = [f"• {row['title']}: {row['message']}" for row in self.rows[:MAX_DIGEST_ITEMS]]
+            if len(self.rows) > MAX_DIGEST_ITEMS:
+                lines.append(f"… et {len(self.rows) - MAX_DIGEST_ITEMS} autres")
+            body = f"Tcha-llé: {len(self.rows)} nouvelles notifications\n" + "\n".join(lines)
+        return body if len(body) <= MAX_MESSAGE_LENGTH else body[:MAX_MESSAGE_LENGTH - 1] + "…"
+
+
+def digests(rows: Sequence[Dict[str, Any]]) -> List[Digest]:
+    """Regroupe les notifications réservées par utilisateur, dans l'ordre de création"""
+    by_user: Dict[Optional[int], Digest] = {}
+    for row in sorted(rows, key=lambda row: row['created_at']):
+        digest = by_user.get(row['user_id'])
+        if digest is None:
+            recipient = row.get('phone_number') if row.get('user_active') is not False else None
+            digest = by_user[row['user_id']] = Digest(row['user_id'], recipient)
+        digest.rows.append(row)
+    return list(by_user.values())
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Attente avant la tentative suivante, avec gigue"""
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS) * random.uniform(0.8, 1.2)
+
+
+# =====================================================
+# DISPATCHER
+# =====================================================
+
+# Résultat d'un envoi par notification: (id, created_at, statut, tentative comptée, attente, erreur)
+Outcome = Tuple[int, datetime, str, int, float, Optional[str]]
+
+
+class NotificationDispatcher:
+    """Réservation, regroupement, envoi et enregistrement des résultats par lots"""
+
+    def __init__(self, provider: Optional[NotificationProvider] = None, batch_size: int = BATCH_SIZE,
+                 max_concurrency: int = MAX_CONCURRENT_SENDS, rate_limiter: Optional[TokenBucket] = None):
+        self.provider = provider or provider_from_env()
+        self.batch_size = batch_size
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="notification-send")
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"claimed": 0, "messages": 0, "sent": 0, "retried": 0, "failed": 0, "skipped": 0}
+
+    def claim(self, db) -> List[Dict[str, Any]]:
+        """Réserve un lot de notifications dues (validé immédiatement: aucun verrou pendant l'envoi)"""
+        rows = [dict(row) for row in db.execute(
+            text(CLAIM_SQL), {"limit": self.batch_size, "lease": CLAIM_LEASE_SECONDS}
+        ).mappings()]
+        db.commit()
+        self.stats["claimed"] += len(rows)
+        return rows
+
+    def send_digest(self, digest: Digest) -> List[Outcome]:
+        """Envoie un récapitulatif; un résultat par notification regroupée"""
+        if digest.user_id is None or not digest.recipient:
+            self.stats["skipped"] += len(digest.rows)
+            return [(row['id'], row['created_at'], STATUS_SKIPPED, 0, 0.0, "Pas de destinataire")
+                    for row in digest.rows]
+        try:
+            self.rate_limiter.acquire()
+            self.provider.send(digest.recipient, digest.body)
+        except DeliveryError as error:
+            return self.failed(digest, error, error.retryable)
+        except Exception as error:
+            # Erreur inattendue du fournisseur: nouvelle tentative, sans interrompre le lot
+            logger.exception("Fournisseur en échec pour l'utilisateur %s", digest.user_id)
+            return self.failed(digest, error, True)
+        self.stats["messages"] += 1
+        self.stats["sent"] += len(digest.rows)
+        return [(row['id'], row['created_at'], STATUS_SENT, 1, 0.0, None) for row in digest.rows]
+
+    def failed(self, digest: Digest, error: Exception, retryable: bool) -> List[Outcome]:
+        """Résultats d'un envoi en échec: la tentative est comptée pour chaque notification"""
+        outcomes = []
+        for row in digest.rows:
+            attempts = row['delivery_attempts'] + 1
+            if retryable and attempts < MAX_ATTEMPTS:
+                self.stats["retried"] += 1
+                outcomes.append((row['id'], row['created_at'], STATUS_PENDING, 1, backoff_seconds(attempts), str(error)))
+            else:
+                self.stats["failed"] += 1
+                outcomes.append((row['id'], row['created_at'], STATUS_FAILED, 1, 0.0, str(error)))
+        return outcomes
+
+    def deliver(self, rows: Sequence[Dict[str, Any]]) -> List[Outcome]:
+        """Envoie les récapitulatifs du lot en parallèle (nombre d'envois simultanés borné)"""
+        outcomes: List[Outcome] = []
+        for result in self._pool.map(self.send_digest, digests(rows)):
+            outcomes.extend(result)
+        return outcomes
+
+    def record(self, db, outcomes: Sequence[Outcome]) -> None:
+        """Enregistre les résultats du lot en une requête"""
+        if not outcomes:
+            return
+        ids, created_at, statuses, attempted, delays, errors = map(list, zip(*outcomes))
+        flag = CHANNEL_FLAGS.get(self.provider.channel, 'is_sms_sent')
+        db.execute(text(RECORD_SQL.format(flag=flag)), {
+            "ids": ids, "created_at": created_at, "statuses": statuses,
+            "attempted": attempted, "delays": delays, "errors": errors,
+        })
+        db.commit()
+
+    def run_once(self, session_factory) -> int:
+        """Traite les lots dus jusqu'à épuisement; retourne le nombre de notifications traitées"""
+        processed = 0
+        with session_factory() as db:
+            while True:
+                rows = self.claim(db)
+                if rows:
+                    self.record(db, self.deliver(rows))
+                processed += len(rows)
+                if len(rows) < self.batch_size:
+                    return processed
+
+    def start(self, session_factory, interval: float = POLL_INTERVAL_SECONDS) -> None:
+        """Interroge la file dans un thread dédié"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.run_once(session_factory)
+                except Exception:
+                    logger.exception("Échec de l'envoi des notifications")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="notification-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def benchmark(count: int, users: int = 200, latency: float = 0.05, rate: float = 1e6) -> Dict[str, float]:
+    """Débit du regroupement et de l'envoi avec le fournisseur local (sans base de données)"""
+    dispatcher = NotificationDispatcher(StubProvider(latency=latency), rate_limiter=TokenBucket(rate, int(rate)))
+    now = datetime.now(timezone.utc)
+    rows = [
+        {"id": index, "created_at": now, "user_id": index % users, "title": "Alerte",
+         "message": f"Notification {index}", "delivery_attempts": 0,
+         "phone_number": f"+22507{index % users:08d}", "user_active": True}
+        for index in range(count)
+    ]
+    started = time.perf_counter()
+    for start in range(0, count, dispatcher.batch_size):
+        dispatcher.deliver(rows[start:start + dispatcher.batch_size])
+    elapsed = time.perf_counter() - started
+    return {"notifications": count, "messages": dispatcher.stats["messages"], "seconds": round(elapsed, 3),
+            "notifications_per_second": round(count / elapsed)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:2] == ["bench"]:
+        print(benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 10000))
+        sys.exit(0)
+
+    try:
+        dispatcher = NotificationDispatcher()
+    except RuntimeError as error:
+        logger.error("%s", error)
+        sys.exit(1)
+
+    from .new_models import SessionLocal
+    logger.info("Dispatcher de notifications démarré (fournisseur %s)", type(dispatcher.provider).__name__)
+    while True:
+        try:
+            dispatcher.run_once(SessionLocal)
+        except Exception:
+            logger.exception("Échec de l'envoi des notifications")
+        time.sleep(POLL_INTERVAL_SECONDS)
@@ -0,0 +1,373 @@
+"""
+Partitionnement par période des journaux, avec rétention
+
+search_logs, user_interactions, audit_logs, webhook_logs et notifications ne
+font que grossir. Chacune est partitionnée par plage de created_at (mois ou
+semaine): VACUUM et les analyses ne parcourent que les partitions utiles, et la
+rétention supprime une partition entière au lieu de millions de DELETE.
+
+La maintenance (horaire):
+
+- crée les partitions des PREMAKE_PERIODS périodes à venir, en y déplaçant
+  les lignes arrivées entre-temps dans la partition par défaut; une période
+  déjà couverte par les bornes d'une partition attachée (l'ancienne table
+  après conversion) est sautée;
+- exporte en CSV compressé les partitions plus anciennes que la rétention,
+  puis les détache et les supprime.
+
+Les nouvelles partitions sont créées à part puis attachées: ATTACH ne prend
+qu'un verrou SHARE UPDATE EXCLUSIVE sur la table mère, les écritures continuent.
+Le détachement prend un verrou exclusif bref (DETACH CONCURRENTLY est exclu
+par la partition par défaut), borné par LOCK_TIMEOUT.
+
+Conversion en ligne d'une table existante (`migrate_table`): l'ancienne table
+devient la partition `<table>_legacy` de la nouvelle table mère, sans copie.
+Une contrainte CHECK validée sans bloquer les écritures et un index unique
+construit en parallèle permettent un ATTACH sans parcours; seul le basculement
+(renommage, création de la table mère vide) prend un verrou exclusif, bref.
+La séquence des identifiants est conservée: l'écriture des recherches ne change pas.
+
+    python -m backend.partitioning            # maintenance
+    python -m backend.partitioning migrate    # conversion des tables existantes
+"""
+import gzip
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+# Table: (période, nombre de périodes conservées)
+PARTITIONED_TABLES: Dict[str, Tuple[str, int]] = {
+    'search_logs': ('month', 13),
+    'user_interactions': ('month', 13),
+    'audit_logs': ('month', 24),
+    'webhook_logs': ('week', 8),
+    'notifications': ('month', 6),
+}
+# Partitions créées à l'avance
+PREMAKE_PERIODS = 3
+ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR",
+                        os.path.join(os.path.dirname(__file__), "..", "archives", "partitions"))
+MAINTENANCE_INTERVAL_SECONDS = 3600
+# Attente maximale d'un verrou: au-delà, l'opération est abandonnée et retentée
+LOCK_TIMEOUT = '2s'
+SWITCH_ATTEMPTS = 5
+
+# Bornes des partitions: range_start NULL pour MINVALUE, range_end NULL pour la partition par défaut
+PARTITIONS_SQL = r"""
+SELECT c.relname AS name,
+       (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \(''([^'']+)''\)'))[1]::TIMESTAMPTZ AS range_start,
+       (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \(''([^'']+)''\)'))[1]::TIMESTAMPTZ AS range_end
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+JOIN pg_class p ON p.oid = i.inhparent
+WHERE p.relname = :table
+"""
+
+INDEXES_SQL = """
+SELECT i.relname AS name FROM pg_index x
+JOIN pg_class i ON i.oid = x.indexrelid
+WHERE x.indrelid = CAST(:table AS regclass)
+"""
+
+FOREIGN_KEYS_SQL = """
+SELECT conname AS name, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'
+"""
+
+# Index secondaires, hors clé primaire et index unique de la conversion
+SECONDARY_INDEXES_SQL = """
+SELECT pg_get_indexdef(x.indexrelid) AS definition FROM pg_index x
+WHERE x.indrelid = CAST(:table AS regclass) AND NOT x.indisprimary AND NOT x.indisunique
+"""
+
+
+def period_start(moment: datetime, period: str) -> datetime:
+    """Début (UTC) de la période contenant `moment`"""
+    moment = moment.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'week':
+        return moment - timedelta(days=moment.weekday())
+    return moment.replace(day=1)
+
+
+def next_period(start: datetime, period: str) -> datetime:
+    if period == 'week':
+        return start + timedelta(days=7)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(table: str, start: datetime, period: str) -> str:
+    return f"{table}_p{start:%Y_%m_%d}" if period == 'week' else f"{table}_p{start:%Y_%m}"
+
+
+def missing_periods(start: datetime, period: str,
+                    bounds: List[Tuple[Optional[datetime], datetime]]) -> List[Tuple[datetime, datetime]]:
+    """Périodes [début, fin) à créer à partir de `start`: celles qu'aucune borne
+    (début, fin) de partition attachée ne recouvre (début None: MINVALUE)"""
+    periods = []
+    for _ in range(PREMAKE_PERIODS + 1):
+        end = next_period(start, period)
+        if not any((low is None or low < end) and start < high for low, high in bounds):
+            periods.append((start, end))
+        start = end
+    return periods
+
+
+def _literal(moment: datetime) -> str:
+    """Borne de partition (les commandes DDL n'acceptent pas de paramètres)"""
+    return "'" + moment.astimezone(timezone.utc).isoformat() + "'"
+
+
+class PartitionMaintainer:
+    """Création des partitions à venir et archivage des partitions expirées"""
+
+    def __init__(self, engine=None, tables: Optional[Dict[str, Tuple[str, int]]] = None,
+                 archive_dir: str = ARCHIVE_DIR):
+        if engine is None:
+            from .new_models import engine
+        self.engine = engine
+        self.tables = tables or PARTITIONED_TABLES
+        self.archive_dir = archive_dir
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"created": 0, "moved_rows": 0, "archived": 0, "archived_rows": 0}
+
+    # -------------------------------------------------
+    # Partitions à venir
+    # -------------------------------------------------
+
+    def ensure_partitions(self, table: str, now: Optional[datetime] = None) -> List[str]:
+        """Crée les partitions manquantes de la période courante et des suivantes"""
+        period, _ = self.tables[table]
+        start = period_start(now or datetime.now(timezone.utc), period)
+        with self.engine.connect() as connection:
+            bounds = [
+                (row.range_start, row.range_end)
+                for row in connection.execute(text(PARTITIONS_SQL), {"table": table})
+                if row.range_end is not None
+            ]
+
+        created = []
+        for start, end in missing_periods(start, period, bounds):
+            name = partition_name(table, start, period)
+            self.create_partition(table, name, start, end)
+            created.append(name)
+        return created
+
+    def create_partition(self, table: str, name: str, start: datetime, end: datetime) -> None:
+        """Crée la partition à part, y déplace les lignes de la partition par défaut, puis l'attache"""
+        with self.engine.begin() as connection:
+            connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            connection.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+            moved = connection.execute(text(f"""
+                WITH moved AS (
+                    DELETE FROM {table}_default WHERE created_at >= :start AND created_at < :end RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            """), {"start": start, "end": end}).rowcount
+            connection.execute(text(
+                f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({_literal(start)}) TO ({_literal(end)})"
+            ))
+        self.stats["created"] += 1
+        self.stats["moved_rows"] += moved or 0
+        logger.info("Partition %s créée (%d lignes reprises de la partition par défaut)", name, moved or 0)
+
+    # -------------------------------------------------
+    # Rétention
+    # -------------------------------------------------
+
+    def archive_expired(self, table: str, now: Optional[datetime] = None) -> List[str]:
+        """Exporte, détache et supprime les partitions entièrement hors rétention"""
+        period, retention = self.tables[table]
+        cutoff = period_start(now or datetime.now(timezone.utc), period)
+        for _ in range(retention):
+            cutoff = period_start(cutoff - timedelta(days=1), period)
+
+        with self.engine.connect() as connection:
+            expired = [
+                (row.name, row.range_end)
+                for row in connection.execute(text(PARTITIONS_SQL), {"table": table})
+                if row.range_end is not None and row.range_end <= cutoff
+            ]
+        for name, range_end in expired:
+            self.archive_partition(table, name, range_end)
+        return [name for name, _ in expired]
+
+    def archive_partition(self, table: str, name: str, range_end: datetime) -> None:
+        # 1. Export: la partition ne reçoit plus d'écritures, elle peut rester attachée
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.csv.gz")
+        temporary_path = path + ".tmp"
+        raw_connection = self.engine.raw_connection()
+        try:
+            with gzip.open(temporary_path, "wb") as archive:
+                cursor = raw_connection.cursor()
+                cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+                row_count = cursor.rowcount
+                cursor.close()
+            raw_connection.commit()
+        finally:
+            raw_connection.close()
+        os.replace(temporary_path, path)
+
+        # 2. Trace de l'archive, détachement et suppression dans la même transaction:
+        # après un arrêt, la partition est simplement exportée à nouveau
+        with self.engine.begin() as connection:
+            connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            connection.execute(text("""
+                INSERT INTO partition_archives (table_name, partition_name, range_end, row_count, file_path)
+                VALUES (:table, :name, :range_end, :row_count, :path)
+            """), {"table": table, "name": name, "range_end": range_end, "row_count": row_count, "path": path})
+            connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            connection.execute(text(f"DROP TABLE {name}"))
+        self.stats["archived"] += 1
+        self.stats["archived_rows"] += row_count
+        logger.info("Partition %s archivée dans %s (%d lignes)", name, path, row_count)
+
+    # -------------------------------------------------
+    # Exécution périodique
+    # -------------------------------------------------
+
+    def run_once(self, now: Optional[datetime] = None) -> None:
+        for table in self.tables:
+            try:
+                self.ensure_partitions(table, now)
+                self.archive_expired(table, now)
+            except SQLAlchemyError:
+                # Verrou non obtenu dans le délai, ou autre échec propre à cette table:
+                # nouvelle tentative au prochain passage, les autres tables sont maintenues
+                logger.exception("Maintenance des partitions de %s reportée", table)
+
+    def start(self, interval: float = MAINTENANCE_INTERVAL_SECONDS) -> None:
+        """Maintient périodiquement les partitions dans un thread dédié"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception:
+                    logger.exception("Échec de la maintenance des partitions")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="partitioning", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # -------------------------------------------------
+    # Conversion en ligne des tables existantes
+    # -------------------------------------------------
+
+    def migrate_table(self, table: str, now: Optional[datetime] = None) -> bool:
+        """Convertit une table ordinaire en table partitionnée; False si déjà partitionnée
+
+        L'ancienne table est attachée telle quelle pour les dates antérieures à
+        la bascule (début de la période suivante); elle est archivée comme les
+        autres partitions quand sa date de fin sort de la rétention.
+        """
+        period, _ = self.tables[table]
+        with self.engine.connect() as connection:
+            kind = connection.execute(
+                text("SELECT relkind FROM pg_class WHERE relname = :table"), {"table": table}
+            ).scalar()
+        if kind != 'r':
+            return False
+
+        now = now or datetime.now(timezone.utc)
+        cutover = next_period(period_start(now, period), period)
+        if cutover - now < timedelta(days=1):
+            # Marge pour les étapes sans verrou: la bascule doit précéder la date de coupure
+            cutover = next_period(cutover, period)
+        legacy = f"{table}_legacy"
+
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text(f"SET lock_timeout = '{LOCK_TIMEOUT}'"))
+            # created_at devient obligatoire (clé de partitionnement)
+            connection.execute(text(f"UPDATE {table} SET created_at = to_timestamp(0) WHERE created_at IS NULL"))
+            # Contrainte vérifiée sans bloquer les écritures: l'ATTACH n'aura pas à parcourir la table
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {legacy}_range "
+                f"CHECK (created_at IS NOT NULL AND created_at < {_literal(cutover)}) NOT VALID"
+            ))
+            connection.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {legacy}_range"))
+            # Index de la future clé primaire (id, created_at), construit sans bloquer
+            connection.execute(text(
+                f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_id_created_at ON {table} (id, created_at)"
+            ))
+
+        for attempt in range(SWITCH_ATTEMPTS):
+            try:
+                self._switch(table, legacy, cutover)
+                break
+            except OperationalError:
+                if attempt == SWITCH_ATTEMPTS - 1:
+                    raise
+                logger.warning("Bascule de %s reportée (verrou non obtenu)", table)
+                time.sleep(2 ** attempt)
+
+        self.ensure_partitions(table, now)
+        logger.info("Table %s partitionnée (anciennes lignes dans %s jusqu'au %s)", table, legacy, cutover)
+        return True
+
+    def _switch(self, table: str, legacy: str, cutover: datetime) -> None:
+        """Bascule en une transaction: opérations sur le catalogue uniquement"""
+        with self.engine.begin() as connection:
+            connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            connection.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+            sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+            foreign_keys = connection.execute(text(FOREIGN_KEYS_SQL), {"table": table}).all()
+            secondary_indexes = [row.definition for row in connection.execute(text(SECONDARY_INDEXES_SQL), {"table": table})]
+
+            # NOT NULL sans parcours grâce à la contrainte CHECK validée
+            connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL"))
+            # Les noms d'index sont globaux: ceux de l'ancienne table sont renommés
+            for row in connection.execute(text(INDEXES_SQL), {"table": table}).all():
+                connection.execute(text(f"ALTER INDEX {row.name} RENAME TO {row.name}_legacy"))
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {legacy}_id_created_at UNIQUE USING INDEX {table}_id_created_at_legacy"
+            ))
+            connection.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+
+            # Table mère vide: index et clés étrangères créés instantanément, puis repris
+            # à l'identique sur l'ancienne table lors de l'ATTACH
+            connection.execute(text(
+                f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING COMMENTS INCLUDING STORAGE, "
+                f"PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)"
+            ))
+            for foreign_key in foreign_keys:
+                connection.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {foreign_key.name} {foreign_key.definition}"))
+            for definition in secondary_indexes:
+                # Définitions lues avant le renommage: elles visent la nouvelle table mère
+                connection.execute(text(definition))
+            # La séquence appartient à la table mère: elle survit à l'archivage de l'ancienne table
+            connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+            connection.execute(text(
+                f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ({_literal(cutover)})"
+            ))
+            connection.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+
+    def migrate(self) -> List[str]:
+        """Convertit toutes les tables encore ordinaires"""
+        return [table for table in self.tables if self.migrate_table(table)]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    maintainer = PartitionMaintainer()
+    if sys.argv[1:] == ["migrate"]:
+        print("Tables converties:", maintainer.migrate())
+    maintainer.run_once()
+    print(maintainer.stats)
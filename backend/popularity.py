@@ -0,0 +1,191 @@
+"""
+Popularité récente des activités, avec décroissance exponentielle
+
+`view_count` et `search_count` cumulent toute l'histoire d'une activité: un
+lieu fermé depuis longtemps garde son avance sur un lieu fréquenté aujourd'hui.
+Les interactions (vue, clic, appel, itinéraire, enregistrement, partage) sont
+agrégées en un score qui décroît avec une demi-vie, par activité et par
+(activité, heure de la semaine).
+
+Chaque ligne stocke le score à son instant de mise à jour; le score à
+l'instant t vaut score * exp(-decay * (t - updated_at)). Une mise à jour
+n'agrège donc que les interactions postérieures au dernier identifiant traité
+(filigrane) et décroît l'ancien score: son coût dépend des nouveaux
+événements, pas de l'historique.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Poids d'une interaction selon l'intention qu'elle traduit
+INTERACTION_WEIGHTS: Dict[str, float] = {
+    'view': 1.0, 'click': 2.0, 'save': 3.0, 'share': 3.0, 'call': 5.0, 'direction': 5.0,
+}
+HALF_LIFE_DAYS = 7
+# Plus longue pour l'heure de la semaine: chaque créneau ne revient qu'une fois par semaine
+HOURLY_HALF_LIFE_DAYS = 28
+DECAY = math.log(2) / (HALF_LIFE_DAYS * 86400)
+HOURLY_DECAY = math.log(2) / (HOURLY_HALF_LIFE_DAYS * 86400)
+# Heure locale des créneaux horaires
+TIMEZONE = 'Africa/Abidjan'
+
+UPDATE_INTERVAL_SECONDS = 60
+# Les interactions plus récentes attendent la mise à jour suivante (transactions encore ouvertes)
+SAFETY_LAG_SECONDS = 30
+MAX_EVENTS_PER_UPDATE = 500000
+# Lignes dont le score est devenu négligeable, supprimées une fois par jour
+PRUNE_THRESHOLD = 0.01
+PRUNE_INTERVAL_SECONDS = 24 * 3600
+WATERMARK_NAME = 'user_interactions'
+
+_WEIGHT_SQL = "CASE interaction_type {} ELSE 0 END".format(
+    " ".join(f"WHEN '{name}' THEN {weight}" for name, weight in INTERACTION_WEIGHTS.items()))
+_TYPES_SQL = ", ".join(f"'{name}'" for name in INTERACTION_WEIGHTS)
+_HOUR_OF_WEEK_SQL = ("((EXTRACT(ISODOW FROM {column} AT TIME ZONE '" + TIMEZONE + "')::INT - 1) * 24"
+                     " + EXTRACT(HOUR FROM {column} AT TIME ZONE '" + TIMEZONE + "')::INT)")
+
+# Colonnes et jointures ajoutées aux requêtes de recherche (score décru à l'instant de la requête)
+POPULARITY_COLUMNS_SQL = f"""
+    COALESCE(pop.score * exp(-{DECAY!r} * EXTRACT(EPOCH FROM NOW() - pop.updated_at)), 0) AS popularity,
+    COALESCE(hpop.score * exp(-{HOURLY_DECAY!r} * EXTRACT(EPOCH FROM NOW() - hpop.updated_at)), 0)
+        AS popularity_this_hour
+"""
+POPULARITY_JOINS_SQL = f"""
+    LEFT JOIN activity_popularity pop ON pop.activity_id = a.id
+    LEFT JOIN activity_hourly_popularity hpop ON hpop.activity_id = a.id
+        AND hpop.hour_of_week = {_HOUR_OF_WEEK_SQL.format(column='NOW()')}
+"""
+
+WATERMARK_SQL = """
+INSERT INTO popularity_watermarks (name, last_interaction_id) VALUES (:name, 0)
+ON CONFLICT (name) DO NOTHING
+"""
+
+LOCK_WATERMARK_SQL = """
+SELECT last_interaction_id FROM popularity_watermarks WHERE name = :name FOR UPDATE
+"""
+
+UPPER_BOUND_SQL = """
+SELECT COALESCE(MAX(id), :from_id) FROM user_interactions
+WHERE id > :from_id AND id <= :from_id + :max_events
+  AND created_at < NOW() - make_interval(secs => :lag)
+"""
+
+UPDATE_SCORES_SQL = f"""
+INSERT INTO activity_popularity (activity_id, score, updated_at)
+SELECT activity_id, SUM({_WEIGHT_SQL} * exp(-:decay * EXTRACT(EPOCH FROM :now - created_at))), :now
+FROM user_interactions
+WHERE id > :from_id AND id <= :to_id
+  AND activity_id IS NOT NULL AND interaction_type IN ({_TYPES_SQL})
+GROUP BY activity_id
+ON CONFLICT (activity_id) DO UPDATE SET
+    score = activity_popularity.score
+        * exp(-:decay * EXTRACT(EPOCH FROM EXCLUDED.updated_at - activity_popularity.updated_at))
+        + EXCLUDED.score,
+    updated_at = EXCLUDED.updated_at
+"""
+
+UPDATE_HOURLY_SCORES_SQL = f"""
+INSERT INTO activity_hourly_popularity (activity_id, hour_of_week, score, updated_at)
+SELECT activity_id, {_HOUR_OF_WEEK_SQL.format(column='created_at')},
+       SUM({_WEIGHT_SQL} * exp(-:decay * EXTRACT(EPOCH FROM :now - created_at))), :now
+FROM user_interactions
+WHERE id > :from_id AND id <= :to_id
+  AND activity_id IS NOT NULL AND interaction_type IN ({_TYPES_SQL})
+GROUP BY 1, 2
+ON CONFLICT (activity_id, hour_of_week) DO UPDATE SET
+    score = activity_hourly_popularity.score
+        * exp(-:decay * EXTRACT(EPOCH FROM EXCLUDED.updated_at - activity_hourly_popularity.updated_at))
+        + EXCLUDED.score,
+    updated_at = EXCLUDED.updated_at
+"""
+
+# Tables élaguées et leur taux de décroissance
+PRUNE_TABLES = {
+    'activity_popularity': DECAY,
+    'activity_hourly_popularity': HOURLY_DECAY,
+}
+
+
+class PopularityAggregator:
+    """Mise à jour incrémentale des scores à partir du filigrane"""
+
+    def __init__(self, max_events: int = MAX_EVENTS_PER_UPDATE):
+        self.max_events = max_events
+        self._pruned_at = float("-inf")
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"updates": 0, "events": 0, "pruned": 0}
+
+    def update(self, db) -> int:
+        """Agrège les interactions depuis le filigrane; retourne le nombre d'identifiants traités
+
+        Le filigrane est verrouillé pendant la transaction: deux workers ne
+        comptent jamais deux fois les mêmes interactions.
+        """
+        db.execute(text(WATERMARK_SQL), {"name": WATERMARK_NAME})
+        from_id = db.execute(text(LOCK_WATERMARK_SQL), {"name": WATERMARK_NAME}).scalar()
+        to_id = db.execute(text(UPPER_BOUND_SQL), {
+            "from_id": from_id, "max_events": self.max_events, "lag": SAFETY_LAG_SECONDS
+        }).scalar()
+        if to_id <= from_id:
+            db.rollback()
+            return 0
+
+        now = db.execute(text("SELECT NOW()")).scalar()
+        bounds = {"from_id": from_id, "to_id": to_id, "now": now}
+        db.execute(text(UPDATE_SCORES_SQL), dict(bounds, decay=DECAY))
+        db.execute(text(UPDATE_HOURLY_SCORES_SQL), dict(bounds, decay=HOURLY_DECAY))
+        db.execute(
+            text("UPDATE popularity_watermarks SET last_interaction_id = :to_id, updated_at = NOW() WHERE name = :name"),
+            {"to_id": to_id, "name": WATERMARK_NAME}
+        )
+        db.commit()
+        self.stats["updates"] += 1
+        self.stats["events"] += to_id - from_id
+        return to_id - from_id
+
+    def prune(self, db) -> None:
+        """Supprime les scores devenus négligeables (la table reste proportionnelle à l'activité récente)"""
+        for table, decay in PRUNE_TABLES.items():
+            result = db.execute(
+                text(f"DELETE FROM {table} WHERE score * exp(-:decay * EXTRACT(EPOCH FROM NOW() - updated_at)) < :threshold"),
+                {"decay": decay, "threshold": PRUNE_THRESHOLD}
+            )
+            self.stats["pruned"] += result.rowcount or 0
+        db.commit()
+
+    def run_once(self, session_factory) -> None:
+        with session_factory() as db:
+            # Rattrapage d'un retard: lots successifs jusqu'au présent
+            while self.update(db) >= self.max_events:
+                pass
+            if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+                self.prune(db)
+                self._pruned_at = time.monotonic()
+
+    def start(self, session_factory, interval: float = UPDATE_INTERVAL_SECONDS) -> None:
+        """Met à jour périodiquement dans un thread dédié"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.run_once(session_factory)
+                except Exception:
+                    logger.exception("Échec de la mise à jour de la popularité")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="popularity", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,181 @@
+"""
+Caractéristiques et poids du score de pertinence de `rank_results`
+
+Le score est un produit scalaire entre les caractéristiques d'une activité
+(tranche de distance, vérification, note, popularité...) et un vecteur de
+poids. Les poids par défaut sont ceux choisis à la main à l'origine; des poids
+appris hors ligne sur les clics (backend/ranking_training.py) sont exportés
+dans un fichier JSON versionné, rechargé à chaud quand il change.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FEATURES = (
+    'distance_under_500', 'distance_under_1000', 'distance_under_2000', 'distance_over_2000',
+    'is_verified', 'verification_level', 'is_open', 'rating',
+    'review_count', 'view_count', 'search_count',
+    'age_under_30_days', 'age_under_90_days',
+    'has_cover_image', 'has_description', 'has_opening_hours', 'has_phone',
+    'popularity', 'popularity_this_hour', 'user_affinity',
+)
+
+# Poids choisis à la main (100/80/60/40 pour la distance, +50 si vérifié, note x 10...)
+DEFAULT_WEIGHTS: Dict[str, float] = {
+    'distance_under_500': 100, 'distance_under_1000': 80, 'distance_under_2000': 60, 'distance_over_2000': 40,
+    'is_verified': 50, 'verification_level': 10, 'is_open': 30, 'rating': 10,
+    'review_count': 0.5, 'view_count': 0.1, 'search_count': 0.2,
+    'age_under_30_days': 10, 'age_under_90_days': 5,
+    'has_cover_image': 5, 'has_description': 5, 'has_opening_hours': 5, 'has_phone': 5,
+    # Popularité récente (backend/popularity.py), en log(1 + score)
+    'popularity': 10, 'popularity_this_hour': 5,
+    # Préférences de l'utilisateur (backend/user_profiles.py), entre 0 et 1
+    'user_affinity': 40,
+}
+
+# Plafonds des compteurs de popularité
+REVIEW_COUNT_CAP = 100
+VIEW_COUNT_CAP = 1000
+SEARCH_COUNT_CAP = 500
+# Part de chaque dimension du profil dans l'affinité
+AFFINITY_WEIGHTS = (('preferred_activity_types', 'activity_type_id', 0.5),
+                    ('preferred_price_levels', 'price_level', 0.25),
+                    ('usual_zones', 'zone_id', 0.25))
+# Longueur à partir de laquelle une description compte comme renseignée
+DESCRIPTION_MIN_LENGTH = 50
+
+WEIGHTS_PATH = os.getenv("RANKING_WEIGHTS_PATH",
+                         os.path.join(os.path.dirname(__file__), "ranking_weights", "current.json"))
+RELOAD_CHECK_SECONDS = 30
+
+
+def feature_matrix(columns: Mapping[str, Sequence[Any]]) -> np.ndarray:
+    """Matrice (activités x FEATURES) à partir de colonnes brutes
+
+    Colonnes attendues: distance, is_verified, verification_level, is_open,
+    rating, review_count, view_count, search_count, age_days,
+    has_cover_image, description_length, has_opening_hours, has_phone,
+    popularity, popularity_this_hour, user_affinity (absentes: 0).
+    Une distance absente ou nulle ne compte pour aucune tranche.
+    """
+    count = len(columns['distance'])
+
+    def column(name: str) -> np.ndarray:
+        return np.array([value or 0 for value in columns.get(name, ())] or np.zeros(count), dtype=np.float64)
+
+    distance = column('distance')
+    known = distance > 0
+    verified = column('is_verified')
+    age_days = np.array([np.inf if value is None else value for value in columns['age_days']], dtype=np.float64)
+
+    return np.column_stack((
+        known & (distance < 500),
+        known & (distance >= 500) & (distance < 1000),
+        known & (distance >= 1000) & (distance < 2000),
+        known & (distance >= 2000),
+        verified,
+        verified * column('verification_level'),
+        column('is_open'),
+        column('rating'),
+        np.minimum(column('review_count'), REVIEW_COUNT_CAP),
+        np.minimum(column('view_count'), VIEW_COUNT_CAP),
+        np.minimum(column('search_count'), SEARCH_COUNT_CAP),
+        age_days < 30,
+        (age_days >= 30) & (age_days < 90),
+        column('has_cover_image'),
+        column('description_length') > DESCRIPTION_MIN_LENGTH,
+        column('has_opening_hours'),
+        column('has_phone'),
+        np.log1p(column('popularity')),
+        np.log1p(column('popularity_this_hour')),
+        column('user_affinity'),
+    )).astype(np.float64)
+
+
+def user_affinity(activity: Any, user_context: Optional[Mapping[str, Any]]) -> float:
+    """Affinité (0 à 1) du profil de l'utilisateur avec le type, le prix et la zone d'une activité"""
+    if not user_context:
+        return 0.0
+    return sum(
+        weight * (user_context.get(preferences) or {}).get(getattr(activity, attribute, None), 0.0)
+        for preferences, attribute, weight in AFFINITY_WEIGHTS
+    )
+
+
+def activity_features(activities: Sequence[Any], user_context: Optional[Mapping[str, Any]] = None) -> np.ndarray:
+    """Caractéristiques d'activités construites par le moteur"""
+    def age_days(created_at: datetime) -> int:
+        return (datetime.now(created_at.tzinfo) - created_at).days if created_at else None
+
+    return feature_matrix({
+        'distance': [getattr(activity, 'distance', None) for activity in activities],
+        'is_verified': [activity.is_verified for activity in activities],
+        'verification_level': [activity.verification_level for activity in activities],
+        'is_open': [activity.is_open for activity in activities],
+        'rating': [float(activity.rating or 0) for activity in activities],
+        'review_count': [activity.review_count for activity in activities],
+        'view_count': [activity.view_count for activity in activities],
+        'search_count': [activity.search_count for activity in activities],
+        'age_days': [age_days(activity.created_at) for activity in activities],
+        'has_cover_image': [bool(activity.cover_image_url) for activity in activities],
+        'description_length': [len(activity.description or '') for activity in activities],
+        'has_opening_hours': [bool(activity.opening_hours) for activity in activities],
+        'has_phone': [bool(activity.phone_number or activity.whatsapp_number) for activity in activities],
+        'popularity': [getattr(activity, 'popularity', None) for activity in activities],
+        'popularity_this_hour': [getattr(activity, 'popularity_this_hour', None) for activity in activities],
+        'user_affinity': [user_affinity(activity, user_context) for activity in activities],
+    })
+
+
+def weight_vector(weights: Mapping[str, float]) -> np.ndarray:
+    """Vecteur aligné sur FEATURES (poids par défaut pour une caractéristique absente)"""
+    return np.array([float(weights.get(name, DEFAULT_WEIGHTS[name])) for name in FEATURES])
+
+
+class RankingWeights:
+    """Poids courants, rechargés quand le fichier exporté change"""
+
+    def __init__(self, path: str = WEIGHTS_PATH, check_interval: float = RELOAD_CHECK_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self.version = "default"
+        self.vector = weight_vector(DEFAULT_WEIGHTS)
+        self._mtime = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def current(self) -> np.ndarray:
+        """Vecteur de poids, après vérification périodique du fichier"""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if now - self._checked_at >= self.check_interval:
+                    self._checked_at = now
+                    self._reload_if_changed()
+        return self.vector
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                payload = json.load(handle)
+            vector = weight_vector(payload["weights"])
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.exception("Fichier de poids de classement illisible: %s", self.path)
+            return
+        self.vector, self.version = vector, payload.get("version", "unknown")
+        logger.info("Poids de classement chargés: version %s", self.version)
@@ -0,0 +1,247 @@
+"""
+Apprentissage hors ligne des poids de `rank_results` à partir des logs
+
+Chaque recherche enregistre les activités affichées, dans l'ordre, dans
+`search_logs.results_ids`. Les impressions sont jointes aux interactions de
+la même session (ou du même utilisateur) qui suivent la recherche: un appel
+ou un itinéraire vaut plus qu'un clic, une impression sans interaction vaut 0.
+
+Les poids sont appris par régression logistique sur les différences de
+caractéristiques entre résultats d'une même recherche (classement par paires),
+puis ramenés à l'échelle des poids par défaut. Les recherches les plus
+récentes sont gardées pour l'évaluation (NDCG@10 des poids par défaut, des
+poids appris et de l'ordre affiché). Les poids sont exportés dans un fichier
+versionné; `current.json`, rechargé à chaud par le moteur, n'est remplacé que
+si les poids appris font au moins aussi bien que les poids en service.
+
+    python -m backend.ranking_training
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sqlalchemy import text
+
+from .popularity import POPULARITY_COLUMNS_SQL, POPULARITY_JOINS_SQL
+from .ranking_model import DEFAULT_WEIGHTS, FEATURES, WEIGHTS_PATH, feature_matrix, weight_vector
+
+logger = logging.getLogger(__name__)
+
+TRAINING_DAYS = 30
+# Délai pendant lequel une interaction est attribuée à la recherche qui la précède
+ATTRIBUTION_WINDOW_MINUTES = 30
+HOLDOUT_FRACTION = 0.2
+NDCG_AT = 10
+# Paires tirées au plus par recherche (les recherches très cliquées ne dominent pas)
+MAX_PAIRS_PER_SEARCH = 50
+INTERACTION_GAINS = {'click': 1, 'call': 3, 'direction': 3}
+
+# Popularité: valeur actuelle (l'historique des scores n'est pas conservé)
+IMPRESSIONS_SQL = """
+WITH impressions AS (
+    SELECT sl.id AS search_id, sl.user_id, sl.session_id, sl.created_at, sl.user_location,
+           shown.activity_id, shown.position
+    FROM search_logs sl
+    CROSS JOIN LATERAL unnest(sl.results_ids) WITH ORDINALITY AS shown(activity_id, position)
+    WHERE sl.created_at >= NOW() - make_interval(days => :days)
+      AND cardinality(sl.results_ids) > 1
+),
+labels AS (
+    SELECT i.search_id, i.activity_id,
+           MAX(CASE ui.interaction_type WHEN 'call' THEN :call_gain WHEN 'direction' THEN :direction_gain
+               ELSE :click_gain END) AS label
+    FROM impressions i
+    JOIN user_interactions ui
+      ON ui.activity_id = i.activity_id
+     AND ((i.session_id IS NOT NULL AND ui.session_id = i.session_id)
+          OR (i.user_id IS NOT NULL AND ui.user_id = i.user_id))
+     AND ui.created_at BETWEEN i.created_at AND i.created_at + make_interval(mins => :window)
+     AND ui.interaction_type IN ('click', 'call', 'direction')
+    GROUP BY i.search_id, i.activity_id
+)
+SELECT
+    i.search_id, i.created_at, i.position, COALESCE(l.label, 0) AS label,
+    -- Même distance que la requête de recherche (géométrie SRID 4326)
+    ST_Distance(a.location, i.user_location) AS distance,
+    a.is_verified, a.verification_level, a.is_open, a.rating,
+    a.review_count, a.view_count, a.search_count,
+    EXTRACT(DAY FROM i.created_at - a.created_at) AS age_days,
+    a.cover_image_url IS NOT NULL AS has_cover_image,
+    COALESCE(length(a.description), 0) AS description_length,
+    COALESCE(a.opening_hours::TEXT, '{}') <> '{}' AS has_opening_hours,
+    (a.phone_number IS NOT NULL OR a.whatsapp_number IS NOT NULL) AS has_phone,
+""" + POPULARITY_COLUMNS_SQL + """
+FROM impressions i
+JOIN activities a ON a.id = i.activity_id
+""" + POPULARITY_JOINS_SQL + """
+LEFT JOIN labels l ON l.search_id = i.search_id AND l.activity_id = i.activity_id
+ORDER BY i.created_at, i.search_id, i.position
+"""
+
+
+def group_bounds(search_ids: np.ndarray) -> List[Tuple[int, int]]:
+    """(début, fin) des impressions de chaque recherche (lignes triées par recherche)"""
+    starts = np.flatnonzero(np.r_[True, search_ids[1:] != search_ids[:-1]])
+    ends = np.r_[starts[1:], len(search_ids)]
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def ndcg(scores: np.ndarray, labels: np.ndarray, groups: List[Tuple[int, int]], k: int = NDCG_AT) -> float:
+    """NDCG@k moyen des recherches ayant au moins une interaction"""
+    values = []
+    for start, end in groups:
+        gains = labels[start:end]
+        if not gains.any():
+            continue
+        discounts = 1 / np.log2(np.arange(2, min(k, end - start) + 2))
+        ranked = gains[np.argsort(-scores[start:end], kind="stable")][:k]
+        ideal = np.sort(gains)[::-1][:k]
+        values.append(((2 ** ranked - 1) @ discounts) / ((2 ** ideal - 1) @ discounts))
+    return float(np.mean(values)) if values else 0.0
+
+
+def pairwise_differences(features: np.ndarray, labels: np.ndarray, groups: List[Tuple[int, int]],
+                         rng: np.random.Generator) -> np.ndarray:
+    """Différences (meilleur - moins bon) des paires de résultats de gains différents"""
+    differences = []
+    for start, end in groups:
+        gains = labels[start:end]
+        if not gains.any():
+            continue
+        better, worse = np.nonzero(gains[:, None] > gains[None, :])
+        if len(better) > MAX_PAIRS_PER_SEARCH:
+            keep = rng.choice(len(better), MAX_PAIRS_PER_SEARCH, replace=False)
+            better, worse = better[keep], worse[keep]
+        differences.append(features[start + better] - features[start + worse])
+    return np.vstack(differences) if differences else np.empty((0, features.shape[1]))
+
+
+def fit_weights(features: np.ndarray, labels: np.ndarray, groups: List[Tuple[int, int]],
+                seed: int = 0, fallback: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+    """Poids appris, à l'échelle des poids par défaut (None si pas assez de paires)
+
+    Une caractéristique qui ne varie dans aucune paire (user_affinity, non
+    journalisée au moment de la recherche) n'est pas apprise: elle garde son
+    poids de `fallback` (poids par défaut si absent) au lieu d'un 0 ajusté.
+    """
+    differences = pairwise_differences(features, labels, groups, np.random.default_rng(seed))
+    if len(differences) < len(FEATURES):
+        return None
+    if fallback is None:
+        fallback = weight_vector(DEFAULT_WEIGHTS)
+    untrained = ~differences.any(axis=0)
+    scale = features.std(axis=0)
+    scale[scale == 0] = 1
+    # Paires dans les deux sens: problème symétrique, sans constante
+    x = np.vstack((differences, -differences)) / scale
+    y = np.r_[np.ones(len(differences)), np.zeros(len(differences))]
+    model = LogisticRegression(fit_intercept=False, C=1.0, max_iter=1000).fit(x, y)
+    learned = model.coef_.ravel() / scale
+
+    # Même dispersion des scores que les poids par défaut (scores comparables entre versions)
+    default_spread = (features @ weight_vector(DEFAULT_WEIGHTS)).std()
+    learned_spread = (features @ learned).std()
+    if learned_spread > 0:
+        learned = learned * (default_spread / learned_spread)
+    if untrained.any():
+        logger.info("Poids conservés (caractéristiques sans variation): %s",
+                    [name for name, flag in zip(FEATURES, untrained) if flag])
+        learned[untrained] = fallback[untrained]
+    return learned
+
+
+def load_impressions(db, days: int = TRAINING_DAYS) -> Dict[str, np.ndarray]:
+    rows = db.execute(text(IMPRESSIONS_SQL), {
+        "days": days, "window": ATTRIBUTION_WINDOW_MINUTES,
+        "click_gain": INTERACTION_GAINS['click'], "call_gain": INTERACTION_GAINS['call'],
+        "direction_gain": INTERACTION_GAINS['direction'],
+    }).mappings().all()
+    columns = {name: [row[name] for row in rows] for name in rows[0].keys()} if rows else {}
+    return {
+        "search_ids": np.array(columns.get("search_id", []), dtype=np.int64),
+        "positions": np.array(columns.get("position", []), dtype=np.float64),
+        "labels": np.array(columns.get("label", []), dtype=np.float64),
+        "features": feature_matrix(columns) if rows else np.empty((0, len(FEATURES))),
+    }
+
+
+def train(data: Dict[str, np.ndarray], current_weights: Dict[str, float]) -> Dict[str, Any]:
+    """Apprend sur les recherches anciennes, évalue sur les plus récentes"""
+    groups = group_bounds(data["search_ids"])
+    split = int(len(groups) * (1 - HOLDOUT_FRACTION))
+    train_groups, test_groups = groups[:split], groups[split:]
+    features, labels = data["features"], data["labels"]
+
+    learned = fit_weights(features, labels, train_groups, fallback=weight_vector(current_weights))
+    report = {
+        "searches": len(groups),
+        "train_searches": len(train_groups),
+        "test_searches": len(test_groups),
+        "impressions": len(labels),
+        "ndcg_at": NDCG_AT,
+        "ndcg_displayed_order": ndcg(-data["positions"], labels, test_groups),
+        "ndcg_current": ndcg(features @ weight_vector(current_weights), labels, test_groups),
+        "ndcg_default": ndcg(features @ weight_vector(DEFAULT_WEIGHTS), labels, test_groups),
+        "ndcg_learned": None,
+    }
+    if learned is not None:
+        report["ndcg_learned"] = ndcg(features @ learned, labels, test_groups)
+        report["weights"] = {name: round(float(weight), 4) for name, weight in zip(FEATURES, learned)}
+    return report
+
+
+def export(report: Dict[str, Any], path: str = WEIGHTS_PATH) -> Optional[str]:
+    """Écrit la version apprise; remplace le fichier courant si elle ne régresse pas"""
+    if report.get("ndcg_learned") is None:
+        return None
+    version = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    payload = {
+        "version": version,
+        "features": list(FEATURES),
+        "weights": report["weights"],
+        "evaluation": {key: value for key, value in report.items() if key != "weights"},
+    }
+    versioned_path = os.path.join(directory, f"weights-{version}.json")
+    with open(versioned_path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2)
+
+    if report["ndcg_learned"] >= report["ndcg_current"]:
+        # Remplacement atomique: le moteur ne lit jamais un fichier partiel
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, indent=2)
+        os.replace(temporary_path, path)
+    return versioned_path
+
+
+def current_weights(path: str = WEIGHTS_PATH) -> Dict[str, float]:
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)["weights"]
+    except (OSError, ValueError, KeyError):
+        return DEFAULT_WEIGHTS
+
+
+def run_training(session_factory=None, days: int = TRAINING_DAYS, path: str = WEIGHTS_PATH) -> Dict[str, Any]:
+    """Passe complète: extraction des impressions, apprentissage, évaluation, export"""
+    if session_factory is None:
+        from .new_models import SessionLocal as session_factory
+
+    with session_factory() as db:
+        data = load_impressions(db, days)
+    report = train(data, current_weights(path))
+    report["exported"] = export(report, path)
+    logger.info("Apprentissage du classement: %s",
+                {key: value for key, value in report.items() if key != "weights"})
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(run_training(), indent=2))
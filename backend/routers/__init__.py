@@ -0,0 +1,3 @@
+"""
+Endpoints API modulaires
+"""
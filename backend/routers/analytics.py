@@ -0,0 +1,36 @@
+"""
+Tableau de bord des recherches, lu dans les agrégats horaires
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..analytics_rollups import SearchRollups, TOP_QUERIES
+from ..async_database import get_async_db
+
+router = APIRouter(prefix="/api/v1/analytics", tags=["analytics"])
+
+rollups = SearchRollups()
+
+# Période maximale d'une requête (quelques milliers de lignes agrégées au plus)
+MAX_PERIOD = timedelta(days=92)
+
+
+@router.get("/searches")
+async def search_analytics(
+    since: Optional[datetime] = Query(None, description="Début (par défaut: il y a 24 h)"),
+    until: Optional[datetime] = Query(None, description="Fin exclue (par défaut: maintenant)"),
+    zone_id: Optional[int] = Query(None),
+    intent: Optional[str] = Query(None, max_length=50),
+    activity_type_id: Optional[int] = Query(None),
+    top_queries: int = Query(TOP_QUERIES, ge=0, le=50),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Volume, recherches sans résultat, p95, taux de clic et requêtes fréquentes, par heure"""
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=1)
+    if since >= until or until - since > MAX_PERIOD:
+        raise HTTPException(status_code=400, detail="Période invalide")
+    return await rollups.summary_async(db, since, until, zone_id, intent, activity_type_id, top_queries)
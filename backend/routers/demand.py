@@ -0,0 +1,39 @@
+"""
+Tuiles de demande (recherches et recherches sans résultat) pour les ambassadeurs
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.orm import Session
+
+from ..demand_tiles import demand_tiles, valid_tile
+from ..new_models import SessionLocal, get_db
+
+router = APIRouter(prefix="/api/v1/demand", tags=["demand"])
+
+# Les tuiles changent au plus une fois par mise à jour des cases
+CACHE_CONTROL = "public, max-age=60"
+
+
+@router.on_event("startup")
+def start_demand_tiles():
+    """Démarre la mise à jour incrémentale des cases et le recalcul des tuiles périmées"""
+    demand_tiles.start(SessionLocal)
+
+
+@router.get("/tiles/{z}/{x}/{y}.json")
+def demand_tile(
+    z: int,
+    x: int,
+    y: int,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Tuile pré-calculée en JSON compact; 304 si l'ETag du client est à jour"""
+    if not valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tuile inexistante")
+    body, etag = demand_tiles.tile(db, z, x, y)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
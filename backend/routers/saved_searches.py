@@ -0,0 +1,57 @@
+"""
+Alertes sur recherches enregistrées ("prévenez-moi quand ça ouvre")
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+
+from ..change_feed import change_feed
+from ..new_models import SessionLocal, get_db
+from ..saved_searches import MAX_RADIUS_M, saved_searches
+
+router = APIRouter(prefix="/api/v1/saved-searches", tags=["saved-searches"])
+
+
+class SavedSearchCreate(BaseModel):
+    user_id: int
+    name: str = Field(..., min_length=1, max_length=255)
+    query: Optional[str] = None
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    radius: int = Field(1000, gt=0, le=MAX_RADIUS_M)
+    activity_type_id: Optional[int] = None
+    category_id: Optional[int] = None
+    require_open: bool = True
+    require_verified: bool = False
+
+
+@router.on_event("startup")
+def start_saved_searches():
+    """Abonne la percolation au flux de changements, démarre l'écoute et l'évaluation par lots"""
+    saved_searches.register_change_feed()
+    change_feed.start()
+    saved_searches.start(SessionLocal)
+
+
+@router.post("/")
+def create_saved_search(request: SavedSearchCreate, db: Session = Depends(get_db)):
+    """Enregistre une alerte; seuls les changements ultérieurs sont notifiés"""
+    try:
+        saved_search_id = saved_searches.subscribe(db, **request.model_dump())
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return {"id": saved_search_id}
+
+
+@router.get("/")
+def list_saved_searches(user_id: int = Query(...), db: Session = Depends(get_db)):
+    return {"saved_searches": saved_searches.list_for_user(db, user_id)}
+
+
+@router.delete("/{saved_search_id}")
+def delete_saved_search(saved_search_id: int, user_id: int = Query(...), db: Session = Depends(get_db)):
+    if not saved_searches.unsubscribe(db, user_id, saved_search_id):
+        raise HTTPException(status_code=404, detail="Alerte inexistante")
+    return {"deleted": saved_search_id}
@@ -0,0 +1,23 @@
+"""
+Lieux similaires à une activité consultée
+"""
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..async_database import get_async_db
+from ..similar_places import SimilarPlaces, TOP_K
+
+router = APIRouter(prefix="/api/v1/activities", tags=["similar"])
+
+
+@router.get("/{activity_id}/similar")
+async def similar_activities(
+    activity_id: int,
+    limit: int = Query(TOP_K, ge=1, le=TOP_K),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Voisins précalculés par le job nocturne, en une lecture"""
+    return {
+        "activity_id": activity_id,
+        "similar": await SimilarPlaces.lookup_async(db, activity_id, limit),
+    }
@@ -0,0 +1,35 @@
+"""
+Suggestions de saisie pendant la frappe dans le chat
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Query
+
+from ..change_feed import change_feed
+from ..typeahead import typeahead
+
+router = APIRouter(prefix="/api/v1/suggest", tags=["suggestions"])
+
+
+@router.on_event("startup")
+def load_suggestions():
+    """Construit l'index, l'abonne au flux de changements et démarre l'écoute"""
+    typeahead.build()
+    typeahead.register_change_feed()
+    change_feed.start()
+
+
+@router.get("/")
+async def suggest(
+    q: str = Query(..., min_length=1, max_length=64, description="Texte saisi"),
+    latitude: Optional[float] = Query(None, ge=-90, le=90),
+    longitude: Optional[float] = Query(None, ge=-180, le=180),
+    limit: int = Query(8, ge=1, le=20),
+    types: Optional[str] = Query(None, description="activity,activity_type,category,tag,keyword,zone"),
+):
+    """Suggestions pour le préfixe saisi, sans accès à la base de données"""
+    kinds = [kind.strip() for kind in types.split(",") if kind.strip()] if types else None
+    return {
+        "query": q,
+        "suggestions": typeahead.suggest(q, limit, latitude, longitude, kinds),
+    }
@@ -0,0 +1,44 @@
+"""
+Tuiles vectorielles des activités pour la carte
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.orm import Session
+
+from ..activity_tiles import activity_tiles, valid_tile
+from ..change_feed import change_feed
+from ..new_models import get_db
+
+router = APIRouter(prefix="/api/v1/tiles", tags=["tiles"])
+
+MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+# Court: une tuile invalidée côté serveur doit vite être relue par les clients
+CACHE_CONTROL = "public, max-age=30"
+
+
+@router.on_event("startup")
+def load_activity_tiles():
+    """Abonne le cache des tuiles au flux de changements et démarre l'écoute"""
+    activity_tiles.register_change_feed()
+    change_feed.start()
+
+
+@router.get("/{z}/{x}/{y}")
+def activity_tile(
+    z: int,
+    x: int,
+    y: int,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Tuile MVT (couches `activities` et, aux petits niveaux, `clusters`)"""
+    if not valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tuile inexistante")
+    data = activity_tiles.tile(db, z, x, y)
+    etag = '"' + hashlib.md5(data).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=MEDIA_TYPE, headers=headers)
@@ -0,0 +1,391 @@
+"""
+Calcul d'itinéraires routiers hors ligne (graphe OpenStreetMap local)
+
+La distance à vol d'oiseau est trompeuse à Abidjan: lagunes et ponts séparent
+des zones proches. Le graphe routier est construit une fois à partir d'un
+extrait OSM (.osm, .osm.gz, .osm.bz2, ou .osm.pbf si le paquet `osmium` est
+installé), puis sauvegardé en tableaux numpy compacts:
+
+- les voies sont coupées aux seuls carrefours (nœuds partagés par plusieurs
+  voies et extrémités): les nœuds intermédiaires ne servent qu'au tracé, ce qui
+  divise le graphe par 5 à 10 sur un extrait urbain;
+- seule la plus grande composante fortement connexe est conservée (une
+  position n'est jamais rattachée à un îlot inaccessible);
+- les arcs sont une matrice CSR de temps de parcours (vitesse selon le type
+  de voie ou maxspeed), avec longueur et tracé de chaque arc.
+
+Une requête un-vers-plusieurs est un Dijkstra (scipy.sparse.csgraph, en C)
+borné par MAX_TRAVEL_SECONDS: quelques millisecondes pour les candidats d'une
+recherche. Les positions sont rattachées au carrefour le plus proche (KD-tree).
+
+    python -m backend.routing abidjan.osm.pbf data/road_graph.npz
+"""
+import bz2
+import gzip
+import logging
+import math
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+logger = logging.getLogger(__name__)
+
+GRAPH_PATH = os.getenv("ROAD_GRAPH_PATH", os.path.join(os.path.dirname(__file__), "..", "data", "road_graph.npz"))
+
+# Vitesses (km/h) par type de voie carrossable
+SPEEDS_KMH: Dict[str, float] = {
+    'motorway': 90, 'motorway_link': 50, 'trunk': 70, 'trunk_link': 40,
+    'primary': 50, 'primary_link': 35, 'secondary': 40, 'secondary_link': 30,
+    'tertiary': 35, 'tertiary_link': 25, 'unclassified': 30, 'residential': 25,
+    'living_street': 10, 'service': 15, 'road': 25, 'track': 15,
+}
+ONEWAY_VALUES = ('yes', 'true', '1')
+# Trajet entre la position et le carrefour le plus proche (à pied ou au pas)
+ACCESS_SPEED_KMH = 10
+# Au-delà, la destination est considérée comme inaccessible
+MAX_TRAVEL_SECONDS = 3600
+# Plus petit temps d'un arc (un arc de poids nul serait ignoré par csgraph)
+MIN_EDGE_SECONDS = 0.01
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def encode_polyline(latitudes: Sequence[float], longitudes: Sequence[float], precision: int = 5) -> str:
+    """Tracé au format polyline (Google), lu par les bibliothèques de cartes"""
+    factor = 10 ** precision
+    output = []
+    previous_lat = previous_lon = 0
+    for latitude, longitude in zip(latitudes, longitudes):
+        lat, lon = int(round(latitude * factor)), int(round(longitude * factor))
+        for delta in (lat - previous_lat, lon - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        previous_lat, previous_lon = lat, lon
+    return "".join(output)
+
+
+# -------------------------------------------------
+# Lecture de l'extrait OSM
+# -------------------------------------------------
+
+Way = Tuple[List[int], Dict[str, str]]
+
+
+def _speed(tags: Dict[str, str]) -> Optional[float]:
+    speed = SPEEDS_KMH.get(tags.get('highway', ''))
+    if speed is None or tags.get('access') in ('no', 'private') or tags.get('motor_vehicle') == 'no':
+        return None
+    maxspeed = tags.get('maxspeed', '').split(' ')[0]
+    return float(maxspeed) if maxspeed.isdigit() and int(maxspeed) > 0 else speed
+
+
+def _open(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _read_xml(path: str) -> Tuple[List[Way], Dict[int, Tuple[float, float]]]:
+    """Deux passes: les voies d'abord, puis les seuls nœuds qu'elles utilisent"""
+    ways: List[Way] = []
+    with _open(path) as handle:
+        for _, element in ElementTree.iterparse(handle):
+            if element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                if _speed(tags) is not None:
+                    ways.append(([int(node.get('ref')) for node in element.iter('nd')], tags))
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+
+    used = {node for refs, _ in ways for node in refs}
+    coordinates: Dict[int, Tuple[float, float]] = {}
+    with _open(path) as handle:
+        for _, element in ElementTree.iterparse(handle):
+            if element.tag == 'node':
+                node_id = int(element.get('id'))
+                if node_id in used:
+                    coordinates[node_id] = (float(element.get('lat')), float(element.get('lon')))
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+    return ways, coordinates
+
+
+def _read_pbf(path: str) -> Tuple[List[Way], Dict[int, Tuple[float, float]]]:
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("La lecture des fichiers .osm.pbf nécessite le paquet osmium (pip install osmium)")
+
+    ways: List[Way] = []
+    coordinates: Dict[int, Tuple[float, float]] = {}
+
+    class Handler(osmium.SimpleHandler):
+        def way(self, way):
+            tags = {tag.k: tag.v for tag in way.tags}
+            if _speed(tags) is None:
+                return
+            refs = []
+            for node in way.nodes:
+                if node.location.valid():
+                    refs.append(node.ref)
+                    coordinates[node.ref] = (node.location.lat, node.location.lon)
+            ways.append((refs, tags))
+
+    Handler().apply_file(path, locations=True)
+    return ways, coordinates
+
+
+def read_osm(path: str) -> Tuple[List[Way], Dict[int, Tuple[float, float]]]:
+    """Voies carrossables (nœuds, tags) et coordonnées de leurs nœuds"""
+    return _read_pbf(path) if path.endswith('.pbf') else _read_xml(path)
+
+
+# -------------------------------------------------
+# Graphe
+# -------------------------------------------------
+
+class RoadGraph:
+    """Graphe routier compact: carrefours, arcs CSR, tracés"""
+
+    ARRAYS = ('latitude', 'longitude', 'indptr', 'indices', 'seconds', 'meters',
+              'shape_index', 'shape_reversed', 'shape_indptr', 'shape_latitude', 'shape_longitude')
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        count = len(self.latitude)
+        self.graph = csr_matrix((self.seconds, self.indices, self.indptr), shape=(count, count))
+        # Projection locale équirectangulaire (mètres) pour le rattachement au carrefour le plus proche
+        self._cos_latitude = math.cos(math.radians(float(np.mean(self.latitude)))) if count else 1.0
+        self._tree = cKDTree(self._project(self.latitude, self.longitude)) if count else None
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    def _project(self, latitudes, longitudes) -> np.ndarray:
+        scale = math.pi * EARTH_RADIUS_M / 180
+        return np.column_stack((np.asarray(longitudes, dtype=np.float64) * self._cos_latitude * scale,
+                                np.asarray(latitudes, dtype=np.float64) * scale))
+
+    # -------------------------------------------------
+    # Construction et sauvegarde
+    # -------------------------------------------------
+
+    @classmethod
+    def from_ways(cls, ways: List[Way], coordinates: Dict[int, Tuple[float, float]]) -> "RoadGraph":
+        ways = [([node for node in refs if node in coordinates], tags) for refs, tags in ways]
+        ways = [(refs, tags) for refs, tags in ways if len(refs) >= 2]
+
+        # Carrefours: nœuds partagés par plusieurs voies (ou répétés) et extrémités
+        references = Counter(node for refs, _ in ways for node in refs)
+        for refs, _ in ways:
+            references[refs[0]] += 1
+            references[refs[-1]] += 1
+        junction_index: Dict[int, int] = {}
+
+        sources, targets, seconds, meters, shapes, reversed_shapes = [], [], [], [], [], []
+        shape_points: List[Tuple[float, float]] = []
+        shape_indptr = [0]
+        for refs, tags in ways:
+            speed = _speed(tags) / 3.6
+            oneway = tags.get('oneway', '')
+            forward = True
+            backward = not (oneway in ONEWAY_VALUES or tags.get('junction') == 'roundabout'
+                            or (tags.get('highway') == 'motorway' and oneway != 'no'))
+            if oneway == '-1':
+                forward, backward = False, True
+
+            start = 0
+            for position in range(1, len(refs)):
+                if references[refs[position]] < 2 and position < len(refs) - 1:
+                    continue
+                segment = refs[start:position + 1]
+                start = position
+                points = [coordinates[node] for node in segment]
+                latitudes, longitudes = np.array(points).T
+                length = float(haversine_m(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:]).sum())
+                shape = len(shape_indptr) - 1
+                shape_points.extend(points)
+                shape_indptr.append(len(shape_points))
+
+                first = junction_index.setdefault(segment[0], len(junction_index))
+                last = junction_index.setdefault(segment[-1], len(junction_index))
+                duration = max(length / speed, MIN_EDGE_SECONDS)
+                for keep, source, target, flipped in ((forward, first, last, False), (backward, last, first, True)):
+                    if keep and source != target:
+                        sources.append(source)
+                        targets.append(target)
+                        seconds.append(duration)
+                        meters.append(length)
+                        shapes.append(shape)
+                        reversed_shapes.append(flipped)
+
+        junction_coordinates = np.zeros((len(junction_index), 2))
+        for node, index in junction_index.items():
+            junction_coordinates[index] = coordinates[node]
+        sources, targets = np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64)
+        seconds, meters = np.array(seconds), np.array(meters)
+        shapes, reversed_shapes = np.array(shapes, dtype=np.int64), np.array(reversed_shapes, dtype=bool)
+
+        # Plus grande composante fortement connexe
+        count = len(junction_index)
+        full = csr_matrix((seconds, (sources, targets)), shape=(count, count))
+        _, labels = connected_components(full, directed=True, connection='strong')
+        main = np.bincount(labels).argmax() if count else 0
+        kept_nodes = labels == main
+        renumber = np.cumsum(kept_nodes) - 1
+        kept_edges = kept_nodes[sources] & kept_nodes[targets]
+        sources, targets = renumber[sources[kept_edges]], renumber[targets[kept_edges]]
+        seconds, meters = seconds[kept_edges], meters[kept_edges]
+        shapes, reversed_shapes = shapes[kept_edges], reversed_shapes[kept_edges]
+
+        # Un seul arc (le plus rapide) par couple de carrefours, dans l'ordre CSR
+        order = np.lexsort((seconds, targets, sources))
+        sources, targets = sources[order], targets[order]
+        first = np.r_[True, (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])]
+        edges = order[first]
+        node_count = int(kept_nodes.sum())
+
+        used_shapes = np.unique(shapes[edges])
+        shape_indptr = np.array(shape_indptr, dtype=np.int64)
+        shape_points = np.array(shape_points, dtype=np.float64).reshape(-1, 2)
+        lengths = shape_indptr[used_shapes + 1] - shape_indptr[used_shapes]
+        point_index = np.concatenate([np.arange(shape_indptr[shape], shape_indptr[shape + 1]) for shape in used_shapes]) \
+            if len(used_shapes) else np.array([], dtype=np.int64)
+        shape_renumber = np.zeros(len(shape_indptr), dtype=np.int64)
+        shape_renumber[used_shapes] = np.arange(len(used_shapes))
+
+        return cls({
+            'latitude': junction_coordinates[kept_nodes, 0].astype(np.float32),
+            'longitude': junction_coordinates[kept_nodes, 1].astype(np.float32),
+            'indptr': np.r_[0, np.cumsum(np.bincount(sources[first], minlength=node_count))].astype(np.int32),
+            'indices': targets[first].astype(np.int32),
+            'seconds': seconds[edges].astype(np.float32),
+            'meters': meters[edges].astype(np.float32),
+            'shape_index': shape_renumber[shapes[edges]].astype(np.int32),
+            'shape_reversed': reversed_shapes[edges],
+            'shape_indptr': np.r_[0, np.cumsum(lengths)].astype(np.int64),
+            'shape_latitude': shape_points[point_index, 0].astype(np.float32),
+            'shape_longitude': shape_points[point_index, 1].astype(np.float32),
+        })
+
+    @classmethod
+    def from_osm(cls, path: str) -> "RoadGraph":
+        ways, coordinates = read_osm(path)
+        return cls.from_ways(ways, coordinates)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temporary_path = path + ".tmp.npz"
+        np.savez_compressed(temporary_path, **{name: getattr(self, name) for name in self.ARRAYS})
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RoadGraph":
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in cls.ARRAYS})
+
+    # -------------------------------------------------
+    # Requêtes
+    # -------------------------------------------------
+
+    def nearest(self, latitudes, longitudes) -> Tuple[np.ndarray, np.ndarray]:
+        """Carrefour le plus proche de chaque position, et distance (m) à ce carrefour"""
+        distances, nodes = self._tree.query(self._project(np.atleast_1d(latitudes), np.atleast_1d(longitudes)))
+        return nodes, distances
+
+    def one_to_many(self, latitude: float, longitude: float, latitudes: Sequence[float],
+                    longitudes: Sequence[float], limit: float = MAX_TRAVEL_SECONDS) -> "Routes":
+        """Temps de parcours depuis une position vers plusieurs destinations"""
+        (source,), (source_access,) = self.nearest(latitude, longitude)
+        times, predecessors = dijkstra(self.graph, indices=int(source), limit=limit, return_predecessors=True)
+        targets, target_access = self.nearest(latitudes, longitudes)
+        access_seconds = (source_access + target_access) / (ACCESS_SPEED_KMH / 3.6)
+        seconds = times[targets] + access_seconds
+        seconds[seconds > limit] = np.inf
+        return Routes(self, int(source), targets, seconds, predecessors)
+
+    def edge(self, source: int, target: int) -> int:
+        start, end = self.indptr[source], self.indptr[source + 1]
+        return int(start + np.flatnonzero(self.indices[start:end] == target)[0])
+
+    def path(self, source: int, target: int, predecessors: np.ndarray) -> Tuple[List[float], List[float], float]:
+        """Tracé (latitudes, longitudes) et longueur (m) du plus court chemin"""
+        nodes = [target]
+        while nodes[-1] != source:
+            nodes.append(int(predecessors[nodes[-1]]))
+        nodes.reverse()
+
+        latitudes, longitudes = [float(self.latitude[source])], [float(self.longitude[source])]
+        length = 0.0
+        for first, second in zip(nodes[:-1], nodes[1:]):
+            edge = self.edge(first, second)
+            shape = self.shape_index[edge]
+            points = slice(self.shape_indptr[shape], self.shape_indptr[shape + 1])
+            shape_latitudes, shape_longitudes = self.shape_latitude[points], self.shape_longitude[points]
+            if self.shape_reversed[edge]:
+                shape_latitudes, shape_longitudes = shape_latitudes[::-1], shape_longitudes[::-1]
+            latitudes.extend(shape_latitudes[1:].tolist())
+            longitudes.extend(shape_longitudes[1:].tolist())
+            length += float(self.meters[edge])
+        return latitudes, longitudes, length
+
+
+class Routes:
+    """Résultat d'une requête un-vers-plusieurs; les tracés sont reconstruits à la demande"""
+
+    def __init__(self, graph: RoadGraph, source: int, targets: np.ndarray, seconds: np.ndarray,
+                 predecessors: np.ndarray):
+        self.graph = graph
+        self.source = source
+        self.targets = targets
+        self.seconds = seconds
+        self.predecessors = predecessors
+
+    def route(self, index: int) -> Optional[Dict[str, float]]:
+        """Temps, longueur et tracé encodé vers la destination `index` (None si inaccessible)"""
+        if not np.isfinite(self.seconds[index]):
+            return None
+        latitudes, longitudes, meters = self.graph.path(self.source, int(self.targets[index]), self.predecessors)
+        return {
+            "seconds": round(float(self.seconds[index])),
+            "meters": round(meters),
+            "polyline": encode_polyline(latitudes, longitudes),
+        }
+
+
+def load_road_graph(path: str = GRAPH_PATH) -> Optional[RoadGraph]:
+    """Graphe sauvegardé, ou None s'il n'a pas été construit (classement à vol d'oiseau)"""
+    if not os.path.exists(path):
+        logger.info("Pas de graphe routier (%s): classement à vol d'oiseau", path)
+        return None
+    graph = RoadGraph.load(path)
+    logger.info("Graphe routier chargé: %d carrefours, %d arcs", len(graph), len(graph.indices))
+    return graph
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python -m backend.routing <extrait.osm[.pbf|.gz|.bz2]> [graphe.npz]")
+        sys.exit(1)
+    road_graph = RoadGraph.from_osm(sys.argv[1])
+    road_graph.save(sys.argv[2] if len(sys.argv) == 3 else GRAPH_PATH)
+    print(f"{len(road_graph)} carrefours, {len(road_graph.indices)} arcs")
@@ -0,0 +1,290 @@
+"""
+Alertes sur recherches enregistrées ("prévenez-moi quand une pharmacie ouvre près de chez moi")
+
+Relancer chaque recherche enregistrée périodiquement coûterait
+utilisateurs x activités. La recherche est inversée (percolation): chaque
+alerte est indexée dans `saved_search_cells` par les cellules geohash qui
+recouvrent son cercle, son type et sa catégorie (0 = indifférent). Quand une
+activité change, seules les alertes de ses cellules (ST_GeoHash aux
+précisions indexées) et de son type/catégorie sont évaluées: le coût est
+proportionnel au nombre d'alertes concernées.
+
+Une notification n'est écrite que lorsqu'une alerte passe de "ne correspond
+pas" à "correspond" (`saved_search_matches`), au plus une fois par
+RENOTIFY_AFTER_HOURS pour un même lieu. Les activités modifiées sont
+regroupées et évaluées par lots: une requête SQL par lot, qui écrit toutes
+les notifications du lot. L'évaluation est idempotente (ON CONFLICT sur
+l'état de correspondance): plusieurs workers peuvent traiter les mêmes
+changements sans doublon.
+"""
+import logging
+import math
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+from .geo_cells import covering
+
+logger = logging.getLogger(__name__)
+
+# Précisions geohash indexées: 4 ≈ 39 km x 20 km, 7 ≈ 150 m x 150 m
+MIN_CELL_PRECISION = 4
+MAX_CELL_PRECISION = 7
+# Précision la plus fine dont le recouvrement reste sous cette limite
+MAX_COVERING_CELLS = 16
+MAX_RADIUS_M = 20000
+MAX_SAVED_SEARCHES_PER_USER = 20
+RENOTIFY_AFTER_HOURS = 12
+
+FLUSH_INTERVAL_SECONDS = 2
+BATCH_SIZE = 500
+# Colonnes d'activité qui peuvent changer le résultat d'une alerte
+MATCH_COLUMNS = ('name', 'location', 'activity_type_id', 'category_id', 'is_active', 'is_open', 'is_verified')
+
+METERS_PER_DEGREE = 111320
+
+# Conditions d'une alerte `s` sur une activité `a`
+MATCH_SQL = """
+    a.is_active IS NOT FALSE
+    AND (NOT s.require_open OR a.is_open IS TRUE)
+    AND (NOT s.require_verified OR a.is_verified IS TRUE)
+    AND (s.activity_type_id IS NULL OR a.activity_type_id = s.activity_type_id)
+    AND (s.category_id IS NULL OR a.category_id = s.category_id)
+    AND ST_DWithin(a.location::geography, s.location::geography, s.radius)
+"""
+
+INSERT_SEARCH_SQL = """
+INSERT INTO saved_searches (user_id, name, query, activity_type_id, category_id, location, radius,
+                            require_open, require_verified, cell_precision)
+VALUES (:user_id, :name, :query, :activity_type_id, :category_id,
+        ST_SetSRID(ST_MakePoint(:longitude, :latitude), 4326), :radius,
+        :require_open, :require_verified, :cell_precision)
+RETURNING id
+"""
+
+INSERT_CELL_SQL = """
+INSERT INTO saved_search_cells (cell, type_key, category_key, saved_search_id)
+VALUES (:cell, :type_key, :category_key, :saved_search_id)
+"""
+
+# Les lieux qui correspondent déjà à la création ne déclenchent pas de notification
+# Boîte englobante en degrés (écart de longitude, le plus grand) avant ST_DWithin: index spatial utilisé
+SEED_MATCHES_SQL = f"""
+INSERT INTO saved_search_matches (saved_search_id, activity_id, matching)
+SELECT s.id, a.id, TRUE
+FROM saved_searches s
+JOIN activities a
+  ON a.location && ST_Expand(s.location, s.radius / ({METERS_PER_DEGREE} * GREATEST(cos(radians(ST_Y(s.location))), 0.01)))
+ AND ST_DWithin(a.location::geography, s.location::geography, s.radius)
+WHERE s.id = :saved_search_id AND {MATCH_SQL}
+"""
+
+PERCOLATE_SQL = f"""
+WITH changed AS (
+    SELECT id, name, activity_type_id, category_id, location, is_active, is_open, is_verified
+    FROM activities
+    WHERE id = ANY(:ids)
+),
+candidates AS (
+    SELECT DISTINCT c.id AS activity_id, ssc.saved_search_id
+    FROM changed c
+    CROSS JOIN generate_series({MIN_CELL_PRECISION}, {MAX_CELL_PRECISION}) AS p
+    JOIN saved_search_cells ssc
+      ON ssc.cell = ST_GeoHash(c.location, p)
+     AND ssc.type_key IN (0, COALESCE(c.activity_type_id, 0))
+     AND ssc.category_key IN (0, COALESCE(c.category_id, 0))
+),
+evaluated AS (
+    SELECT s.id AS saved_search_id, a.id AS activity_id, ({MATCH_SQL}) AS matching
+    FROM candidates k
+    JOIN saved_searches s ON s.id = k.saved_search_id AND s.is_active
+    JOIN changed a ON a.id = k.activity_id
+),
+cleared AS (
+    UPDATE saved_search_matches m SET matching = FALSE
+    FROM evaluated e
+    WHERE m.saved_search_id = e.saved_search_id AND m.activity_id = e.activity_id
+      AND NOT e.matching AND m.matching
+    RETURNING m.saved_search_id
+),
+matched AS (
+    INSERT INTO saved_search_matches AS m (saved_search_id, activity_id, matching, notified_at)
+    SELECT saved_search_id, activity_id, TRUE, NOW() FROM evaluated WHERE matching
+    ON CONFLICT (saved_search_id, activity_id) DO UPDATE SET
+        matching = TRUE,
+        notified_at = CASE
+            WHEN m.notified_at IS NULL OR m.notified_at < NOW() - make_interval(hours => :renotify_hours)
+            THEN NOW() ELSE m.notified_at END
+    WHERE NOT m.matching
+    RETURNING m.saved_search_id, m.activity_id, m.notified_at = NOW() AS notify
+)
+INSERT INTO notifications (user_id, title, message, notification_type, target_activity_id, data)
+SELECT s.user_id, s.name,
+       a.name || CASE WHEN s.require_open THEN ' est ouvert' ELSE ' correspond à votre alerte' END
+       || ' à ' || round(ST_Distance(a.location::geography, s.location::geography))::INT || ' m',
+       'info', a.id,
+       jsonb_build_object('kind', 'saved_search', 'saved_search_id', s.id)
+FROM matched t
+JOIN saved_searches s ON s.id = t.saved_search_id
+JOIN changed a ON a.id = t.activity_id
+WHERE t.notify
+RETURNING id
+"""
+
+LIST_SQL = """
+SELECT id, name, query, activity_type_id, category_id, ST_Y(location) AS latitude, ST_X(location) AS longitude,
+       radius, require_open, require_verified, is_active, created_at
+FROM saved_searches
+WHERE user_id = :user_id
+ORDER BY created_at DESC
+"""
+
+
+def search_cells(latitude: float, longitude: float, radius: float) -> Tuple[int, List[str]]:
+    """Précision et cellules qui recouvrent le cercle d'une alerte"""
+    lat_delta = radius / METERS_PER_DEGREE
+    lon_delta = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    box = (latitude - lat_delta, longitude - lon_delta, latitude + lat_delta, longitude + lon_delta)
+    for precision in range(MAX_CELL_PRECISION, MIN_CELL_PRECISION, -1):
+        cells = covering(*box, precision)
+        if len(cells) <= MAX_COVERING_CELLS:
+            return precision, cells
+    return MIN_CELL_PRECISION, covering(*box, MIN_CELL_PRECISION)
+
+
+class SavedSearches:
+    """Création des alertes et percolation des activités modifiées"""
+
+    def __init__(self):
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"percolated": 0, "notifications": 0, "batches": 0}
+
+    # -------------------------------------------------
+    # Alertes
+    # -------------------------------------------------
+
+    def subscribe(self, db, user_id: int, name: str, latitude: float, longitude: float, radius: float,
+                  activity_type_id: Optional[int] = None, category_id: Optional[int] = None,
+                  require_open: bool = True, require_verified: bool = False,
+                  query: Optional[str] = None) -> int:
+        """Enregistre une alerte et l'indexe; retourne son identifiant"""
+        if not 0 < radius <= MAX_RADIUS_M:
+            raise ValueError(f"Rayon invalide: {radius}")
+        count = db.execute(text("SELECT COUNT(*) FROM saved_searches WHERE user_id = :user_id"),
+                           {"user_id": user_id}).scalar()
+        if count >= MAX_SAVED_SEARCHES_PER_USER:
+            raise ValueError(f"Limite de {MAX_SAVED_SEARCHES_PER_USER} alertes atteinte")
+
+        precision, cells = search_cells(latitude, longitude, radius)
+        saved_search_id = db.execute(text(INSERT_SEARCH_SQL), {
+            "user_id": user_id, "name": name, "query": query,
+            "activity_type_id": activity_type_id, "category_id": category_id,
+            "latitude": latitude, "longitude": longitude, "radius": radius,
+            "require_open": require_open, "require_verified": require_verified,
+            "cell_precision": precision,
+        }).scalar()
+        db.execute(text(INSERT_CELL_SQL), [
+            {"cell": cell, "type_key": activity_type_id or 0, "category_key": category_id or 0,
+             "saved_search_id": saved_search_id}
+            for cell in cells
+        ])
+        db.execute(text(SEED_MATCHES_SQL), {"saved_search_id": saved_search_id})
+        db.commit()
+        return saved_search_id
+
+    @staticmethod
+    def unsubscribe(db, user_id: int, saved_search_id: int) -> bool:
+        """Supprime une alerte (cellules et correspondances en cascade)"""
+        deleted = db.execute(
+            text("DELETE FROM saved_searches WHERE id = :id AND user_id = :user_id"),
+            {"id": saved_search_id, "user_id": user_id}
+        ).rowcount
+        db.commit()
+        return deleted > 0
+
+    @staticmethod
+    def list_for_user(db, user_id: int) -> List[Dict[str, Any]]:
+        return [dict(row) for row in db.execute(text(LIST_SQL), {"user_id": user_id}).mappings()]
+
+    # -------------------------------------------------
+    # Percolation
+    # -------------------------------------------------
+
+    def percolate(self, db, activity_ids: Sequence[int]) -> int:
+        """Évalue les alertes concernées par ces activités; retourne le nombre de notifications"""
+        if not activity_ids:
+            return 0
+        notified = len(db.execute(text(PERCOLATE_SQL), {
+            "ids": list(activity_ids), "renotify_hours": RENOTIFY_AFTER_HOURS,
+        }).all())
+        db.commit()
+        self.stats["percolated"] += len(activity_ids)
+        self.stats["notifications"] += notified
+        self.stats["batches"] += 1
+        return notified
+
+    def activity_changed(self, activity_id: int) -> None:
+        """Met l'activité en attente du prochain lot"""
+        with self._lock:
+            self._pending.add(activity_id)
+
+    def flush(self, session_factory) -> int:
+        """Évalue les activités en attente, par lots de BATCH_SIZE"""
+        notified = 0
+        while True:
+            with self._lock:
+                batch = [self._pending.pop() for _ in range(min(BATCH_SIZE, len(self._pending)))]
+            if not batch:
+                return notified
+            try:
+                with session_factory() as db:
+                    notified += self.percolate(db, batch)
+            except Exception:
+                # Le lot sera réessayé au prochain passage
+                with self._lock:
+                    self._pending.update(batch)
+                raise
+
+    def register_change_feed(self, feed=None) -> None:
+        """Évalue les alertes à chaque modification d'activité qui peut changer leur résultat"""
+        if feed is None:
+            from .change_feed import change_feed as feed
+
+        def on_change(event) -> None:
+            # Après une reconnexion, le rattrapage par updated_at rejoue les modifications
+            if event.is_reset or event.id is None or not event.touches(*MATCH_COLUMNS):
+                return
+            self.activity_changed(event.id)
+
+        feed.register("activities", on_change)
+
+    # -------------------------------------------------
+    # Exécution périodique
+    # -------------------------------------------------
+
+    def start(self, session_factory, interval: float = FLUSH_INTERVAL_SECONDS) -> None:
+        """Évalue les lots en attente dans un thread dédié"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.flush(session_factory)
+                except Exception:
+                    logger.exception("Échec de l'évaluation des alertes")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="saved-searches", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+saved_searches = SavedSearches()
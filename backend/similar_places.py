@@ -0,0 +1,260 @@
+"""
+Listes précalculées de lieux similaires ("vous aimerez aussi")
+
+Pour chaque activité, les TOP_K activités les plus proches au sens de:
+
+- co-interaction: cosinus entre colonnes de la matrice creuse
+  (visiteur x activité) des interactions récentes, les visiteurs étant les
+  utilisateurs ou, à défaut, les sessions;
+- contenu: même type d'activité, niveau de prix voisin, proximité spatiale.
+
+Les candidats sont les voisins par co-interaction et les activités du même
+type dans la même cellule geohash (≈ 5 km): aucune comparaison de toutes les
+paires. Les activités sans position sont exclues (pas de cellule ni de
+distance). Le calcul est fait par tranches de lignes avec des opérations sur
+matrices creuses et tableaux, puis écrit dans `activity_similar` (une ligne
+compacte par activité). Prévu pour tourner chaque nuit:
+
+    python -m backend.similar_places
+"""
+import logging
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import text
+
+from .popularity import INTERACTION_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 10
+INTERACTION_DAYS = 90
+# Cellule geohash des candidats par contenu (≈ 5 km x 5 km)
+CONTENT_CELL_PRECISION = 5
+# Lignes traitées ensemble (mémoire bornée)
+CHUNK_ROWS = 20000
+
+# Mélange des signaux (somme 1)
+CO_INTERACTION_WEIGHT = 0.5
+TYPE_WEIGHT = 0.2
+PRICE_WEIGHT = 0.1
+PROXIMITY_WEIGHT = 0.2
+# Distance (km) à laquelle la proximité vaut 1/e
+PROXIMITY_SCALE_KM = 2.0
+MAX_PRICE_GAP = 4
+# Score minimal d'un voisin
+MIN_SCORE = 0.3
+
+ACTIVITIES_SQL = """
+SELECT id, COALESCE(activity_type_id, 0) AS activity_type_id, COALESCE(price_level, 0) AS price_level,
+       ST_Y(location) AS latitude, ST_X(location) AS longitude,
+       ST_GeoHash(location, :precision) AS cell
+FROM activities
+WHERE is_active = TRUE AND location IS NOT NULL
+"""
+
+INTERACTIONS_SQL = """
+SELECT COALESCE(user_id::TEXT, 's:' || session_id) AS visitor, activity_id, interaction_type, COUNT(*) AS events
+FROM user_interactions
+WHERE created_at >= NOW() - make_interval(days => :days)
+  AND activity_id IS NOT NULL AND (user_id IS NOT NULL OR session_id IS NOT NULL)
+GROUP BY 1, 2, 3
+"""
+
+UPSERT_SQL = """
+INSERT INTO activity_similar (activity_id, similar_ids, scores, computed_at)
+VALUES (:activity_id, :similar_ids, :scores, :computed_at)
+ON CONFLICT (activity_id) DO UPDATE SET
+    similar_ids = EXCLUDED.similar_ids, scores = EXCLUDED.scores, computed_at = EXCLUDED.computed_at
+"""
+
+# Une seule lecture: la liste et les activités voisines, dans l'ordre
+LOOKUP_SQL = """
+SELECT a.id, a.name, a.slug, a.activity_type_id, a.price_level, a.rating, a.is_open, a.cover_image_url,
+       ST_Y(a.location) AS latitude, ST_X(a.location) AS longitude, n.score
+FROM activity_similar s
+CROSS JOIN LATERAL unnest(s.similar_ids, s.scores) WITH ORDINALITY AS n(activity_id, score, position)
+JOIN activities a ON a.id = n.activity_id AND a.is_active = TRUE
+WHERE s.activity_id = :activity_id
+ORDER BY n.position
+LIMIT :limit
+"""
+
+
+def _normalized_columns(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Activités x visiteurs, lignes de norme 1 (le produit donne le cosinus)"""
+    items = matrix.T.tocsr()
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ items
+
+
+def _haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+def top_k_per_row(rows: np.ndarray, columns: np.ndarray, scores: np.ndarray, k: int):
+    """Les k meilleurs (colonne, score) de chaque ligne, triés par score décroissant"""
+    order = np.lexsort((-scores, rows))
+    rows, columns, scores = rows[order], columns[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    rank = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = rank < k
+    return rows[keep], columns[keep], scores[keep]
+
+
+class SimilarPlaces:
+    """Calcul des voisins et lecture de la liste d'une activité"""
+
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self.stats = {"activities": 0, "pairs": 0, "stored": 0}
+
+    def compute(self, activities: Dict[str, np.ndarray], interactions: List[Dict[str, Any]]):
+        """Génère (activity_id, voisins, scores) par tranche de lignes
+
+        `activities`: tableaux id, activity_type_id, price_level, latitude,
+        longitude, cell; `interactions`: visitor, activity_id, interaction_type, events.
+        """
+        ids = activities["id"]
+        count = len(ids)
+        index_of = {activity_id: index for index, activity_id in enumerate(ids.tolist())}
+
+        # Matrice visiteur x activité pondérée par le type d'interaction
+        visitors: Dict[str, int] = {}
+        row_indexes, column_indexes, values = [], [], []
+        for interaction in interactions:
+            column = index_of.get(interaction["activity_id"])
+            weight = INTERACTION_WEIGHTS.get(interaction["interaction_type"], 0)
+            if column is None or not weight:
+                continue
+            row_indexes.append(visitors.setdefault(interaction["visitor"], len(visitors)))
+            column_indexes.append(column)
+            values.append(weight * interaction["events"])
+        interactions_matrix = sparse.csr_matrix(
+            (np.log1p(values), (row_indexes, column_indexes)), shape=(max(len(visitors), 1), count)
+        )
+        items = _normalized_columns(interactions_matrix)
+        items_transposed = items.T.tocsr()
+
+        # Ordre des blocs (type, cellule): les candidats par contenu d'une tranche sont contigus
+        order = np.lexsort((activities["cell"], activities["activity_type_id"]))
+        block_keys = np.char.add(activities["activity_type_id"].astype(str), activities["cell"].astype(str))[order]
+        block_starts = np.flatnonzero(np.r_[True, block_keys[1:] != block_keys[:-1]])
+        block_ends = np.r_[block_starts[1:], count]
+
+        chunk_blocks: List[int] = []
+        chunk_rows = 0
+        for block in range(len(block_starts)):
+            chunk_blocks.append(block)
+            chunk_rows += block_ends[block] - block_starts[block]
+            if chunk_rows >= CHUNK_ROWS or block == len(block_starts) - 1:
+                yield from self._compute_chunk(activities, items, items_transposed, order,
+                                               block_starts[chunk_blocks], block_ends[chunk_blocks])
+                chunk_blocks, chunk_rows = [], 0
+
+    def _compute_chunk(self, activities, items, items_transposed, order, starts, ends):
+        # Candidats par contenu: toutes les paires d'un même bloc (co-interaction 0)
+        pair_rows, pair_columns, pair_values = [], [], []
+        for start, end in zip(starts, ends):
+            members = order[start:end]
+            if len(members) > 1:
+                pair_rows.append(np.repeat(members, len(members)))
+                pair_columns.append(np.tile(members, len(members)))
+                pair_values.append(np.zeros(len(members) ** 2))
+        chunk = np.concatenate([order[start:end] for start, end in zip(starts, ends)])
+
+        # Candidats par co-interaction: lignes de la tranche dans la matrice activité x activité
+        co = (items[chunk] @ items_transposed).tocoo()
+        pair_rows.append(chunk[co.row])
+        pair_columns.append(co.col)
+        pair_values.append(co.data)
+
+        # Dédoublonnage des paires, valeur de co-interaction conservée
+        keys, inverse = np.unique(np.concatenate(pair_rows) * len(order) + np.concatenate(pair_columns),
+                                  return_inverse=True)
+        co_scores = np.zeros(len(keys))
+        np.maximum.at(co_scores, inverse, np.concatenate(pair_values))
+        rows, columns = keys // len(order), keys % len(order)
+        distinct = rows != columns
+        rows, columns, co_scores = rows[distinct], columns[distinct], co_scores[distinct]
+
+        types, prices = activities["activity_type_id"], activities["price_level"]
+        latitudes, longitudes = activities["latitude"], activities["longitude"]
+        distance = _haversine_km(latitudes[rows], longitudes[rows], latitudes[columns], longitudes[columns])
+        scores = (
+            CO_INTERACTION_WEIGHT * np.minimum(co_scores, 1.0)
+            + TYPE_WEIGHT * (types[rows] == types[columns])
+            + PRICE_WEIGHT * (1 - np.minimum(np.abs(prices[rows] - prices[columns]), MAX_PRICE_GAP) / MAX_PRICE_GAP)
+            + PROXIMITY_WEIGHT * np.exp(-distance / PROXIMITY_SCALE_KM)
+        )
+        keep = scores >= MIN_SCORE
+        self.stats["pairs"] += int(keep.sum())
+        rows, columns, scores = top_k_per_row(rows[keep], columns[keep], scores[keep], self.top_k)
+
+        ids = activities["id"]
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.array([], dtype=int)
+        for start, end in zip(starts, np.r_[starts[1:], len(rows)]):
+            self.stats["activities"] += 1
+            yield int(ids[rows[start]]), ids[columns[start:end]].tolist(), np.round(scores[start:end], 3).tolist()
+
+    # -------------------------------------------------
+    # Job et lecture
+    # -------------------------------------------------
+
+    def run(self, session_factory=None) -> Dict[str, int]:
+        """Recalcul complet; les listes des activités disparues sont supprimées"""
+        if session_factory is None:
+            from .new_models import SessionLocal as session_factory
+
+        start_time = time.time()
+        with session_factory() as db:
+            computed_at = db.execute(text("SELECT NOW()")).scalar()
+            rows = db.execute(text(ACTIVITIES_SQL), {"precision": CONTENT_CELL_PRECISION}).mappings().all()
+            activities = {
+                "id": np.array([row["id"] for row in rows], dtype=np.int64),
+                "activity_type_id": np.array([row["activity_type_id"] for row in rows], dtype=np.int64),
+                "price_level": np.array([row["price_level"] for row in rows], dtype=np.float64),
+                "latitude": np.array([row["latitude"] for row in rows], dtype=np.float64),
+                "longitude": np.array([row["longitude"] for row in rows], dtype=np.float64),
+                "cell": np.array([row["cell"] for row in rows]),
+            }
+            interactions = db.execute(text(INTERACTIONS_SQL), {"days": INTERACTION_DAYS}).mappings().all()
+
+            batch = []
+            for activity_id, similar_ids, scores in self.compute(activities, interactions):
+                batch.append({"activity_id": activity_id, "similar_ids": similar_ids, "scores": scores,
+                              "computed_at": computed_at})
+                if len(batch) >= 1000:
+                    db.execute(text(UPSERT_SQL), batch)
+                    self.stats["stored"] += len(batch)
+                    batch = []
+            if batch:
+                db.execute(text(UPSERT_SQL), batch)
+                self.stats["stored"] += len(batch)
+            db.execute(text("DELETE FROM activity_similar WHERE computed_at < :computed_at"),
+                       {"computed_at": computed_at})
+            db.commit()
+
+        logger.info("Lieux similaires: %s en %.1f s", self.stats, time.time() - start_time)
+        return dict(self.stats)
+
+    @staticmethod
+    def lookup(db, activity_id: int, limit: int = TOP_K) -> List[Dict[str, Any]]:
+        """Activités similaires à `activity_id`, les plus proches d'abord"""
+        return [dict(row) for row in
+                db.execute(text(LOOKUP_SQL), {"activity_id": activity_id, "limit": limit}).mappings()]
+
+    @staticmethod
+    async def lookup_async(db, activity_id: int, limit: int = TOP_K) -> List[Dict[str, Any]]:
+        result = await db.execute(text(LOOKUP_SQL), {"activity_id": activity_id, "limit": limit})
+        return [dict(row) for row in result.mappings()]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    SimilarPlaces().run()
@@ -0,0 +1,133 @@
+"""
+Regroupement (singleflight) des exécutions concurrentes identiques
+
+Quand plusieurs requêtes de même clé arrivent pendant qu'une exécution est en
+cours, elles attendent son résultat au lieu de relancer la même requête SQL.
+Contrairement à un cache TTL, rien n'est conservé après la fin de l'exécution:
+seules les requêtes réellement simultanées sont regroupées.
+
+`SingleFlight` sert le chemin synchrone (threads), `AsyncSingleFlight` le
+chemin asynchrone (une seule boucle asyncio par worker).
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Partage une exécution en cours entre les appelants de même clé"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.stats = {"requests": 0, "executions": 0, "coalesced": 0, "errors": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Exécute fn une seule fois par clé en vol
+
+        Retourne (résultat, partagé), partagé valant True si le résultat
+        provient de l'exécution d'un autre appelant.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.stats["executions"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            self.stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    @property
+    def coalescing_ratio(self) -> float:
+        """Part des requêtes servies par une exécution partagée"""
+        requests = self.stats["requests"]
+        return self.stats["coalesced"] / requests if requests else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Compteurs pour le monitoring"""
+        with self._lock:
+            return {**self.stats, "in_flight": len(self._calls),
+                    "coalescing_ratio": round(self.coalescing_ratio, 4)}
+
+
+class AsyncSingleFlight:
+    """Équivalent asyncio de SingleFlight
+
+    L'exécution partagée tourne dans sa propre tâche: l'annulation de
+    l'appelant qui l'a lancée (client déconnecté) n'interrompt pas les autres.
+    `fn` ne doit donc utiliser aucune ressource de cet appelant (sa session de
+    base de données notamment): elle ouvre les siennes.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, "asyncio.Task"] = {}
+        self.stats = {"requests": 0, "executions": 0, "coalesced": 0, "errors": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Exécute fn une seule fois par clé en vol; retourne (résultat, partagé)"""
+        self.stats["requests"] += 1
+        task = self._tasks.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._tasks[key] = task
+        self.stats["executions"] += 1
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), False
+
+    def _finish(self, key: Hashable, task: "asyncio.Task") -> None:
+        self._tasks.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["errors"] += 1
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def coalescing_ratio(self) -> float:
+        """Part des requêtes servies par une exécution partagée"""
+        requests = self.stats["requests"]
+        return self.stats["coalesced"] / requests if requests else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Compteurs pour le monitoring"""
+        return {**self.stats, "in_flight": len(self._tasks),
+                "coalescing_ratio": round(self.coalescing_ratio, 4)}
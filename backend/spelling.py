@@ -0,0 +1,325 @@
+"""
+Correction orthographique des requêtes (suppressions symétriques, type SymSpell)
+
+"farmacie", "hopital", "attieke" ou "yopugon" ne correspondent à aucun motif
+d'intention ou d'entité. Chaque mot de la requête est comparé, sans accents, à
+un dictionnaire construit à partir du vocabulaire des motifs, des noms
+d'activités, des tags et des noms de zones; il est remplacé par la forme
+canonique (accentuée) du mot le plus proche à distance d'édition bornée.
+
+Seul un mot absent du lexique est corrigé. Le lexique comprend le
+dictionnaire, les mots des descriptions d'activités, les mots tapés dans au
+moins MIN_QUERY_FREQUENCY recherches récentes (une faute de frappe est rare,
+un vrai mot revient) et leurs formes fléchies (pluriel, féminin): "coiffeur",
+"plats" ou "banques" ne sont pas réécrits vers un mot voisin du dictionnaire.
+La requête corrigée sert à l'intention et aux entités; le filtre textuel SQL
+garde les mots saisis.
+
+Chaque mot du dictionnaire est indexé par ses variantes obtenues en supprimant
+jusqu'à `max_edit_distance` caractères de son préfixe. Une recherche génère
+les mêmes suppressions pour le mot saisi: les candidats sont trouvés par
+quelques accès à un dictionnaire, sans parcourir le vocabulaire.
+"""
+import logging
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from .text_normalization import fold
+
+logger = logging.getLogger(__name__)
+
+# Longueur minimale pour corriger un mot (les mots courts sont seulement réaccentués)
+MIN_CORRECTION_LENGTH = 5
+# Distance maximale selon la longueur du mot
+MAX_EDIT_DISTANCE = 2
+LONG_WORD_LENGTH = 8
+# Les suppressions ne portent que sur le préfixe: taille de l'index bornée
+PREFIX_LENGTH = 7
+# Un mot tapé dans au moins autant de recherches récentes est un mot valide
+MIN_QUERY_FREQUENCY = 20
+QUERY_LEXICON_DAYS = 90
+# Terminaisons fléchies: un mot dont le radical est connu n'est pas corrigé
+INFLECTION_SUFFIXES = ("es", "s", "x", "e")
+MIN_STEM_LENGTH = 3
+
+# Mots courants absents des motifs mais qui ne doivent pas être corrigés
+COMMON_WORDS = (
+    "trouve", "trouver", "cherche", "chercher", "endroit", "manger", "boire", "acheter",
+    "près", "proche", "pour", "avec", "dans", "sans", "quel", "quelle", "quels", "quelles",
+    "veux", "voudrais", "besoin", "aller", "faire", "bien", "très", "plus", "moins",
+    "avez", "vous", "nous", "comment", "combien", "quand", "pourquoi", "avoir", "être",
+    "sont", "elle", "leur", "votre", "notre", "cette", "entre", "aussi", "encore",
+    "autour", "côté", "ville", "heure", "heures", "midi", "nuit", "demain", "prix",
+    "livraison", "ouverte", "ouverts", "ouvertes", "fermée", "fermés", "numéro", "bonne",
+    "meilleure", "meilleurs", "quelque", "chose", "avant", "après", "depuis", "jusqu",
+)
+
+# Mots d'une expression régulière ou d'un libellé (lettres uniquement)
+_WORD = re.compile(r"[^\W\d_]+")
+
+VOCABULARY_SQL = {
+    "activities": "SELECT id, name, tags, keywords, description, short_description FROM activities WHERE is_active = true",
+    "zones": "SELECT id, name FROM zones",
+    "cities": "SELECT id, name FROM cities",
+}
+
+# Mots fréquents des recherches récentes (lexique seulement, jamais cible de correction)
+QUERY_WORDS_SQL = """
+SELECT word FROM (
+    SELECT DISTINCT sl.id, word
+    FROM search_logs sl
+    CROSS JOIN LATERAL regexp_split_to_table(lower(sl.query), '[^[:alpha:]]+') AS word
+    WHERE sl.created_at >= NOW() - make_interval(days => :days) AND length(word) >= 2
+) words
+GROUP BY word
+HAVING COUNT(*) >= :min_count
+"""
+
+
+def pattern_words(patterns: Dict[str, List[str]]) -> List[str]:
+    """Mots littéraux des motifs regex d'intention ou d'entité"""
+    words = []
+    for pattern_list in patterns.values():
+        for pattern in pattern_list:
+            words.extend(_WORD.findall(pattern))
+    return words
+
+
+def edit_distance(source: str, target: str, limit: int) -> int:
+    """Distance de Damerau-Levenshtein (transpositions adjacentes), limit + 1 au-delà de limit"""
+    if abs(len(source) - len(target)) > limit:
+        return limit + 1
+
+    previous_previous: List[int] = []
+    previous = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        current = [i] + [0] * len(target)
+        row_min = i
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and source[i - 1] == target[j - 2] and source[i - 2] == target[j - 1]:
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+
+class SpellingCorrector:
+    """Dictionnaire à suppressions symétriques sur des mots repliés"""
+
+    def __init__(self, max_edit_distance: int = MAX_EDIT_DISTANCE, prefix_length: int = PREFIX_LENGTH):
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        # mot replié -> fréquence, forme canonique et priorité de cette forme
+        self._counts: Dict[str, int] = {}
+        self._canonical: Dict[str, Tuple[int, str]] = {}
+        self._deletes: Dict[str, Set[str]] = {}
+        # Mots valides qui ne sont pas des cibles de correction (descriptions, recherches fréquentes)
+        self._lexicon: Set[str] = set()
+        # Corrections déjà calculées, vidées à chaque nouveau mot
+        self._lookups: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"tokens": 0, "corrected": 0, "reaccented": 0, "unknown": 0, "in_lexicon": 0}
+
+    def __contains__(self, word: str) -> bool:
+        return fold(word) in self._counts
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    # -------------------------------------------------
+    # Construction
+    # -------------------------------------------------
+
+    def _variants(self, word: str, distance: int) -> Set[str]:
+        """Suppressions de 0 à `distance` caractères du préfixe"""
+        variants = {word[:self.prefix_length]}
+        frontier = set(variants)
+        for _ in range(distance):
+            following = set()
+            for variant in frontier:
+                if len(variant) <= 1:
+                    continue
+                for index in range(len(variant)):
+                    following.add(variant[:index] + variant[index + 1:])
+            following -= variants
+            variants |= following
+            frontier = following
+        return variants
+
+    def add_word(self, word: str, count: int = 1, priority: int = 0) -> None:
+        """Ajoute un mot (ou augmente sa fréquence); la forme de plus haute priorité est conservée"""
+        folded = fold(word)
+        if len(folded) < 2 or " " in folded:
+            return
+        canonical = word.strip().lower()
+
+        with self._lock:
+            if folded not in self._counts:
+                # Publication de l'index avant le mot: un lecteur concurrent ne voit pas de trou
+                for variant in self._variants(folded, self.max_edit_distance):
+                    self._deletes.setdefault(variant, set()).add(folded)
+                self._counts[folded] = 0
+                self._lookups = {}
+            self._counts[folded] += count
+            current = self._canonical.get(folded)
+            if current is None or priority > current[0]:
+                self._canonical[folded] = (priority, canonical)
+
+    def add_text(self, value: Optional[str], count: int = 1, priority: int = 0) -> None:
+        """Ajoute chaque mot d'un libellé"""
+        for word in _WORD.findall(value or ""):
+            self.add_word(word, count, priority)
+
+    def add_words(self, words: Iterable[str], count: int = 1, priority: int = 0) -> None:
+        for word in words:
+            self.add_word(word, count, priority)
+
+    def add_lexicon_text(self, value: Optional[str]) -> None:
+        """Ajoute les mots d'un texte au lexique (acceptés tels quels, jamais proposés)"""
+        words = {fold(word) for word in _WORD.findall(value or "")} - self._lexicon
+        if words:
+            with self._lock:
+                self._lexicon |= words
+                self._lookups = {}
+
+    def is_word(self, word: str) -> bool:
+        """Mot du lexique, ou forme fléchie d'un mot connu"""
+        folded = fold(word)
+        if folded in self._counts or folded in self._lexicon:
+            return True
+        for suffix in INFLECTION_SUFFIXES:
+            stem = folded[:-len(suffix)]
+            if folded.endswith(suffix) and len(stem) >= MIN_STEM_LENGTH \
+                    and (stem in self._counts or stem in self._lexicon):
+                return True
+        return False
+
+    # -------------------------------------------------
+    # Correction
+    # -------------------------------------------------
+
+    def _limit(self, length: int) -> int:
+        if length < MIN_CORRECTION_LENGTH:
+            return 0
+        return self.max_edit_distance if length >= LONG_WORD_LENGTH else min(1, self.max_edit_distance)
+
+    def lookup(self, word: str) -> Optional[str]:
+        """Forme canonique du mot connu le plus proche, ou None"""
+        folded = fold(word)
+        if folded in self._counts:
+            return self._canonical[folded][1]
+
+        cached = self._lookups.get(folded, False)
+        if cached is not False:
+            return cached
+
+        # Mot valide absent du dictionnaire: conservé tel quel
+        if self.is_word(folded):
+            return None
+
+        limit = self._limit(len(folded))
+        if not limit:
+            return None
+
+        best: Optional[Tuple[int, int, str]] = None
+        seen = set()
+        for variant in self._variants(folded, limit):
+            for candidate in self._deletes.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(folded, candidate, limit)
+                if distance > limit:
+                    continue
+                # Distance la plus faible, puis mot le plus fréquent
+                key = (distance, -self._counts.get(candidate, 0), candidate)
+                if best is None or key < best:
+                    best = key
+
+        result = self._canonical[best[2]][1] if best else None
+        if len(self._lookups) < 50000:
+            self._lookups[folded] = result
+        return result
+
+    def correct(self, query: str) -> Tuple[str, Dict[str, str]]:
+        """Requête corrigée et corrections appliquées (mot saisi -> mot retenu)"""
+        corrections: Dict[str, str] = {}
+
+        def replace(match: "re.Match") -> str:
+            word = match.group(0)
+            self.stats["tokens"] += 1
+            replacement = self.lookup(word)
+            if replacement is None:
+                self.stats["in_lexicon" if self.is_word(word) else "unknown"] += 1
+                return word
+            if replacement == word.lower():
+                return word
+            if fold(replacement) == fold(word):
+                self.stats["reaccented"] += 1
+            else:
+                self.stats["corrected"] += 1
+                corrections[word] = replacement
+            return replacement
+
+        return _WORD.sub(replace, query), corrections
+
+    # -------------------------------------------------
+    # Vocabulaire de la base
+    # -------------------------------------------------
+
+    def load(self, db) -> None:
+        """Ajoute les noms d'activités, tags, mots-clés, zones et villes; lexique des
+        descriptions et des mots fréquents des recherches"""
+        for row in db.execute(text(VOCABULARY_SQL["activities"])).mappings():
+            self.add_activity(row)
+        for table in ("zones", "cities"):
+            for row in db.execute(text(VOCABULARY_SQL[table])).mappings():
+                self.add_text(row['name'])
+        words = db.execute(text(QUERY_WORDS_SQL), {
+            "days": QUERY_LEXICON_DAYS, "min_count": MIN_QUERY_FREQUENCY
+        }).scalars().all()
+        self.add_lexicon_text(" ".join(words))
+
+    def add_activity(self, row) -> None:
+        self.add_text(row['name'])
+        for value in list(row.get('tags') or ()) + list(row.get('keywords') or ()):
+            self.add_text(value)
+        self.add_lexicon_text(row.get('description'))
+        self.add_lexicon_text(row.get('short_description'))
+
+    def register_change_feed(self, feed=None, session_factory=None) -> None:
+        """Ajoute le vocabulaire des activités et zones créées ou renommées
+
+        Les mots des lignes supprimées restent connus: ils corrigent toujours
+        vers une orthographe valide.
+        """
+        if feed is None:
+            from .change_feed import change_feed as feed
+        if session_factory is None:
+            from .new_models import SessionLocal as session_factory
+
+        def on_change(event) -> None:
+            if event.id is None or not event.touches("name", "tags", "keywords", "description", "short_description"):
+                return
+            with session_factory() as db:
+                row = db.execute(
+                    text(VOCABULARY_SQL[event.table] + (" AND" if event.table == "activities" else " WHERE")
+                         + " id = :id"),
+                    {"id": event.id}
+                ).mappings().first()
+            if row is None:
+                return
+            if event.table == "activities":
+                self.add_activity(row)
+            else:
+                self.add_text(row['name'])
+
+        feed.register(("activities", "zones"), on_change)
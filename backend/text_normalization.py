@@ -0,0 +1,30 @@
+"""
+Normalisation du texte: minuscules, suppression des accents et de la ponctuation
+
+"Hôpital Sainte-Anne" et "hopital sainte anne" donnent la même forme, ce qui
+permet de comparer les saisies des utilisateurs aux noms de la base sans
+tenir compte des accents.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+@lru_cache(maxsize=65536)
+def fold(value: str) -> str:
+    """Forme repliée: minuscules, sans accents, séparateurs réduits à un espace"""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", value.lower())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    stripped = stripped.replace("œ", "oe").replace("æ", "ae")
+    return _NON_ALNUM.sub(" ", stripped).strip()
+
+
+def tokens(value: str) -> List[str]:
+    """Mots de la forme repliée"""
+    folded = fold(value)
+    return folded.split() if folded else []
@@ -0,0 +1,311 @@
+"""
+Meilleurs choix précalculés par zone pour les demandes de recommandation génériques
+
+"Recommandes-moi un endroit" ou "Quel est le meilleur restaurant ?" n'ont
+aucun filtre sélectif: ce sont les recherches les plus coûteuses et leur
+réponse change peu. La table `zone_top_picks` conserve, pour chaque
+(zone, type d'activité, ouvert/tous), les TOP_N activités classées avec le
+score de `rank_results`. Elle est recalculée périodiquement par un seul
+worker (verrou consultatif) puis rechargée en mémoire par tous.
+
+Une requête est servie depuis ces choix seulement si elle est nue: intention
+générique, aucune entité spécifique (plat, prix, lieu nommé...) et aucun mot
+restant une fois retirés les mots de type d'activité, de lieu, les entités
+reconnues et les mots vides. "Meilleur restaurant à cocody" est servi,
+"restaurant libanais" ne l'est pas. Un rayon explicite plus petit que la zone
+est respecté (recherche SQL).
+
+activity_type_id = 0 désigne tous les types confondus.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from .geo_cells import location_cell
+from .popularity import POPULARITY_COLUMNS_SQL, POPULARITY_JOINS_SQL
+from .text_normalization import fold
+
+logger = logging.getLogger(__name__)
+
+TOP_N = 10
+REFRESH_INTERVAL_SECONDS = 15 * 60
+# Au-delà, les choix sont trop anciens pour être servis (rafraîchissement en échec)
+MAX_AGE_SECONDS = 3 * REFRESH_INTERVAL_SECONDS
+ALL_TYPES = 0
+OPEN = "open"
+ANY = "any"
+# Verrou consultatif du rafraîchissement (un seul worker recalcule)
+REFRESH_LOCK_ID = 726001
+
+# Intentions sans filtre sélectif qui peuvent être servies depuis les choix précalculés
+TOP_PICKS_INTENTS = ('compare_activities', 'search_activity')
+# Entités compatibles avec une réponse par zone et par type
+GENERIC_ENTITIES = {'activity_type', 'location', 'time_constraint', 'quality_level', 'corrections',
+                    'relaxed_text_filter', 'zone_ids', 'city_ids'}
+# Filtres explicites de la requête qui excluent les choix précalculés
+SELECTIVE_FILTERS = ('category_id', 'price_level', 'verification_level', 'language')
+# Entités dont le texte reconnu est retiré de la requête avant le contrôle des mots restants
+TEXT_ENTITIES = ('activity_type', 'location', 'time_constraint', 'quality_level')
+# Mots vides et formulations de recommandation (forme repliée)
+GENERIC_WORDS = frozenset("""
+a au aux ce c d de des du en et est il j je l la le les m ma me mes moi mon ou qu que qui sur un une y
+cherche chercher trouve trouver trouves veux voudrais peux pouvez donne donner idee
+recommande recommandes recommandez recommander recommandation recommandations suggestion suggestions
+suggere conseille conseilles conseiller comparer choisir
+meilleur meilleure meilleurs meilleures bon bonne bons bonnes top quel quelle quels quelles
+endroit endroits lieu lieux coin ici pres proche cote autour quartier zone dans svp stp plait vous
+""".split())
+
+SOURCE_SQL = """
+SELECT a.*, ST_X(a.location) AS longitude, ST_Y(a.location) AS latitude,
+""" + POPULARITY_COLUMNS_SQL + """
+FROM activities a
+""" + POPULARITY_JOINS_SQL + """
+WHERE a.is_active = TRUE AND a.zone_id IS NOT NULL
+"""
+
+PICKS_SQL = """
+SELECT
+    tp.zone_id AS pick_zone_id,
+    tp.activity_type_id AS pick_activity_type_id,
+    tp.open_bucket,
+    tp.rank,
+    tp.score AS relevance_score,
+    tp.computed_at,
+    a.*,
+    at.name AS activity_type_name,
+    at.slug AS activity_type_slug,
+    c.name AS category_name,
+    c.slug AS category_slug,
+    z.name AS zone_name,
+    ST_X(a.location) AS longitude,
+    ST_Y(a.location) AS latitude
+FROM zone_top_picks tp
+JOIN activities a ON a.id = tp.activity_id
+LEFT JOIN activity_types at ON a.activity_type_id = at.id
+LEFT JOIN categories c ON a.category_id = c.id
+LEFT JOIN zones z ON a.zone_id = z.id
+WHERE a.is_active = TRUE
+ORDER BY tp.zone_id, tp.activity_type_id, tp.open_bucket, tp.rank
+"""
+
+# Rayon équivalent de la zone (disque de même surface), en mètres
+ZONE_CENTERS_SQL = """
+SELECT id, name, ST_Y(center_point) AS latitude, ST_X(center_point) AS longitude,
+       sqrt(ST_Area(geometry::geography) / pi()) AS radius
+FROM zones
+WHERE center_point IS NOT NULL
+"""
+
+CITY_NAMES_SQL = "SELECT name FROM cities"
+
+ACTIVITY_TYPES_SQL = "SELECT id, name FROM activity_types"
+
+PickKey = Tuple[int, int, str]
+
+
+def compute_top_picks(ranked: List[Any], top_n: int = TOP_N) -> Dict[PickKey, List[Any]]:
+    """Répartit des activités déjà classées en listes (zone, type, ouvert/tous)"""
+    picks: Dict[PickKey, List[Any]] = defaultdict(list)
+    for activity in ranked:
+        buckets = (ANY, OPEN) if activity.is_open else (ANY,)
+        for activity_type_id in {ALL_TYPES, activity.activity_type_id or ALL_TYPES}:
+            for bucket in buckets:
+                key = (activity.zone_id, activity_type_id, bucket)
+                if len(picks[key]) < top_n:
+                    picks[key].append(activity)
+    return picks
+
+
+class TopPicks:
+    """Choix précalculés en mémoire et résolution (zone, type, ouvert) d'une requête"""
+
+    def __init__(self, top_n: int = TOP_N, max_age_seconds: float = MAX_AGE_SECONDS):
+        self.top_n = top_n
+        self.max_age_seconds = max_age_seconds
+        self._picks: Dict[PickKey, List[Dict[str, Any]]] = {}
+        self._computed_at: Optional[datetime] = None
+        self._zone_centers: List[Tuple[int, float, float]] = []
+        self._zone_by_cell: Dict[str, Optional[int]] = {}
+        self._type_ids: Dict[str, int] = {}
+        self._zone_radius: Dict[int, float] = {}
+        # Mots des types d'activités, zones et villes (repliés)
+        self._known_words: Set[str] = set()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"served": 0, "refreshes": 0, "loads": 0}
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._picks)
+
+    # -------------------------------------------------
+    # Calcul et chargement
+    # -------------------------------------------------
+
+    def store(self, db, ranked: List[Any]) -> int:
+        """Remplace le contenu de zone_top_picks (une transaction)"""
+        computed_at = datetime.now(timezone.utc)
+        values = [
+            {
+                "zone_id": zone_id, "activity_type_id": activity_type_id, "open_bucket": bucket,
+                "rank": rank, "activity_id": activity.id,
+                "score": float(getattr(activity, 'relevance_score', 0) or 0), "computed_at": computed_at,
+            }
+            for (zone_id, activity_type_id, bucket), activities in compute_top_picks(ranked, self.top_n).items()
+            for rank, activity in enumerate(activities, start=1)
+        ]
+        db.execute(text("DELETE FROM zone_top_picks"))
+        if values:
+            db.execute(
+                text("""
+                INSERT INTO zone_top_picks (zone_id, activity_type_id, open_bucket, rank, activity_id, score, computed_at)
+                VALUES (:zone_id, :activity_type_id, :open_bucket, :rank, :activity_id, :score, :computed_at)
+                """),
+                values
+            )
+        db.commit()
+        self.stats["refreshes"] += 1
+        return len(values)
+
+    def load(self, db) -> None:
+        """Charge les choix, les centres de zones et les types d'activités"""
+        picks: Dict[PickKey, List[Dict[str, Any]]] = defaultdict(list)
+        rows_by_id: Dict[int, Dict[str, Any]] = {}
+        computed_at = None
+        for row in db.execute(text(PICKS_SQL)).mappings():
+            key = (row['pick_zone_id'], row['pick_activity_type_id'], row['open_bucket'])
+            # Une ligne par activité, partagée entre ses listes
+            activity_row = rows_by_id.setdefault(row['id'], {
+                name: value for name, value in row.items()
+                if name not in ('pick_zone_id', 'pick_activity_type_id', 'open_bucket', 'rank', 'computed_at')
+            })
+            picks[key].append(activity_row)
+            computed_at = row['computed_at'] if computed_at is None else min(computed_at, row['computed_at'])
+
+        zones = db.execute(text(ZONE_CENTERS_SQL)).mappings().all()
+        zone_centers = [(row['id'], row['latitude'], row['longitude']) for row in zones]
+        zone_radius = {row['id']: float(row['radius']) for row in zones if row['radius'] is not None}
+        type_ids = {fold(row['name']): row['id'] for row in db.execute(text(ACTIVITY_TYPES_SQL)).mappings()}
+        place_names = [row['name'] for row in zones] + list(db.execute(text(CITY_NAMES_SQL)).scalars())
+        known_words = {word for name in list(type_ids) + place_names for word in fold(name).split()}
+
+        self._picks, self._computed_at = dict(picks), computed_at
+        if zone_centers != self._zone_centers:
+            self._zone_centers, self._zone_by_cell = zone_centers, {}
+        self._type_ids, self._zone_radius, self._known_words = type_ids, zone_radius, known_words
+        self.stats["loads"] += 1
+
+    def refresh(self, session_factory, rank: Callable[[Any], List[Any]],
+                min_age_seconds: float = REFRESH_INTERVAL_SECONDS / 2) -> None:
+        """Recalcule la table si elle date et qu'aucun autre worker ne le fait, puis la recharge
+
+        `rank(db)` retourne toutes les activités actives classées par le moteur.
+        """
+        with session_factory() as db:
+            locked = db.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": REFRESH_LOCK_ID}).scalar()
+            age = db.execute(text("SELECT EXTRACT(EPOCH FROM now() - MAX(computed_at)) FROM zone_top_picks")).scalar()
+            if locked and (age is None or age >= min_age_seconds):
+                count = self.store(db, rank(db))
+                logger.info("Meilleurs choix par zone recalculés: %d lignes", count)
+            else:
+                db.rollback()
+            self.load(db)
+
+    def start(self, session_factory, rank: Callable[[Any], List[Any]],
+              interval: float = REFRESH_INTERVAL_SECONDS) -> None:
+        """Rafraîchit périodiquement dans un thread dédié"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.refresh(session_factory, rank, interval / 2)
+                except Exception:
+                    logger.exception("Échec du rafraîchissement des meilleurs choix par zone")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="top-picks", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # -------------------------------------------------
+    # Résolution d'une requête
+    # -------------------------------------------------
+
+    def _nearest_zone(self, latitude: Optional[float], longitude: Optional[float]) -> Optional[int]:
+        cell = location_cell(latitude, longitude)
+        if cell is None or not self._zone_centers:
+            return None
+        if cell not in self._zone_by_cell:
+            # Distance planaire en degrés: suffisante pour départager des centres de quartiers
+            self._zone_by_cell[cell] = min(
+                self._zone_centers,
+                key=lambda zone: (zone[1] - latitude) ** 2 + (zone[2] - longitude) ** 2
+            )[0]
+        return self._zone_by_cell[cell]
+
+    def remaining_words(self, query: str, entities: Dict[str, Any]) -> List[str]:
+        """Mots de la requête qui ne sont ni un type d'activité, ni un lieu, ni une
+        entité reconnue, ni un mot vide (pluriels ramenés au singulier)"""
+        corrections = {fold(word): fold(replacement) for word, replacement in (entities.get('corrections') or {}).items()}
+        recognised = {word for name in TEXT_ENTITIES if isinstance(entities.get(name), str)
+                      for word in fold(entities[name]).split()}
+        remaining = []
+        for word in fold(query).split():
+            word = corrections.get(word, word)
+            forms = {word, word[:-1]} if len(word) > 3 and word[-1] in "sx" else {word}
+            if forms & (GENERIC_WORDS | recognised | self._known_words):
+                continue
+            remaining.append(word)
+        return remaining
+
+    def lookup(self, search_request: Dict[str, Any], intent: str,
+               entities: Dict[str, Any]) -> Optional[Tuple[datetime, List[Dict[str, Any]]]]:
+        """(horodatage du calcul, lignes) si la requête est une recommandation générique nue"""
+        if not self._picks or intent not in TOP_PICKS_INTENTS:
+            return None
+        if not set(entities) <= GENERIC_ENTITIES:
+            return None
+        if any(search_request.get(name) for name in SELECTIVE_FILTERS):
+            return None
+        # "restaurant libanais": le mot "libanais" doit filtrer, la liste de la zone ne convient pas
+        if self.remaining_words(search_request.get('query') or '', entities):
+            return None
+        if self._computed_at is None or \
+                (datetime.now(timezone.utc) - self._computed_at).total_seconds() > self.max_age_seconds:
+            return None
+
+        zone_id = search_request.get('zone_id') or (entities.get('zone_ids') or [None])[0] \
+            or self._nearest_zone(search_request.get('latitude'), search_request.get('longitude'))
+        if zone_id is None:
+            return None
+        # Rayon explicite plus petit que la zone: la liste de la zone déborderait
+        radius = search_request.get('radius')
+        if radius is not None and radius < self._zone_radius.get(zone_id, float('inf')):
+            return None
+
+        activity_type_id = search_request.get('activity_type_id')
+        if activity_type_id is None and entities.get('activity_type'):
+            activity_type_id = self._type_ids.get(fold(entities['activity_type']))
+            if activity_type_id is None:
+                return None
+
+        # Même règle que le filtre SQL sur les contraintes de temps
+        time_constraint = entities.get('time_constraint', '')
+        wants_open = search_request.get('is_open_now') or \
+            any(word in time_constraint for word in ['ce soir', 'maintenant', 'aujourd\'hui'])
+
+        rows = self._picks.get((zone_id, activity_type_id or ALL_TYPES, OPEN if wants_open else ANY))
+        if not rows:
+            return None
+        self.stats["served"] += 1
+        return self._computed_at, rows[:search_request.get('limit', 20)]
@@ -0,0 +1,452 @@
+"""
+Suggestions de saisie (typeahead) servies depuis un index de préfixes en mémoire
+
+L'index couvre les noms d'activités, les types d'activités, les catégories,
+les tags, les mots-clés et les zones. Chaque libellé est replié (minuscules,
+sans accents) et indexé à partir de chaque début de mot: "Pharmacie du
+Plateau" répond à "pharm", "du pla" et "plateau".
+
+Chaque nœud du trie conserve les TOP_K entrées les plus populaires de son
+sous-arbre: une recherche parcourt au plus MAX_TERM_LENGTH nœuds puis reclasse
+ces candidats selon la proximité de l'utilisateur, sans jamais interroger la
+base de données.
+
+L'index est construit au démarrage (`build`) puis tenu à jour ligne par ligne
+par le flux de changements (`register_change_feed`).
+"""
+import bisect
+import logging
+import math
+import threading
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+from .geo_cells import center, location_cell
+from .text_normalization import fold, tokens
+
+logger = logging.getLogger(__name__)
+
+# Types d'entrées
+ACTIVITY = "activity"
+ACTIVITY_TYPE = "activity_type"
+CATEGORY = "category"
+TAG = "tag"
+KEYWORD = "keyword"
+ZONE = "zone"
+
+# Candidats conservés par nœud avant le reclassement par proximité
+TOP_K = 32
+# Longueur maximale indexée d'un terme (au-delà, le préfixe suffit à discriminer)
+MAX_TERM_LENGTH = 32
+
+# Bonus ajouté au poids d'une entrée située à proximité (décroît avec la distance)
+PROXIMITY_BOOST = 3.0
+PROXIMITY_SCALE_KM = 2.0
+
+# Bonus des types et catégories, plus utiles qu'un tag isolé pour lancer une recherche
+CLASSIFICATION_BONUS = 1.0
+
+# Colonnes dont la modification change une suggestion d'activité
+ACTIVITY_COLUMNS = ("name", "tags", "keywords", "is_active", "activity_type_id", "category_id",
+                    "zone_id", "location", "rating", "review_count", "is_verified")
+
+ACTIVITIES_SQL = """
+SELECT a.id, a.name, a.tags, a.keywords, a.activity_type_id, a.category_id, a.zone_id,
+       a.view_count, a.search_count, a.review_count, a.rating, a.is_verified,
+       ST_Y(a.location) AS latitude, ST_X(a.location) AS longitude
+FROM activities a
+WHERE a.is_active = true
+"""
+ACTIVITY_TYPES_SQL = "SELECT id, name FROM activity_types WHERE is_public = true"
+CATEGORIES_SQL = "SELECT id, name FROM categories WHERE is_active = true"
+ZONES_SQL = """
+SELECT id, name, ST_Y(center_point) AS latitude, ST_X(center_point) AS longitude
+FROM zones
+"""
+
+EntryKey = Tuple[str, Hashable]
+
+
+def activity_popularity(row: Dict[str, Any]) -> float:
+    """Poids d'une activité: vues, recherches et avis, en échelle logarithmique"""
+    interactions = (row.get('view_count') or 0) + 3 * (row.get('search_count') or 0) \
+        + 5 * (row.get('review_count') or 0)
+    weight = math.log1p(interactions) + float(row.get('rating') or 0) / 5
+    if row.get('is_verified'):
+        weight += 0.5
+    return round(weight, 4)
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance orthodromique en kilomètres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 6371.0 * 2 * math.asin(min(1.0, math.sqrt(a)))
+
+
+def index_terms(label: str) -> List[str]:
+    """Termes indexés: le libellé replié à partir de chaque début de mot"""
+    words = tokens(label)
+    terms = []
+    for start in range(len(words)):
+        term = " ".join(words[start:])[:MAX_TERM_LENGTH].rstrip()
+        if term and term not in terms:
+            terms.append(term)
+    return terms
+
+
+class _Entry:
+    __slots__ = ("key", "label", "weight", "latitude", "longitude", "terms", "rank")
+
+    def __init__(self, key: EntryKey, label: str, weight: float,
+                 latitude: Optional[float] = None, longitude: Optional[float] = None):
+        self.key = key
+        self.label = label
+        self.weight = weight
+        self.latitude = latitude
+        self.longitude = longitude
+        self.terms = index_terms(label)
+        # Clé de tri des listes de candidats: poids décroissant puis libellé
+        self.rank = (-weight, fold(label), str(key))
+
+
+class _Node:
+    __slots__ = ("children", "terminal", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.terminal: Dict[EntryKey, _Entry] = {}
+        # Meilleures entrées du sous-arbre: liste de (rank, entrée) triée
+        self.top: List[Tuple[Tuple, _Entry]] = []
+
+
+class TypeaheadIndex:
+    """Trie replié en minuscules et sans accents, avec candidats par nœud"""
+
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self._root = _Node()
+        self._entries: Dict[EntryKey, _Entry] = {}
+        # Entrées dérivées des activités (tags, mots-clés, types, catégories, zones)
+        self._activity_refs: Dict[int, Tuple[EntryKey, ...]] = {}
+        self._ref_counts: Dict[EntryKey, int] = {}
+        self._labels: Dict[EntryKey, str] = {}
+        self._locations: Dict[EntryKey, Tuple[float, float]] = {}
+        # Pendant un chargement complet, les poids dérivés sont calculés une seule fois à la fin
+        self._deferred: Optional[set] = None
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # -------------------------------------------------
+    # Trie
+    # -------------------------------------------------
+
+    def _insert(self, entry: _Entry) -> None:
+        item = (entry.rank, entry)
+        for term in entry.terms:
+            node = self._root
+            self._offer(node, item)
+            for char in term:
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = _Node()
+                node = child
+                self._offer(node, item)
+            node.terminal[entry.key] = entry
+        self._entries[entry.key] = entry
+
+    def _offer(self, node: _Node, item: Tuple[Tuple, _Entry]) -> None:
+        top = node.top
+        if len(top) >= self.top_k and item[0] >= top[-1][0]:
+            return
+        if any(existing is item[1] for _, existing in top):
+            return
+        # Nouvelle liste plutôt que mutation: les lectures se font sans verrou
+        # (les rangs sont uniques: la comparaison ne descend jamais jusqu'à l'entrée)
+        updated = list(top)
+        bisect.insort(updated, item)
+        node.top = updated[:self.top_k]
+
+    def _delete(self, entry: _Entry) -> None:
+        for term in entry.terms:
+            path = [self._root]
+            for char in term:
+                node = path[-1].children.get(char)
+                if node is None:
+                    break
+                path.append(node)
+            else:
+                path[-1].terminal.pop(entry.key, None)
+
+            # Recalcul ascendant des nœuds dont l'entrée faisait partie des candidats
+            for depth in range(len(path) - 1, -1, -1):
+                node = path[depth]
+                if any(existing is entry for _, existing in node.top):
+                    node.top = self._collect(node)
+                if depth and not node.terminal and not node.children and not node.top:
+                    del path[depth - 1].children[term[depth - 1]]
+        self._entries.pop(entry.key, None)
+
+    def _collect(self, node: _Node) -> List[Tuple[Tuple, _Entry]]:
+        candidates = {entry.key: (entry.rank, entry) for entry in node.terminal.values()}
+        for child in node.children.values():
+            for item in child.top:
+                candidates.setdefault(item[1].key, item)
+        return sorted(candidates.values(), key=lambda item: item[0])[:self.top_k]
+
+    # -------------------------------------------------
+    # Mise à jour
+    # -------------------------------------------------
+
+    def upsert(self, kind: str, entry_id: Hashable, label: str, weight: float,
+               latitude: Optional[float] = None, longitude: Optional[float] = None) -> None:
+        """Ajoute ou remplace une entrée"""
+        key = (kind, entry_id)
+        entry = _Entry(key, label, weight, latitude, longitude)
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                if (previous.label, previous.weight, previous.latitude, previous.longitude) == \
+                        (label, weight, latitude, longitude):
+                    return
+                self._delete(previous)
+            if entry.terms:
+                self._insert(entry)
+
+    def remove(self, kind: str, entry_id: Hashable) -> None:
+        """Retire une entrée si elle est indexée"""
+        with self._lock:
+            entry = self._entries.get((kind, entry_id))
+            if entry is not None:
+                self._delete(entry)
+
+    def _derived_weight(self, key: EntryKey) -> float:
+        weight = math.log1p(self._ref_counts.get(key, 0))
+        if key[0] in (ACTIVITY_TYPE, CATEGORY):
+            weight += CLASSIFICATION_BONUS
+        return round(weight, 4)
+
+    def _refresh_derived(self, key: EntryKey) -> None:
+        if self._deferred is not None:
+            self._deferred.add(key)
+            return
+        count = self._ref_counts.get(key, 0)
+        label = self._labels.get(key)
+        if key[0] in (TAG, KEYWORD) and count <= 0:
+            self._labels.pop(key, None)
+            self.remove(*key)
+            return
+        if label is None:
+            return
+        latitude, longitude = self._locations.get(key, (None, None))
+        self.upsert(key[0], key[1], label, self._derived_weight(key), latitude, longitude)
+
+    def set_label(self, kind: str, entry_id: Hashable, label: str,
+                  latitude: Optional[float] = None, longitude: Optional[float] = None) -> None:
+        """Ajoute ou renomme un type, une catégorie ou une zone"""
+        key = (kind, entry_id)
+        with self._lock:
+            self._labels[key] = label
+            if latitude is not None and longitude is not None:
+                self._locations[key] = (latitude, longitude)
+            else:
+                self._locations.pop(key, None)
+            self._refresh_derived(key)
+
+    def drop_label(self, kind: str, entry_id: Hashable) -> None:
+        """Retire un type, une catégorie ou une zone"""
+        key = (kind, entry_id)
+        with self._lock:
+            self._labels.pop(key, None)
+            self._locations.pop(key, None)
+            self.remove(kind, entry_id)
+
+    def upsert_activity(self, row: Dict[str, Any]) -> None:
+        """Indexe une activité et met à jour les compteurs de ses tags, type, catégorie et zone"""
+        refs = []
+        labels = {}
+        for kind, values in ((TAG, row.get('tags')), (KEYWORD, row.get('keywords'))):
+            for value in values or ():
+                key = (kind, fold(value))
+                if key[1] and key not in refs:
+                    refs.append(key)
+                    labels[key] = value.strip()
+        for kind, column in ((ACTIVITY_TYPE, 'activity_type_id'), (CATEGORY, 'category_id'),
+                             (ZONE, 'zone_id')):
+            if row.get(column) is not None:
+                refs.append((kind, row[column]))
+
+        with self._lock:
+            for key, label in labels.items():
+                self._labels.setdefault(key, label)
+            self._swap_refs(row['id'], tuple(refs))
+            self.upsert(ACTIVITY, row['id'], row['name'], activity_popularity(row),
+                        row.get('latitude'), row.get('longitude'))
+
+    def remove_activity(self, activity_id: int) -> None:
+        """Retire une activité et décrémente les compteurs associés"""
+        with self._lock:
+            self._swap_refs(activity_id, ())
+            self.remove(ACTIVITY, activity_id)
+
+    def _swap_refs(self, activity_id: int, refs: Tuple[EntryKey, ...]) -> None:
+        previous = self._activity_refs.get(activity_id, ())
+        if previous == refs:
+            return
+        for key in previous:
+            self._ref_counts[key] = self._ref_counts.get(key, 0) - 1
+        for key in refs:
+            self._ref_counts[key] = self._ref_counts.get(key, 0) + 1
+        if refs:
+            self._activity_refs[activity_id] = refs
+        else:
+            self._activity_refs.pop(activity_id, None)
+        for key in set(previous) ^ set(refs):
+            if self._ref_counts.get(key, 0) <= 0:
+                self._ref_counts.pop(key, None)
+            self._refresh_derived(key)
+
+    # -------------------------------------------------
+    # Recherche
+    # -------------------------------------------------
+
+    def suggest(self, prefix: str, limit: int = 8, latitude: Optional[float] = None,
+                longitude: Optional[float] = None, kinds: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Meilleures entrées commençant par `prefix`, rapprochées de l'utilisateur"""
+        folded = fold(prefix)[:MAX_TERM_LENGTH]
+        if not folded:
+            return []
+        # Un espace final tapé par l'utilisateur marque la fin d'un mot
+        if prefix[-1:].isspace() and len(folded) < MAX_TERM_LENGTH:
+            folded += " "
+
+        node = self._root
+        for char in folded:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        candidates = node.top
+
+        # Proximité mesurée depuis le centre de la cellule de l'utilisateur
+        cell = location_cell(latitude, longitude)
+        origin = center(cell) if cell else None
+        kinds = set(kinds) if kinds else None
+
+        scored = []
+        for _, entry in candidates:
+            if kinds and entry.key[0] not in kinds:
+                continue
+            score = entry.weight
+            distance = None
+            if origin and entry.latitude is not None and entry.longitude is not None:
+                distance = distance_km(origin[0], origin[1], entry.latitude, entry.longitude)
+                score += PROXIMITY_BOOST / (1 + distance / PROXIMITY_SCALE_KM)
+            scored.append((score, entry, distance))
+
+        scored.sort(key=lambda item: (-item[0], item[1].rank))
+        return [
+            {
+                "type": entry.key[0],
+                "id": entry.key[1],
+                "label": entry.label,
+                "score": round(score, 3),
+                "distance_km": round(distance, 2) if distance is not None else None,
+            }
+            for score, entry, distance in scored[:limit]
+        ]
+
+    # -------------------------------------------------
+    # Chargement depuis la base
+    # -------------------------------------------------
+
+    def load(self, db) -> None:
+        """Charge toutes les entrées depuis la base"""
+        with self._lock:
+            self._deferred = set()
+            for row in db.execute(text(ACTIVITY_TYPES_SQL)).mappings():
+                self.set_label(ACTIVITY_TYPE, row['id'], row['name'])
+            for row in db.execute(text(CATEGORIES_SQL)).mappings():
+                self.set_label(CATEGORY, row['id'], row['name'])
+            for row in db.execute(text(ZONES_SQL)).mappings():
+                self.set_label(ZONE, row['id'], row['name'], row['latitude'], row['longitude'])
+            for row in db.execute(text(ACTIVITIES_SQL)).mappings():
+                self.upsert_activity(dict(row))
+
+            deferred, self._deferred = self._deferred, None
+            for key in deferred:
+                self._refresh_derived(key)
+            self.ready = True
+
+    def reload_row(self, db, table: str, row_id: int) -> None:
+        """Relit une ligne modifiée et met l'index à jour"""
+        if table == "activities":
+            row = db.execute(text(ACTIVITIES_SQL + " AND a.id = :id"), {"id": row_id}).mappings().first()
+            if row is None:
+                self.remove_activity(row_id)
+            else:
+                self.upsert_activity(dict(row))
+            return
+
+        kind, sql = {
+            "activity_types": (ACTIVITY_TYPE, ACTIVITY_TYPES_SQL + " AND id = :id"),
+            "categories": (CATEGORY, CATEGORIES_SQL + " AND id = :id"),
+            "zones": (ZONE, ZONES_SQL + " WHERE id = :id"),
+        }[table]
+        row = db.execute(text(sql), {"id": row_id}).mappings().first()
+        if row is None:
+            self.drop_label(kind, row_id)
+        else:
+            self.set_label(kind, row_id, row['name'], row.get('latitude'), row.get('longitude'))
+
+
+class Typeahead:
+    """Index courant, reconstruit en entier ou mis à jour par le flux de changements"""
+
+    def __init__(self):
+        self.index = TypeaheadIndex()
+        self._rebuild_lock = threading.Lock()
+
+    def build(self, session_factory=None) -> TypeaheadIndex:
+        """Construit un nouvel index puis le substitue à l'ancien"""
+        if session_factory is None:
+            from .new_models import SessionLocal as session_factory
+        with self._rebuild_lock:
+            index = TypeaheadIndex()
+            with session_factory() as db:
+                index.load(db)
+            self.index = index
+            logger.info("Index de suggestions construit: %d entrées", len(index))
+            return index
+
+    def suggest(self, prefix: str, limit: int = 8, latitude: Optional[float] = None,
+                longitude: Optional[float] = None, kinds: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        return self.index.suggest(prefix, limit, latitude, longitude, kinds)
+
+    def register_change_feed(self, feed=None, session_factory=None) -> None:
+        """Tient l'index à jour à partir des notifications de modification"""
+        if feed is None:
+            from .change_feed import change_feed as feed
+        if session_factory is None:
+            from .new_models import SessionLocal as session_factory
+
+        def on_change(event) -> None:
+            if event.is_reset:
+                # Une reconnexion peut avoir masqué des suppressions
+                if event.table == "activities":
+                    self.build(session_factory)
+                return
+            if event.id is None or (event.table == "activities" and not event.touches(*ACTIVITY_COLUMNS)):
+                return
+            with session_factory() as db:
+                self.index.reload_row(db, event.table, event.id)
+
+        feed.register(("activities", "activity_types", "categories", "zones"), on_change)
+
+
+typeahead = Typeahead()
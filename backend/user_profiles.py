@@ -0,0 +1,351 @@
+"""
+Profils de préférences par utilisateur pour personnaliser le classement
+
+`rank_results` et `generate_advanced_response` acceptent un `user_context`
+que rien ne construisait. Un profil résume l'historique d'un utilisateur:
+types d'activités, niveaux de prix et zones préférés (poids à décroissance
+exponentielle, bornés aux plus forts) et dernières requêtes.
+
+Les profils sont mis à jour incrémentalement à partir des nouvelles lignes de
+search_logs et user_interactions, et persistés dans `user_profiles`. Les
+identifiants de search_logs sont réservés par blocs (AsyncSearchLogWriter)
+et ne suivent pas l'ordre d'insertion: son filigrane porte sur created_at,
+avec une marge de sécurité (rollup_watermarks, comme analytics_rollups.py).
+Celui de user_interactions reste sur l'id (popularity_watermarks).
+
+Chaque worker garde un cache LRU borné à durée de vie: une requête
+personnalisée coûte au plus une lecture par clé primaire.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+
+from .popularity import INTERACTION_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+HALF_LIFE_DAYS = 30
+DECAY = math.log(2) / (HALF_LIFE_DAYS * 86400)
+# Valeurs conservées par dimension (les plus fortes)
+MAX_PREFERENCES = 10
+MAX_RECENT_QUERIES = 10
+# Poids d'une recherche par rapport aux interactions (INTERACTION_WEIGHTS)
+SEARCH_WEIGHT = 1.0
+
+CACHE_SIZE = 100000
+# Au-delà, un profil en cache est relu (mises à jour faites par un autre worker)
+CACHE_TTL_SECONDS = 300
+UPDATE_INTERVAL_SECONDS = 60
+SAFETY_LAG_SECONDS = 30
+MAX_EVENTS_PER_UPDATE = 100000
+# Les recherches sont écrites en différé par lots: marge plus large, fenêtre bornée
+SEARCH_SAFETY_LAG_SECONDS = 60
+SEARCH_MAX_WINDOW_HOURS = 6
+
+SEARCH_WATERMARK = 'user_profiles.search_logs'
+INTERACTION_WATERMARK = 'user_profiles.user_interactions'
+
+PROFILE_SQL = "SELECT profile FROM user_profiles WHERE user_id = :user_id"
+
+PROFILES_SQL = "SELECT user_id, profile FROM user_profiles WHERE user_id = ANY(:user_ids)"
+
+UPSERT_SQL = """
+INSERT INTO user_profiles (user_id, profile, updated_at)
+VALUES (:user_id, CAST(:profile AS JSONB), NOW())
+ON CONFLICT (user_id) DO UPDATE SET profile = EXCLUDED.profile, updated_at = EXCLUDED.updated_at
+"""
+
+# Premier filigrane des recherches: juste avant la plus ancienne recherche
+SEARCH_WATERMARK_SQL = """
+INSERT INTO rollup_watermarks (name, processed_until)
+SELECT :name, COALESCE((SELECT MIN(created_at) FROM search_logs) - INTERVAL '1 microsecond', NOW())
+ON CONFLICT (name) DO NOTHING
+"""
+
+LOCK_SEARCH_WATERMARK_SQL = "SELECT processed_until FROM rollup_watermarks WHERE name = :name FOR UPDATE"
+
+SEARCH_UPPER_BOUND_SQL = """
+SELECT LEAST(NOW() - make_interval(secs => :lag), CAST(:from_time AS TIMESTAMPTZ) + make_interval(hours => :hours)),
+       NOW() - make_interval(secs => :lag) > CAST(:from_time AS TIMESTAMPTZ) + make_interval(hours => :hours)
+"""
+
+UPPER_BOUND_SQL = """
+SELECT COALESCE(MAX(id), :from_id) FROM {table}
+WHERE id > :from_id AND id <= :from_id + :max_events
+  AND created_at < NOW() - make_interval(secs => :lag)
+"""
+
+SEARCH_EVENTS_SQL = """
+SELECT user_id, query, entities, EXTRACT(EPOCH FROM created_at) AS at
+FROM search_logs
+WHERE created_at > :from_time AND created_at <= :to_time AND user_id IS NOT NULL
+ORDER BY created_at
+"""
+
+INTERACTION_EVENTS_SQL = """
+SELECT ui.user_id, ui.interaction_type, EXTRACT(EPOCH FROM ui.created_at) AS at,
+       a.activity_type_id, a.price_level, a.zone_id
+FROM user_interactions ui
+JOIN activities a ON a.id = ui.activity_id
+WHERE ui.id > :from_id AND ui.id <= :to_id AND ui.user_id IS NOT NULL
+ORDER BY ui.id
+"""
+
+
+@dataclass
+class UserProfile:
+    """Préférences d'un utilisateur (poids décrus jusqu'à `updated_at`, en secondes epoch)"""
+    activity_types: Dict[int, float] = field(default_factory=dict)
+    price_levels: Dict[int, float] = field(default_factory=dict)
+    zones: Dict[int, float] = field(default_factory=dict)
+    recent_queries: List[str] = field(default_factory=list)
+    updated_at: float = 0.0
+
+    @classmethod
+    def from_json(cls, payload: Optional[Dict[str, Any]]) -> "UserProfile":
+        if not payload:
+            return cls()
+        return cls(
+            activity_types={int(key): value for key, value in payload.get('activity_types', {}).items()},
+            price_levels={int(key): value for key, value in payload.get('price_levels', {}).items()},
+            zones={int(key): value for key, value in payload.get('zones', {}).items()},
+            recent_queries=list(payload.get('recent_queries', [])),
+            updated_at=payload.get('updated_at', 0.0),
+        )
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'activity_types': self.activity_types, 'price_levels': self.price_levels, 'zones': self.zones,
+            'recent_queries': self.recent_queries, 'updated_at': self.updated_at,
+        }
+
+    def _decay_to(self, at: float) -> None:
+        if at <= self.updated_at:
+            return
+        factor = math.exp(-DECAY * (at - self.updated_at))
+        for weights in (self.activity_types, self.price_levels, self.zones):
+            for key in weights:
+                weights[key] *= factor
+        self.updated_at = at
+
+    def add(self, at: float, weight: float, activity_type_id: Optional[int] = None,
+            price_level: Optional[int] = None, zone_ids: Iterable[Optional[int]] = ()) -> None:
+        """Ajoute un événement (les poids existants sont décrus jusqu'à son instant)"""
+        self._decay_to(at)
+        # Un événement plus ancien que le profil compte avec sa décroissance
+        weight *= math.exp(-DECAY * max(0.0, self.updated_at - at))
+        for weights, key in ((self.activity_types, activity_type_id), (self.price_levels, price_level)):
+            if key is not None:
+                weights[key] = weights.get(key, 0.0) + weight
+        for zone_id in zone_ids:
+            if zone_id is not None:
+                self.zones[zone_id] = self.zones.get(zone_id, 0.0) + weight
+
+    def add_query(self, query: str) -> None:
+        query = (query or '').strip()
+        if query:
+            self.recent_queries = ([query] + [previous for previous in self.recent_queries if previous != query]
+                                   )[:MAX_RECENT_QUERIES]
+
+    def trim(self) -> None:
+        """Ne garde que les MAX_PREFERENCES valeurs les plus fortes par dimension"""
+        for name in ('activity_types', 'price_levels', 'zones'):
+            weights = getattr(self, name)
+            if len(weights) > MAX_PREFERENCES:
+                setattr(self, name, dict(sorted(weights.items(), key=lambda item: -item[1])[:MAX_PREFERENCES]))
+
+    def as_context(self) -> Dict[str, Any]:
+        """user_context du moteur: parts de chaque valeur préférée (somme 1 par dimension)"""
+        def shares(weights: Dict[int, float]) -> Dict[int, float]:
+            total = sum(weights.values())
+            return {key: value / total for key, value in weights.items()} if total > 0 else {}
+
+        return {
+            'previous_searches': self.recent_queries,
+            'preferred_activity_types': shares(self.activity_types),
+            'preferred_price_levels': shares(self.price_levels),
+            'usual_zones': shares(self.zones),
+        }
+
+
+class UserProfileStore:
+    """Cache LRU des profils, adossé à la table user_profiles, et mise à jour incrémentale"""
+
+    def __init__(self, max_size: int = CACHE_SIZE, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"hits": 0, "misses": 0, "updates": 0, "events": 0}
+
+    # -------------------------------------------------
+    # Lecture
+    # -------------------------------------------------
+
+    def _cached(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                return None
+            self._cache.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def _store(self, user_id: int, profile: UserProfile) -> Dict[str, Any]:
+        context = profile.as_context()
+        with self._lock:
+            self._cache[user_id] = (time.monotonic(), context)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return context
+
+    def context(self, db, user_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """user_context d'un utilisateur (None si anonyme); une lecture par clé primaire au plus"""
+        if user_id is None:
+            return None
+        context = self._cached(user_id)
+        if context is None:
+            self.stats["misses"] += 1
+            payload = db.execute(text(PROFILE_SQL), {"user_id": user_id}).scalar()
+            context = self._store(user_id, UserProfile.from_json(payload))
+        return context
+
+    async def context_async(self, db, user_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """Équivalent de `context` sur une session asynchrone"""
+        if user_id is None:
+            return None
+        context = self._cached(user_id)
+        if context is None:
+            self.stats["misses"] += 1
+            payload = (await db.execute(text(PROFILE_SQL), {"user_id": user_id})).scalar()
+            context = self._store(user_id, UserProfile.from_json(payload))
+        return context
+
+    # -------------------------------------------------
+    # Mise à jour incrémentale
+    # -------------------------------------------------
+
+    def _bounds(self, db, watermark: str, table: str) -> tuple:
+        db.execute(
+            text("INSERT INTO popularity_watermarks (name, last_interaction_id) VALUES (:name, 0) "
+                 "ON CONFLICT (name) DO NOTHING"),
+            {"name": watermark}
+        )
+        from_id = db.execute(
+            text("SELECT last_interaction_id FROM popularity_watermarks WHERE name = :name FOR UPDATE"),
+            {"name": watermark}
+        ).scalar()
+        to_id = db.execute(text(UPPER_BOUND_SQL.format(table=table)), {
+            "from_id": from_id, "max_events": MAX_EVENTS_PER_UPDATE, "lag": SAFETY_LAG_SECONDS
+        }).scalar()
+        return from_id, to_id
+
+    def _search_bounds(self, db) -> tuple:
+        """(début, fin, fenêtre pleine) des recherches à appliquer"""
+        db.execute(text(SEARCH_WATERMARK_SQL), {"name": SEARCH_WATERMARK})
+        from_time = db.execute(text(LOCK_SEARCH_WATERMARK_SQL), {"name": SEARCH_WATERMARK}).scalar()
+        to_time, full = db.execute(text(SEARCH_UPPER_BOUND_SQL), {
+            "lag": SEARCH_SAFETY_LAG_SECONDS, "from_time": from_time, "hours": SEARCH_MAX_WINDOW_HOURS
+        }).one()
+        return from_time, max(from_time, to_time), full
+
+    def update(self, db) -> bool:
+        """Applique les nouvelles recherches et interactions aux profils concernés;
+        True si une fenêtre était pleine (il reste des événements à appliquer)
+
+        Les filigranes sont verrouillés pendant la transaction: deux workers
+        n'appliquent jamais deux fois les mêmes événements.
+        """
+        search_from, search_to, search_full = self._search_bounds(db)
+        interaction_from, interaction_to = self._bounds(db, INTERACTION_WATERMARK, 'user_interactions')
+        if search_to <= search_from and interaction_to <= interaction_from:
+            db.rollback()
+            return False
+
+        searches = db.execute(
+            text(SEARCH_EVENTS_SQL), {"from_time": search_from, "to_time": search_to}
+        ).mappings().all()
+        interactions = db.execute(
+            text(INTERACTION_EVENTS_SQL), {"from_id": interaction_from, "to_id": interaction_to}
+        ).mappings().all()
+
+        user_ids = sorted({row['user_id'] for row in searches} | {row['user_id'] for row in interactions})
+        profiles = {user_id: UserProfile() for user_id in user_ids}
+        if user_ids:
+            for row in db.execute(text(PROFILES_SQL), {"user_ids": user_ids}).mappings():
+                profiles[row['user_id']] = UserProfile.from_json(row['profile'])
+
+        for row in searches:
+            profile = profiles[row['user_id']]
+            entities = row['entities'] or {}
+            profile.add(float(row['at']), SEARCH_WEIGHT, zone_ids=entities.get('zone_ids') or ())
+            profile.add_query(row['query'])
+        for row in interactions:
+            weight = INTERACTION_WEIGHTS.get(row['interaction_type'])
+            if weight:
+                profiles[row['user_id']].add(float(row['at']), weight, row['activity_type_id'],
+                                             row['price_level'], (row['zone_id'],))
+
+        if profiles:
+            for profile in profiles.values():
+                profile.trim()
+            db.execute(text(UPSERT_SQL), [
+                {"user_id": user_id, "profile": json.dumps(profile.to_json())}
+                for user_id, profile in profiles.items()
+            ])
+        db.execute(
+            text("UPDATE rollup_watermarks SET processed_until = :to_time, updated_at = NOW() WHERE name = :name"),
+            {"to_time": search_to, "name": SEARCH_WATERMARK}
+        )
+        db.execute(
+            text("UPDATE popularity_watermarks SET last_interaction_id = :to_id, updated_at = NOW() "
+                 "WHERE name = :name"),
+            {"to_id": interaction_to, "name": INTERACTION_WATERMARK}
+        )
+        db.commit()
+
+        # Les profils en cache de ce worker sont remplacés aussitôt
+        with self._lock:
+            cached = [user_id for user_id in profiles if user_id in self._cache]
+        for user_id in cached:
+            self._store(user_id, profiles[user_id])
+
+        self.stats["updates"] += 1
+        self.stats["events"] += len(searches) + len(interactions)
+        return search_full or interaction_to >= interaction_from + MAX_EVENTS_PER_UPDATE
+
+    def run_once(self, session_factory) -> None:
+        with session_factory() as db:
+            # Rattrapage d'un retard: fenêtres successives jusqu'au présent
+            while self.update(db):
+                pass
+
+    def start(self, session_factory, interval: float = UPDATE_INTERVAL_SECONDS) -> None:
+        """Met à jour périodiquement dans un thread dédié"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.run_once(session_factory)
+                except Exception:
+                    logger.exception("Échec de la mise à jour des profils utilisateurs")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="user-profiles", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
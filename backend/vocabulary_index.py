@@ -0,0 +1,163 @@
+"""
+Index des termes du corpus pour écarter les filtres textuels impossibles
+
+Le filtre textuel de la recherche exige que la requête entière apparaisse
+(ILIKE '%requête%') dans le nom, la description, la description courte, un tag
+ou un mot-clé d'une activité. Si l'un des mots de la requête n'apparaît dans
+aucun de ces champs, ce filtre ne peut rien trouver: le moteur le retire avant
+d'interroger la base et s'appuie sur le type et la position.
+
+ILIKE trouve aussi un mot partiel ("pharm" dans "Pharmacie"): l'index
+contient donc chaque préfixe d'au moins MIN_PREFIX_LENGTH caractères des
+termes, et un mot plus court n'est jamais déclaré impossible. Un mot n'est
+impossible que si aucun terme du corpus ne commence par lui.
+
+Les préfixes des termes fréquents sont gardés dans un ensemble; ceux des
+termes rares (une seule activité), les plus nombreux, vont dans un filtre de
+Bloom. Un faux positif du filtre conserve simplement le filtre textuel, comme
+avant.
+"""
+import hashlib
+import logging
+import math
+import threading
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Set
+
+from sqlalchemy import text
+
+from .text_normalization import tokens
+
+logger = logging.getLogger(__name__)
+
+# Champs interrogés par le filtre textuel du moteur
+SEARCH_FIELDS_SQL = """
+SELECT id, name, description, short_description, tags, keywords
+FROM activities
+WHERE is_active = true
+"""
+
+# Nombre d'activités à partir duquel un terme va dans l'ensemble plutôt que dans le filtre
+FREQUENT_TERM_MIN_COUNT = 2
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+# Marge du filtre de Bloom pour les termes ajoutés après la construction
+BLOOM_HEADROOM = 2
+# Préfixes indexés; un mot plus court est toujours supposé présent
+MIN_PREFIX_LENGTH = 3
+
+
+def prefixes(term: str) -> Iterator[str]:
+    """Préfixes indexés d'un terme (le terme lui-même compris)"""
+    for length in range(MIN_PREFIX_LENGTH, len(term) + 1):
+        yield term[:length]
+
+
+class BloomFilter:
+    """Filtre de Bloom sur un bytearray (double hachage blake2b)"""
+
+    def __init__(self, capacity: int, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE):
+        capacity = max(capacity, 1000)
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, term: str) -> Iterable[int]:
+        digest = hashlib.blake2b(term.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + index * second) % self.size for index in range(self.hash_count))
+
+    def add(self, term: str) -> None:
+        for position in self._positions(term):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, term: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(term))
+
+
+class VocabularyIndex:
+    """Dictionnaire des termes de recherche des activités"""
+
+    def __init__(self):
+        self._frequent: Set[str] = set()
+        self._rare = BloomFilter(0)
+        self._lock = threading.Lock()
+        self.ready = False
+        self.stats = {"checks": 0, "impossible": 0}
+
+    def __contains__(self, term: str) -> bool:
+        """Vrai si un terme du corpus commence par `term` (ou si `term` est trop court)"""
+        return len(term) < MIN_PREFIX_LENGTH or term in self._frequent or term in self._rare
+
+    @staticmethod
+    def activity_terms(row) -> Set[str]:
+        """Termes repliés de tous les champs de recherche d'une activité"""
+        terms = set()
+        for field in ('name', 'description', 'short_description'):
+            terms.update(tokens(row.get(field) or ''))
+        for value in list(row.get('tags') or ()) + list(row.get('keywords') or ()):
+            terms.update(tokens(value or ''))
+        return terms
+
+    def build(self, rows: Iterable) -> None:
+        """Construit l'index à partir des lignes d'activités"""
+        document_counts = Counter()
+        for row in rows:
+            document_counts.update(self.activity_terms(row))
+
+        frequent = {prefix for term, count in document_counts.items() if count >= FREQUENT_TERM_MIN_COUNT
+                    for prefix in prefixes(term)}
+        rare_terms = [term for term, count in document_counts.items() if count < FREQUENT_TERM_MIN_COUNT]
+        rare_prefixes = {prefix for term in rare_terms for prefix in prefixes(term)} - frequent
+        rare = BloomFilter(len(rare_prefixes) * BLOOM_HEADROOM)
+        for prefix in rare_prefixes:
+            rare.add(prefix)
+
+        with self._lock:
+            self._frequent, self._rare = frequent, rare
+            self.ready = True
+        logger.info("Index de vocabulaire: %d préfixes fréquents, %d préfixes rares", len(frequent), len(rare_prefixes))
+
+    def load(self, db) -> None:
+        self.build(db.execute(text(SEARCH_FIELDS_SQL)).mappings())
+
+    def add_activity(self, row) -> None:
+        """Ajoute les termes d'une activité créée ou modifiée
+
+        Les termes disparus ne sont pas retirés: au pire le filtre textuel est
+        conservé inutilement.
+        """
+        with self._lock:
+            for term in self.activity_terms(row):
+                for prefix in prefixes(term):
+                    if prefix not in self:
+                        self._rare.add(prefix)
+
+    def unknown_terms(self, query: str) -> Optional[List[str]]:
+        """Mots de la requête qui ne commencent aucun terme du corpus (None si l'index n'est pas chargé)"""
+        if not self.ready:
+            return None
+        self.stats["checks"] += 1
+        unknown = [term for term in tokens(query) if term not in self]
+        if unknown:
+            self.stats["impossible"] += 1
+        return unknown
+
+    def register_change_feed(self, feed=None, session_factory=None) -> None:
+        """Ajoute les termes des activités créées ou modifiées"""
+        if feed is None:
+            from .change_feed import change_feed as feed
+        if session_factory is None:
+            from .new_models import SessionLocal as session_factory
+
+        def on_change(event) -> None:
+            if event.id is None or not event.touches("name", "description", "short_description", "tags", "keywords"):
+                return
+            with session_factory() as db:
+                row = db.execute(text(SEARCH_FIELDS_SQL + " AND id = :id"), {"id": event.id}).mappings().first()
+            if row is not None:
+                self.add_activity(row)
+
+        feed.register("activities", on_change)
@@ -319,7 +319,7 @@ CREATE TABLE reviews (
 
 -- Table des logs de recherche
 CREATE TABLE search_logs (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER REFERENCES users(id),
     session_id VARCHAR(100),
     
@@ -348,12 +348,14 @@ CREATE TABLE search_logs (
     search_time_ms INTEGER,
     
     -- Timestamps
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
 -- Table des interactions utilisateur
 CREATE TABLE user_interactions (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER REFERENCES users(id),
     activity_id INTEGER REFERENCES activities(id),
     interaction_type VARCHAR(50) NOT NULL, -- view, click, call, direction, save, share
@@ -368,8 +370,10 @@ CREATE TABLE user_interactions (
     metadata JSONB DEFAULT '{}',
     
     -- Timestamps
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
 -- =====================================================
 -- 8. GESTION DES CONVERSATIONS ET IA
@@ -504,7 +508,7 @@ CREATE TABLE webhooks (
 
 -- Table des logs de webhook
 CREATE TABLE webhook_logs (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     webhook_id INTEGER REFERENCES webhooks(id),
     event_type VARCHAR(50) NOT NULL,
     payload JSONB NOT NULL,
@@ -516,9 +520,11 @@ CREATE TABLE webhook_logs (
     error_message TEXT,
     
     -- Timestamps
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    processed_at TIMESTAMP WITH TIME ZONE
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMP WITH TIME ZONE,
+    
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
 -- =====================================================
 -- 11. GESTION DES DONNÉES ET INSIGHTS
@@ -636,7 +642,7 @@ CREATE TABLE subscriptions (
 
 -- Table des notifications
 CREATE TABLE notifications (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER REFERENCES users(id),
     
     -- Contenu
@@ -654,13 +660,22 @@ CREATE TABLE notifications (
     is_sms_sent BOOLEAN DEFAULT FALSE,
     is_email_sent BOOLEAN DEFAULT FALSE,
     
+    -- Envoi (backend/notification_dispatcher.py): pending, sending, sent, failed, skipped
+    delivery_status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    delivery_attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    delivery_error TEXT,
+    delivered_at TIMESTAMP WITH TIME ZONE,
+    
     -- Données additionnelles
     data JSONB DEFAULT '{}',
     
     -- Timestamps
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    read_at TIMESTAMP WITH TIME ZONE
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    read_at TIMESTAMP WITH TIME ZONE,
+    
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
 -- =====================================================
 -- 14. GESTION DES AUDITS ET LOGS
@@ -668,7 +683,7 @@ CREATE TABLE notifications (
 
 -- Table des audits
 CREATE TABLE audit_logs (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER REFERENCES users(id),
     
     -- Action
@@ -686,8 +701,10 @@ CREATE TABLE audit_logs (
     session_id VARCHAR(100),
     
     -- Timestamps
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
 -- =====================================================
 -- 15. VUES ET FONCTIONS UTILES
@@ -871,6 +888,8 @@ CREATE INDEX idx_user_interactions_type ON user_interactions (interaction_type,
 -- Index pour les notifications
 CREATE INDEX idx_notifications_user_unread ON notifications (user_id, is_read, created_at DESC);
 CREATE INDEX idx_notifications_type ON notifications (notification_type, created_at DESC);
+-- File d'envoi: seules les notifications à envoyer (ou en cours d'envoi) sont indexées
+CREATE INDEX idx_notifications_delivery ON notifications (next_attempt_at) WHERE delivery_status IN ('pending', 'sending');
 
 -- =====================================================
 -- 18. TRIGGERS ET FONCTIONS AUTOMATIQUES
@@ -931,6 +950,302 @@ COMMENT ON TABLE search_logs IS 'Logs des recherches pour l''amélioration de l'
 COMMENT ON TABLE insights IS 'Insights générés par l''IA à partir des données collectées';
 COMMENT ON TABLE data_models IS 'Modèles de machine learning entraînés sur les données';
 
+-- =====================================================
+-- 20. FLUX DE CHANGEMENTS (LISTEN/NOTIFY)
+-- =====================================================
+
+-- Horodatage des modifications pour le rattrapage des événements manqués
+ALTER TABLE zones ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+ALTER TABLE activity_types ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+CREATE TRIGGER update_zones_updated_at BEFORE UPDATE ON zones FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+CREATE TRIGGER update_categories_updated_at BEFORE UPDATE ON categories FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+CREATE TRIGGER update_activity_types_updated_at BEFORE UPDATE ON activity_types FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+CREATE TRIGGER update_media_updated_at BEFORE UPDATE ON media FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_zones_updated ON zones (updated_at);
+CREATE INDEX IF NOT EXISTS idx_categories_updated ON categories (updated_at);
+CREATE INDEX IF NOT EXISTS idx_activity_types_updated ON activity_types (updated_at);
+CREATE INDEX IF NOT EXISTS idx_media_updated ON media (updated_at);
+
+-- Notification compacte: {"t": table, "id": id, "op": I/U/D, "c": [colonnes modifiées], "a": activity_id}
+CREATE OR REPLACE FUNCTION notify_table_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    row_data JSONB;
+    changed TEXT[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := to_jsonb(OLD);
+    ELSE
+        row_data := to_jsonb(NEW);
+    END IF;
+
+    IF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(n.key ORDER BY n.key) INTO changed
+        FROM jsonb_each(row_data) n
+        JOIN jsonb_each(to_jsonb(OLD)) o ON o.key = n.key
+        WHERE n.value IS DISTINCT FROM o.value
+          AND n.key NOT IN ('updated_at', 'view_count', 'search_count', 'last_activity_at');
+
+        -- Rien de visible n'a changé (compteurs uniquement)
+        IF changed IS NULL THEN
+            RETURN NEW;
+        END IF;
+    END IF;
+
+    PERFORM pg_notify('tchaller_changes', json_strip_nulls(json_build_object(
+        't', TG_TABLE_NAME,
+        'id', (row_data->>'id')::INTEGER,
+        'op', left(TG_OP, 1),
+        'c', changed,
+        'a', (row_data->>'activity_id')::INTEGER
+    ))::TEXT);
+
+    RETURN COALESCE(NEW, OLD);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_activities_change AFTER INSERT OR UPDATE OR DELETE ON activities FOR EACH ROW EXECUTE FUNCTION notify_table_change();
+CREATE TRIGGER notify_activity_types_change AFTER INSERT OR UPDATE OR DELETE ON activity_types FOR EACH ROW EXECUTE FUNCTION notify_table_change();
+CREATE TRIGGER notify_categories_change AFTER INSERT OR UPDATE OR DELETE ON categories FOR EACH ROW EXECUTE FUNCTION notify_table_change();
+CREATE TRIGGER notify_zones_change AFTER INSERT OR UPDATE OR DELETE ON zones FOR EACH ROW EXECUTE FUNCTION notify_table_change();
+CREATE TRIGGER notify_media_change AFTER INSERT OR UPDATE OR DELETE ON media FOR EACH ROW EXECUTE FUNCTION notify_table_change();
+
+-- =====================================================
+-- 21. MEILLEURS CHOIX PAR ZONE
+-- =====================================================
+
+-- Top N par (zone, type d'activité, ouvert/tous), recalculé périodiquement par le moteur
+-- activity_type_id = 0: tous les types confondus
+CREATE TABLE zone_top_picks (
+    zone_id INTEGER NOT NULL REFERENCES zones(id) ON DELETE CASCADE,
+    activity_type_id INTEGER NOT NULL DEFAULT 0,
+    open_bucket VARCHAR(10) NOT NULL, -- open, any
+    rank SMALLINT NOT NULL,
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    score DECIMAL(10,2) NOT NULL,
+    computed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (zone_id, activity_type_id, open_bucket, rank)
+);
+
+-- =====================================================
+-- 22. PROPOSITIONS DE FUSION DES DOUBLONS
+-- =====================================================
+
+-- Paires d'activités en double détectées par backend/deduplication.py, à valider
+CREATE TABLE activity_merge_proposals (
+    id SERIAL PRIMARY KEY,
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE, -- activité conservée
+    duplicate_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE, -- activité à fusionner
+    score DECIMAL(4,3) NOT NULL,
+    name_score DECIMAL(4,3) NOT NULL,
+    address_score DECIMAL(4,3),
+    phone_match BOOLEAN,
+    status VARCHAR(20) DEFAULT 'pending', -- pending, accepted, rejected
+    reviewed_by INTEGER REFERENCES users(id),
+    reviewed_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Une proposition par paire, dans un sens ou dans l'autre
+CREATE UNIQUE INDEX idx_merge_proposals_pair ON activity_merge_proposals
+    (LEAST(activity_id, duplicate_id), GREATEST(activity_id, duplicate_id));
+CREATE INDEX idx_merge_proposals_status ON activity_merge_proposals (status, score DESC);
+
+-- =====================================================
+-- 23. POPULARITÉ RÉCENTE
+-- =====================================================
+
+-- Scores à décroissance exponentielle (backend/popularity.py): valeur à updated_at,
+-- score(t) = score * exp(-decay * (t - updated_at))
+CREATE TABLE activity_popularity (
+    activity_id INTEGER PRIMARY KEY REFERENCES activities(id) ON DELETE CASCADE,
+    score DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Même score par heure de la semaine (0 = lundi 0h, 167 = dimanche 23h, heure d'Abidjan)
+CREATE TABLE activity_hourly_popularity (
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    hour_of_week SMALLINT NOT NULL,
+    score DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (activity_id, hour_of_week)
+);
+
+-- Dernier identifiant traité par chaque agrégation incrémentale (popularité, profils)
+CREATE TABLE popularity_watermarks (
+    name VARCHAR(50) PRIMARY KEY,
+    last_interaction_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- =====================================================
+-- 24. PROFILS DE PRÉFÉRENCES
+-- =====================================================
+
+-- Préférences par utilisateur (backend/user_profiles.py): types d'activités, prix et zones
+-- préférés (poids décroissants), dernières requêtes
+CREATE TABLE user_profiles (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    profile JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- =====================================================
+-- 25. LIEUX SIMILAIRES
+-- =====================================================
+
+-- Voisins précalculés par activité (backend/similar_places.py): co-interactions,
+-- type, prix et proximité; une ligne par activité, les plus proches d'abord
+CREATE TABLE activity_similar (
+    activity_id INTEGER PRIMARY KEY REFERENCES activities(id) ON DELETE CASCADE,
+    similar_ids INTEGER[] NOT NULL,
+    scores REAL[] NOT NULL,
+    computed_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- =====================================================
+-- 26. PARTITIONNEMENT DES JOURNAUX
+-- =====================================================
+
+-- search_logs, user_interactions, webhook_logs, notifications et audit_logs sont
+-- partitionnées par période de created_at. Les partitions futures sont créées et
+-- les anciennes archivées par backend/partitioning.py; la partition par défaut
+-- reçoit les lignes hors des partitions existantes (vidée à la création suivante).
+CREATE TABLE search_logs_default PARTITION OF search_logs DEFAULT;
+CREATE TABLE user_interactions_default PARTITION OF user_interactions DEFAULT;
+CREATE TABLE webhook_logs_default PARTITION OF webhook_logs DEFAULT;
+CREATE TABLE notifications_default PARTITION OF notifications DEFAULT;
+CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT;
+
+-- Partitions détachées et exportées (CSV compressé) avant suppression
+CREATE TABLE partition_archives (
+    id SERIAL PRIMARY KEY,
+    table_name VARCHAR(100) NOT NULL,
+    partition_name VARCHAR(100) NOT NULL,
+    range_end TIMESTAMP WITH TIME ZONE NOT NULL,
+    row_count BIGINT NOT NULL,
+    file_path TEXT NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- =====================================================
+-- 27. AGRÉGATS HORAIRES DES RECHERCHES
+-- =====================================================
+
+-- Compteurs additifs par heure, zone, intention et type d'activité du premier résultat
+-- (backend/analytics_rollups.py); zone et type inconnus: 0
+CREATE TABLE search_rollups_hourly (
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    zone_id INTEGER NOT NULL,
+    intent VARCHAR(50) NOT NULL,
+    activity_type_id INTEGER NOT NULL,
+    searches INTEGER NOT NULL DEFAULT 0,
+    zero_results INTEGER NOT NULL DEFAULT 0,
+    search_time_sum BIGINT NOT NULL DEFAULT 0,
+    -- Recherches par classe de temps de réponse (LATENCY_BUCKETS_MS)
+    search_time_histogram INTEGER[] NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    -- Recherches suivies d'au moins un clic, appel ou itinéraire
+    clicked_searches INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, zone_id, intent, activity_type_id)
+);
+
+CREATE TABLE search_query_rollups_hourly (
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    zone_id INTEGER NOT NULL,
+    intent VARCHAR(50) NOT NULL,
+    activity_type_id INTEGER NOT NULL,
+    query VARCHAR(200) NOT NULL,
+    searches INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, zone_id, intent, activity_type_id, query)
+);
+
+-- Position des agrégats dans le temps (created_at déjà traité)
+CREATE TABLE rollup_watermarks (
+    name VARCHAR(50) PRIMARY KEY,
+    processed_until TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- =====================================================
+-- 28. TUILES DE DEMANDE
+-- =====================================================
+
+-- Recherches par case de grille (tuile Web Mercator zoom, x, y) et intention
+-- (backend/demand_tiles.py), à tous les niveaux de la grille
+CREATE TABLE search_demand_bins (
+    zoom INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    intent VARCHAR(50) NOT NULL,
+    searches INTEGER NOT NULL DEFAULT 0,
+    zero_results INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (zoom, x, y, intent)
+);
+
+-- Tuiles déjà demandées, en JSON compact; périmées quand une de leurs cases change
+CREATE TABLE demand_tiles (
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    etag VARCHAR(40) NOT NULL,
+    stale BOOLEAN NOT NULL DEFAULT FALSE,
+    rendered_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (z, x, y)
+);
+
+CREATE INDEX idx_demand_tiles_stale ON demand_tiles (z, x, y) WHERE stale;
+
+-- =====================================================
+-- 29. ALERTES SUR RECHERCHES ENREGISTRÉES
+-- =====================================================
+
+-- Alertes des utilisateurs (backend/saved_searches.py): type et catégorie optionnels
+CREATE TABLE saved_searches (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name VARCHAR(255) NOT NULL,
+    query TEXT,
+    activity_type_id INTEGER REFERENCES activity_types(id),
+    category_id INTEGER REFERENCES categories(id),
+    location GEOMETRY(POINT, 4326) NOT NULL,
+    radius INTEGER NOT NULL,
+    require_open BOOLEAN NOT NULL DEFAULT TRUE,
+    require_verified BOOLEAN NOT NULL DEFAULT FALSE,
+    cell_precision INTEGER NOT NULL,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX idx_saved_searches_user ON saved_searches (user_id);
+
+-- Index inversé: cellules geohash recouvrant le cercle de l'alerte, type et catégorie (0 = indifférent)
+CREATE TABLE saved_search_cells (
+    cell VARCHAR(12) NOT NULL,
+    type_key INTEGER NOT NULL,
+    category_key INTEGER NOT NULL,
+    saved_search_id INTEGER NOT NULL REFERENCES saved_searches(id) ON DELETE CASCADE,
+    PRIMARY KEY (cell, type_key, category_key, saved_search_id)
+);
+
+CREATE INDEX idx_saved_search_cells_search ON saved_search_cells (saved_search_id);
+
+-- Dernier état connu de chaque couple (alerte, activité): notification au passage à TRUE
+CREATE TABLE saved_search_matches (
+    saved_search_id INTEGER NOT NULL REFERENCES saved_searches(id) ON DELETE CASCADE,
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    matching BOOLEAN NOT NULL,
+    notified_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (saved_search_id, activity_id)
+);
+
+CREATE INDEX idx_saved_search_matches_activity ON saved_search_matches (activity_id);
+
 -- =====================================================
 -- FIN DE LA STRUCTURE
 -- =====================================================
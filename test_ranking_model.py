@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Test du score de pertinence (caractéristiques x poids) et de l'apprentissage des poids
+"""
+import sys
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+sys.path.append('/workspace')
+
+import numpy as np
+
+def activity(**values):
+    """Activité de test avec les attributs lus par rank_results"""
+    defaults = {
+        "distance": None, "is_verified": False, "verification_level": 0, "is_open": False,
+        "rating": 0, "review_count": 0, "view_count": 0, "search_count": 0,
+        "created_at": datetime.now() - timedelta(days=365), "cover_image_url": None,
+        "description": None, "opening_hours": None, "phone_number": None, "whatsapp_number": None,
+    }
+    defaults.update(values)
+    return SimpleNamespace(**defaults)
+
+FIXTURES = [
+    activity(distance=120, is_verified=True, verification_level=3, is_open=True, rating=4.5,
+             review_count=240, view_count=5000, search_count=80, created_at=datetime.now() - timedelta(days=10),
+             cover_image_url="cover.jpg", description="Pharmacie de garde ouverte tous les jours, parking et livraison.",
+             opening_hours={"lun": "08:00-22:00"}, phone_number="+225 07 00 00 00 00"),
+    activity(distance=750, rating=3.2, review_count=12, view_count=300, search_count=700,
+             created_at=datetime.now() - timedelta(days=45), whatsapp_number="+225 05 00 00 00 00"),
+    activity(distance=1500, is_verified=True, verification_level=1, rating=4.0, review_count=55,
+             description="Trop court"),
+    activity(distance=4200, is_open=True, rating=2.5, view_count=12000, opening_hours={"sam": "10:00-18:00"}),
+    activity(distance=0, rating=5.0, created_at=datetime.now() - timedelta(days=2)),
+    activity(rating=1.0, review_count=3),
+]
+
+def legacy_score(activity):
+    """Boucle de score écrite à la main, remplacée par activity_features @ weight_vector(DEFAULT_WEIGHTS)"""
+    score = 0
+
+    # Score de distance (plus proche = mieux)
+    if hasattr(activity, 'distance') and activity.distance:
+        if activity.distance < 500:
+            score += 100
+        elif activity.distance < 1000:
+            score += 80
+        elif activity.distance < 2000:
+            score += 60
+        else:
+            score += 40
+
+    # Score de vérification
+    if activity.is_verified:
+        score += 50
+        score += activity.verification_level * 10
+
+    # Score de statut ouvert
+    if activity.is_open:
+        score += 30
+
+    # Score d'évaluation
+    score += float(activity.rating) * 10
+
+    # Score de popularité
+    score += min(activity.review_count, 100) * 0.5
+    score += min(activity.view_count, 1000) * 0.1
+    score += min(activity.search_count, 500) * 0.2
+
+    # Bonus pour les activités récentes
+    days_old = (datetime.now() - activity.created_at).days
+    if days_old < 30:
+        score += 10
+    elif days_old < 90:
+        score += 5
+
+    # Bonus pour les activités avec photos
+    if activity.cover_image_url:
+        score += 5
+
+    # Bonus pour les activités avec informations complètes
+    if activity.description and len(activity.description) > 50:
+        score += 5
+    if activity.opening_hours:
+        score += 5
+    if activity.phone_number or activity.whatsapp_number:
+        score += 5
+
+    return score
+
+def test_default_weights_match_legacy_scores():
+    """Les poids par défaut reproduisent les scores écrits à la main"""
+    print("🧮 TEST DES POIDS PAR DÉFAUT")
+    print("=" * 60)
+
+    from backend.ranking_model import DEFAULT_WEIGHTS, activity_features, weight_vector
+
+    scores = activity_features(FIXTURES) @ weight_vector(DEFAULT_WEIGHTS)
+    expected = np.array([legacy_score(item) for item in FIXTURES])
+    for score, legacy in zip(scores, expected):
+        print(f"   score {score:8.2f} / boucle {legacy:8.2f}")
+    assert np.allclose(scores, expected), (scores, expected)
+    print("✅ Scores identiques à la boucle d'origine")
+
+    return True
+
+def test_ndcg():
+    """NDCG@k: 1 pour l'ordre idéal, recherches sans interaction ignorées"""
+    print("📏 TEST DU NDCG")
+    print("=" * 60)
+
+    from backend.ranking_training import ndcg
+
+    labels = np.array([0, 3, 1, 0, 0, 0], dtype=np.float64)
+    groups = [(0, 3), (3, 6)]
+    ideal = np.array([1.0, 3.0, 2.0, 0.0, 0.0, 0.0])
+    reversed_order = np.array([3.0, 1.0, 2.0, 0.0, 0.0, 0.0])
+
+    assert ndcg(ideal, labels, groups) == 1.0
+    worse = ndcg(reversed_order, labels, groups)
+    assert 0 < worse < 1, worse
+    assert ndcg(ideal, np.zeros(6), groups) == 0.0
+    print(f"✅ Ordre idéal: 1.0, ordre inversé: {worse:.3f}, sans interaction: 0.0")
+
+    return True
+
+def test_fit_weights():
+    """Les poids appris retrouvent le signal des clics; une caractéristique constante garde son poids"""
+    print("🎯 TEST DE L'APPRENTISSAGE DES POIDS")
+    print("=" * 60)
+
+    from backend.ranking_model import DEFAULT_WEIGHTS, FEATURES, feature_matrix, weight_vector
+    from backend.ranking_training import fit_weights, ndcg
+
+    rng = np.random.default_rng(7)
+    searches, per_search = 200, 8
+    count = searches * per_search
+    columns = {
+        "distance": rng.uniform(100, 5000, count).tolist(),
+        "is_verified": rng.integers(0, 2, count).tolist(),
+        "verification_level": rng.integers(0, 4, count).tolist(),
+        "is_open": rng.integers(0, 2, count).tolist(),
+        "rating": rng.uniform(1, 5, count).tolist(),
+        "review_count": rng.integers(0, 200, count).tolist(),
+        "view_count": rng.integers(0, 2000, count).tolist(),
+        "search_count": rng.integers(0, 600, count).tolist(),
+        "age_days": rng.integers(0, 400, count).tolist(),
+        "has_cover_image": rng.integers(0, 2, count).tolist(),
+        "description_length": rng.integers(0, 200, count).tolist(),
+        "has_opening_hours": rng.integers(0, 2, count).tolist(),
+        "has_phone": rng.integers(0, 2, count).tolist(),
+        "popularity": rng.uniform(0, 50, count).tolist(),
+        "popularity_this_hour": rng.uniform(0, 5, count).tolist(),
+        # Non journalisée: constante dans les impressions
+        "user_affinity": [0.0] * count,
+    }
+    features = feature_matrix(columns)
+    groups = [(start, start + per_search) for start in range(0, count, per_search)]
+
+    # Les utilisateurs cliquent sur les activités ouvertes et bien notées
+    is_open, rating = FEATURES.index("is_open"), FEATURES.index("rating")
+    utility = 2.0 * features[:, is_open] + features[:, rating] + rng.normal(0, 0.5, count)
+    labels = np.zeros(count)
+    for start, end in groups:
+        labels[start + int(np.argmax(utility[start:end]))] = 1
+
+    fallback = weight_vector({**DEFAULT_WEIGHTS, "user_affinity": 25})
+    learned = fit_weights(features, labels, groups, fallback=fallback)
+    assert learned is not None
+    assert learned[is_open] > 0 and learned[rating] > 0, learned
+    assert learned[FEATURES.index("user_affinity")] == 25
+    print(f"✅ Poids appris: is_open {learned[is_open]:.1f}, rating {learned[rating]:.1f}, user_affinity 25 conservé")
+
+    shuffled = rng.permutation(count).astype(np.float64)
+    assert ndcg(features @ learned, labels, groups) > ndcg(shuffled, labels, groups)
+    print("✅ Le classement appris fait mieux qu'un ordre aléatoire")
+
+    assert fit_weights(features[:2], labels[:2], [(0, 2)]) is None
+    print("✅ Trop peu de paires: aucun poids appris")
+
+    return True
+
+def main():
+    """Fonction principale de test"""
+    print("🚀 TEST DU MODÈLE DE CLASSEMENT")
+    print("=" * 80)
+
+    tests = [
+        ("Poids par défaut", test_default_weights_match_legacy_scores),
+        ("NDCG", test_ndcg),
+        ("Apprentissage des poids", test_fit_weights)
+    ]
+
+    results = []
+
+    for test_name, test_func in tests:
+        print(f"\n{'='*20} {test_name.upper()} {'='*20}")
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur critique dans {test_name}: {e}")
+            import traceback
+            traceback.print_exc()
+            results.append((test_name, False))
+
+    # Résumé des résultats
+    print("\n\n📊 RÉSUMÉ DES TESTS")
+    print("=" * 80)
+
+    passed = 0
+    total = len(results)
+
+    for test_name, result in results:
+        status = "✅ RÉUSSI" if result else "❌ ÉCHOUÉ"
+        print(f"{test_name}: {status}")
+        if result:
+            passed += 1
+
+    print(f"\n🎯 RÉSULTAT GLOBAL: {passed}/{total} tests réussis")
+
+if __name__ == "__main__":
+    main()
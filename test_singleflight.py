@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Test du regroupement des recherches concurrentes identiques (singleflight)
+"""
+import sys
+import os
+import threading
+import time
+sys.path.append('/workspace')
+
+def test_concurrent_calls_share_execution():
+    """Les appels simultanés de même clé partagent une seule exécution"""
+    print("🔀 TEST DU REGROUPEMENT DES EXÉCUTIONS")
+    print("=" * 60)
+
+    try:
+        from backend.singleflight import SingleFlight
+
+        flight = SingleFlight()
+        executions = []
+        results = []
+
+        def slow_query():
+            executions.append(1)
+            time.sleep(0.2)
+            return ["Pharmacie du Plateau", "Pharmacie Sainte-Anne"]
+
+        def caller():
+            results.append(flight.do(("pharmacie de garde", (), "ebvnkvz"), slow_query))
+
+        threads = [threading.Thread(target=caller) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(executions) == 1, f"{len(executions)} exécutions au lieu d'une"
+        assert all(rows == results[0][0] for rows, _ in results)
+        assert sum(1 for _, shared in results if shared) == 9
+
+        stats = flight.snapshot()
+        print(f"✅ {stats['requests']} requêtes, {stats['executions']} exécution")
+        print(f"✅ Ratio de regroupement: {stats['coalescing_ratio']:.0%}")
+        assert stats['in_flight'] == 0
+
+        # Une fois l'exécution terminée, la clé n'est plus partagée
+        flight.do(("pharmacie de garde", (), "ebvnkvz"), slow_query)
+        assert len(executions) == 2
+        print("✅ Aucun résultat conservé après l'exécution")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Erreur lors du test de regroupement: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_errors_propagate_to_waiters():
+    """Une erreur de l'exécution partagée est remontée à tous les appelants"""
+    print("\n💥 TEST DE PROPAGATION DES ERREURS")
+    print("=" * 60)
+
+    try:
+        from backend.singleflight import SingleFlight
+
+        flight = SingleFlight()
+        errors = []
+
+        def failing_query():
+            time.sleep(0.1)
+            raise TimeoutError("base de données indisponible")
+
+        def caller():
+            try:
+                flight.do("restaurant terrasse", failing_query)
+            except TimeoutError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=caller) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(errors) == 5
+        assert flight.in_flight == 0
+        print("✅ Erreur remontée à tous les appelants")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Erreur lors du test de propagation: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def main():
+    """Fonction principale de test"""
+    print("🚀 TEST DU SINGLEFLIGHT")
+    print("=" * 80)
+
+    tests = [
+        ("Regroupement des exécutions", test_concurrent_calls_share_execution),
+        ("Propagation des erreurs", test_errors_propagate_to_waiters)
+    ]
+
+    results = []
+
+    for test_name, test_func in tests:
+        print(f"\n{'='*20} {test_name.upper()} {'='*20}")
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur critique dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    # Résumé des résultats
+    print("\n\n📊 RÉSUMÉ DES TESTS")
+    print("=" * 80)
+
+    passed = 0
+    total = len(results)
+
+    for test_name, result in results:
+        status = "✅ RÉUSSI" if result else "❌ ÉCHOUÉ"
+        print(f"{test_name}: {status}")
+        if result:
+            passed += 1
+
+    print(f"\n🎯 RÉSULTAT GLOBAL: {passed}/{total} tests réussis")
+
+if __name__ == "__main__":
+    main()